@@ -2,8 +2,12 @@
 
 # wrapper script for running the ibis application in a docker container
 
-# gather the static resources
-./manage.py collectstatic
+# the static resources are collected when the image is built, see the Dockerfile
 
-# run the app
-exec waitress-serve --listen 0.0.0.0:8000 ibis.wsgi:application
+# run the app, over WSGI with pre-forked waitress workers (the default) or over ASGI with uvicorn;
+# see python -m ibis.server --help for the SERVER_* variables that tune the WSGI server
+if [ "$SERVER_INTERFACE" = "asgi" ]; then
+    exec uvicorn --host 0.0.0.0 --port 8000 --lifespan off ibis.asgi:application
+else
+    exec python -m ibis.server
+fi
@@ -1,14 +1,57 @@
+import re
+from functools import cached_property
+
 from django.contrib import admin
+from django.core.paginator import Paginator
 
-from .models import Book, Person, Credit, Series, SeriesMembership, Tag, Collection
+from .models import Book, Person, Credit, Series, SeriesMembership, Tag, Collection, Category, ClassifierTask, \
+    OpenLibraryEdition, SavedSearch, SlowQuery
+from .utils import estimated_count
 
 
-class PersonAdmin(admin.ModelAdmin):
-    search_fields = ['name']
+class EstimatedCountPaginator(Paginator):
+    """Takes the number of objects in an unfiltered change list from the
+    database's table statistics instead of counting the rows, which takes
+    long for a large table; filtered change lists are still counted."""
+
+    # tables estimated to have fewer rows than this are counted
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is None or estimate < self.threshold:
+            return super().count
+        return estimate
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin for a model with many rows: no full count next to the count of
+    search results, estimated counts, and ordered autocomplete results."""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # both the change list and autocomplete results come through here
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if not queryset.ordered:
+            # autocomplete results aren't ordered otherwise; the change list orders them itself
+            queryset = queryset.order_by('-pk')
+        return queryset, may_have_duplicates
 
 
-class TagAdmin(admin.ModelAdmin):
-    search_fields = ['value']
+# search fields are prefix matches ("^"), which can use an index, unlike the default "contains"
+
+class PersonAdmin(LargeTableAdmin):
+    list_display = ['name', 'sort_name']
+    search_fields = ['^name', '^sort_name']
+
+
+class TagAdmin(LargeTableAdmin):
+    list_display = ['value', 'namespace']
+    list_filter = ['namespace']
+    search_fields = ['^value']
 
 
 class CreditInline(admin.TabularInline):
@@ -16,6 +59,10 @@ class CreditInline(admin.TabularInline):
     extra = 1
     autocomplete_fields = ['person']
 
+    def get_queryset(self, request):
+        # for the credits' __str__()
+        return super().get_queryset(request).select_related('person', 'book')
+
 
 class TaggingInline(admin.StackedInline):
     model = Book.tags.through
@@ -23,24 +70,92 @@ class TaggingInline(admin.StackedInline):
     autocomplete_fields = ['tag']
 
 
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(LargeTableAdmin):
     fields = ['title', 'subtitle', 'isbn', 'format', 'publisher', 'publication_date']
     inlines = [CreditInline, TaggingInline]
-    search_fields = ['title']
+    list_display = ['__str__', 'publisher', 'publication_date', 'format', 'isbn']
+    search_fields = ['^title']
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Django sends no signals for the rows of Book.tags.through, which the tags inline saves and
+        # deletes itself, so this does what catalog.signals does when tags are added or removed
+        if any(formset.model is Book.tags.through and formset.has_changed() for formset in formsets):
+            Category.update_for([form.instance.id])
+            SavedSearch.update_for([form.instance.id], 'tags')
+
+    def get_search_results(self, request, queryset, search_term):
+        # an ISBN is looked up exactly, through the index on isbn
+        if re.fullmatch(r'\d{9}[\dXx]|\d{13}', search_term.strip()):
+            return queryset.filter(isbn=search_term.strip()), False
+        return super().get_search_results(request, queryset, search_term)
 
 
 class SeriesMembershipInline(admin.TabularInline):
     model = SeriesMembership
     autocomplete_fields = ['book']
 
+    def get_queryset(self, request):
+        # for the memberships' __str__()
+        return super().get_queryset(request).select_related('series')
 
-class SeriesAdmin(admin.ModelAdmin):
+
+class SeriesAdmin(LargeTableAdmin):
     fields = ['title']
     inlines = [SeriesMembershipInline]
+    search_fields = ['^title']
 
 
 class CollectionAdmin(admin.ModelAdmin):
-    fields = ['title']
+    fields = ['title', 'books']
+    autocomplete_fields = ['books']
+
+
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ['name', 'any_tags', 'no_tags', 'role']
+    fields = ['name', 'any_tags', 'no_tags', 'role']
+
+
+class SavedSearchAdmin(admin.ModelAdmin):
+    list_display = ['name', 'query']
+    fields = ['name', 'query']
+    search_fields = ['name']
+
+
+class ClassifierTaskAdmin(admin.ModelAdmin):
+    list_display = ['book', 'attempts', 'next_attempt', 'error']
+    list_select_related = ['book']
+    readonly_fields = ['book']
+    fields = ['book', 'attempts', 'next_attempt', 'error']
+
+
+class OpenLibraryEditionAdmin(LargeTableAdmin):
+    """The editions loaded from an Open Library dump, which is where they are changed."""
+    list_display = ['isbn', 'title', 'publisher', 'publish_date', 'physical_format']
+    search_fields = ['=isbn']
+    readonly_fields = ['isbn', 'title', 'subtitle', 'authors', 'publisher', 'publish_date', 'physical_format']
+    fields = readonly_fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ['captured_at', 'duration', 'view', 'filters', 'alias']
+    list_filter = ['view', 'alias']
+    search_fields = ['filters', 'path', 'sql']
+    readonly_fields = ['captured_at', 'duration', 'alias', 'view', 'path', 'filters', 'sql', 'params', 'plan']
+    fields = readonly_fields
+    date_hierarchy = 'captured_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 # Register your models here.
@@ -49,3 +164,8 @@ admin.site.register(Person, PersonAdmin)
 admin.site.register(Series, SeriesAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Collection, CollectionAdmin)
+admin.site.register(Category, CategoryAdmin)
+admin.site.register(SavedSearch, SavedSearchAdmin)
+admin.site.register(ClassifierTask, ClassifierTaskAdmin)
+admin.site.register(OpenLibraryEdition, OpenLibraryEditionAdmin)
+admin.site.register(SlowQuery, SlowQueryAdmin)
@@ -0,0 +1,286 @@
+"""
+Scenario benchmarks for the catalog views.
+
+Each scenario is a function that takes a ``BenchmarkContext`` and makes one
+request (or one unit of work); the ``benchmark`` management command runs
+every scenario a number of times and reports timings and query counts. The
+scenarios run against whatever catalog is in the configured database, so
+generate one first with the ``generate_catalog`` command.
+
+Scenarios that write to the database run inside a transaction that is
+rolled back, and outbound metadata services are replaced with stubs, so
+the catalog is left unchanged and no network access is needed.
+
+Besides the timings, each scenario is run once more while tracing memory
+allocations, for the peak memory it allocates.
+"""
+
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager, ExitStack
+from typing import AsyncIterable, Callable, Iterator
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.listing import ROW_FIELDS, book_rows
+from catalog.models import Book, Person, Credit, CoverImage
+from catalog.openlibrary import OpenLibraryClient
+from catalog.synthetic import isbn13
+from catalog.views import PAGE_SIZE
+
+SCENARIOS: dict[str, Callable[['BenchmarkContext'], None]] = {}
+
+
+def scenario(name: str):
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+STUB_METADATA = {
+    'ISBN-13': '',
+    'Title': 'A Stubbed Book - For Benchmarking',
+    'Authors': ['Stub Author', 'Second Stub'],
+    'Publisher': 'Benchmark Press',
+    'Year': '2001',
+}
+
+
+async def stub_metadata(self, isbn):
+    return dict(STUB_METADATA)
+
+
+async def stub_physical_format(self, isbn):
+    return 'paperback'
+
+
+async def stub_cover_available(self, url):
+    return False
+
+
+@contextmanager
+def stubbed_services():
+    """Replace the Open Library and classifier lookups with local stubs."""
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.object(CoverImage, 'is_available', False))
+        stack.enter_context(mock.patch.object(OpenLibraryClient, 'metadata', stub_metadata))
+        stack.enter_context(mock.patch.object(OpenLibraryClient, 'physical_format', stub_physical_format))
+        stack.enter_context(mock.patch.object(OpenLibraryClient, 'cover_available', stub_cover_available))
+        # read streamed imports in this thread, where their writes are rolled back with the scenario
+        stack.enter_context(mock.patch('catalog.views.sync_iterator', buffered))
+        yield
+
+
+def buffered(chunks: AsyncIterable) -> Iterator:
+    async def read():
+        return [chunk async for chunk in chunks]
+    yield from async_to_sync(read)()
+
+
+class BenchmarkContext:
+    def __init__(self):
+        self.client = Client()
+        book_count = Book.objects.count()
+        book_ids = Book.objects.order_by('id').values_list('id', flat=True)
+        self.book_id = book_ids[book_count // 2]
+        self.book_ids = list(book_ids[:100])
+        common_author = Person.objects.filter(credit__role=Credit.Role.AUTHOR) \
+            .annotate(book_count=Count('credit')).order_by('-book_count').first()
+        self.author_name = common_author.name if common_author else ''
+        self.num_pages = max(1, (book_count + PAGE_SIZE - 1) // PAGE_SIZE)
+        self.isbn_counter = 0
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        assert response.status_code == 200, f'{url} returned {response.status_code}'
+        return response
+
+    def post(self, url, data):
+        response = self.client.post(url, data)
+        assert response.status_code in (200, 302, 303), f'{url} returned {response.status_code}'
+        if response.streaming:
+            # the work of a streamed response is done while it's read
+            b''.join(response.streaming_content)
+        return response
+
+    def next_isbns(self, count):
+        # use the 979 prefix so these never collide with generated books
+        start = self.isbn_counter
+        self.isbn_counter += count
+        return [isbn13(i, prefix='979') for i in range(start, start + count)]
+
+
+INDEX_FILTER_SETS = {
+    'unfiltered': {},
+    'format': {'format': 'paperback'},
+    'tag': {'tag': 'novel'},
+    'title-contains': {'title~': 'night'},
+    'publisher-prefix': {'publisher^': 'pen'},
+    'category-fiction': {'category': 'fiction'},
+    'category-non-fiction': {'category': 'non-fiction'},
+    'category-translated-hardcover': {'category': 'translated', 'format': 'hardcover'},
+    'search': {'q': 'garden'},
+}
+
+for _name, _params in INDEX_FILTER_SETS.items():
+    def _index_scenario(ctx: BenchmarkContext, params=_params):
+        ctx.get(reverse('index'), **params)
+    scenario(f'index-{_name}')(_index_scenario)
+
+
+@scenario('index-author')
+def index_author(ctx: BenchmarkContext):
+    ctx.get(reverse('index'), author=ctx.author_name)
+
+
+@scenario('index-author-tag')
+def index_author_tag(ctx: BenchmarkContext):
+    ctx.get(reverse('index'), author=ctx.author_name, tag='novel')
+
+
+@scenario('index-page-middle')
+def index_page_middle(ctx: BenchmarkContext):
+    ctx.get(reverse('index'), page=ctx.num_pages // 2)
+
+
+@scenario('index-page-last')
+def index_page_last(ctx: BenchmarkContext):
+    ctx.get(reverse('index'), page=ctx.num_pages)
+
+
+# long pages of the index, where the cost of building and rendering each listed book dominates
+for _page_size in (100, 1000):
+    def _index_page_size_scenario(ctx: BenchmarkContext, page_size=_page_size):
+        with mock.patch('catalog.views.PAGE_SIZE', page_size):
+            ctx.get(reverse('index'))
+    scenario(f'index-page-size-{_page_size}')(_index_page_size_scenario)
+
+    # only reading the listed books, without the rest of the request
+    def _listing_scenario(ctx: BenchmarkContext, page_size=_page_size):
+        book_rows(Book.objects.order_by('id').values_list(*ROW_FIELDS)[:page_size])
+    scenario(f'listing-{_page_size}')(_listing_scenario)
+
+
+@scenario('book')
+def book(ctx: BenchmarkContext):
+    ctx.get(reverse('show_book', args=[ctx.book_id]))
+
+
+@scenario('book-cover')
+def book_cover(ctx: BenchmarkContext):
+    ctx.get(reverse('book_cover', args=[ctx.book_id]))
+
+
+@scenario('bulk-tag-10')
+def bulk_tag_10(ctx: BenchmarkContext):
+    with rolled_back():
+        ctx.post(reverse('index'), {'action': 'tag', 'tag': 'benchmark', 'book_id': ctx.book_ids[:10]})
+
+
+@scenario('bulk-tag-100')
+def bulk_tag_100(ctx: BenchmarkContext):
+    with rolled_back():
+        ctx.post(reverse('index'), {'action': 'tag', 'tag': 'benchmark', 'book_id': ctx.book_ids[:100]})
+
+
+@scenario('bulk-edit-form-25')
+def bulk_edit_form(ctx: BenchmarkContext):
+    ctx.get(reverse('bulk_edit_books'), book_id=ctx.book_ids[:25], redirect=reverse('index'))
+
+
+@scenario('bulk-edit-save-25')
+def bulk_edit_save(ctx: BenchmarkContext):
+    books = Book.objects.filter(id__in=ctx.book_ids[:25])
+    data = {
+        'book_id': [b.id for b in books],
+        'title': [b.title for b in books],
+        'subtitle': [b.subtitle for b in books],
+        'publisher': [b.publisher for b in books],
+        'publication_date': [b.publication_date for b in books],
+        'redirect': reverse('index'),
+    }
+    with rolled_back():
+        ctx.post(reverse('bulk_edit_books'), data)
+
+
+@scenario('isbn-import-1')
+def isbn_import_1(ctx: BenchmarkContext):
+    with rolled_back():
+        ctx.post(reverse('import_by_isbn'), {'isbn': ctx.next_isbns(1)[0]})
+
+
+@scenario('isbn-import-20')
+def isbn_import_20(ctx: BenchmarkContext):
+    with rolled_back():
+        ctx.post(reverse('import_by_isbn'), {'isbns': '\n'.join(ctx.next_isbns(20))})
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def run_scenario(func: Callable[[BenchmarkContext], None], ctx: BenchmarkContext, repeat: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        func(ctx)
+
+    timings = []
+    query_counts = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func(ctx)
+            timings.append((time.perf_counter() - start) * 1000)
+        query_counts.append(len(queries))
+
+    tracemalloc.start()
+    try:
+        func(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(query_counts),
+        'peak_alloc_kb': round(peak / 1024),
+    }
+
+
+def run(names: list[str], repeat: int = 10, warmup: int = 2, progress: Callable[[str], None] = None) -> dict:
+    results = {}
+    with stubbed_services():
+        ctx = BenchmarkContext()
+        for name in names:
+            if progress is not None:
+                progress(name)
+            results[name] = run_scenario(SCENARIOS[name], ctx, repeat, warmup)
+    return results
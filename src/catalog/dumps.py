@@ -0,0 +1,141 @@
+"""
+Loading Open Library bulk dumps into local lookup tables.
+
+Open Library publishes dumps of all its records
+(https://openlibrary.org/developers/dumps), as gzipped text files with one
+record per line: its type, key, revision, last modification time and the
+record as JSON, separated by tabs. The ``load_openlibrary_dump`` command
+streams an authors dump into ``OpenLibraryAuthor`` and then an editions
+dump into ``OpenLibraryEdition``, keeping only the fields that imports use.
+Editions are stored once for each of their ISBNs, as ISBN-13, with the
+names of their authors, so that looking up an ISBN is a single query on
+the primary key.
+
+Loading a dump again updates the records that were loaded before, so a
+newer dump can be loaded over an older one. The authors dump has to be
+loaded before the editions dump, whose authors are named from it.
+"""
+
+import gzip
+import json
+import logging
+from typing import Iterator
+
+from catalog import metadata
+from catalog.models import OpenLibraryAuthor, OpenLibraryEdition
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# the fields of OpenLibraryEdition that are updated when an ISBN is loaded again
+EDITION_FIELDS = ['title', 'subtitle', 'authors', 'publisher', 'publish_date', 'physical_format']
+
+
+def read_records(path: str, record_type: str, marker: str = '') -> Iterator[dict]:
+    """The records of the given type, such as "/type/edition", in a dump file,
+    which is read a line at a time and decompressed if its name ends with ".gz".
+
+    Only lines that contain ``marker`` are parsed, which saves parsing records
+    that would be skipped anyway."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            columns = line.split('\t', 4)
+            if len(columns) < 5 or columns[0] != record_type or marker not in columns[4]:
+                continue
+            try:
+                yield json.loads(columns[4])
+            except ValueError:
+                logger.warning('Skipping a record that is not valid JSON: %s', columns[1])
+
+
+def key_id(key: str) -> str:
+    """The identifier in a key such as "/authors/OL23919A"."""
+    return key.rsplit('/', 1)[-1]
+
+
+def text(value, max_length: int) -> str:
+    return value[:max_length] if isinstance(value, str) else ''
+
+
+def load_authors(path: str, batch_size: int = BATCH_SIZE) -> int:
+    def save(batch: dict):
+        OpenLibraryAuthor.objects.bulk_create(
+            batch.values(), update_conflicts=True, unique_fields=['key'], update_fields=['name'],
+        )
+
+    count = 0
+    batch = {}
+    for record in read_records(path, '/type/author', '"name"'):
+        name = text(record.get('name'), 256)
+        if not name:
+            continue
+        author = OpenLibraryAuthor(key=key_id(record['key']), name=name)
+        batch[author.key] = author
+        if len(batch) == batch_size:
+            save(batch)
+            count += len(batch)
+            batch = {}
+            logger.debug('Loaded %d authors', count)
+    save(batch)
+    return count + len(batch)
+
+
+def edition_isbns(record: dict) -> set[str]:
+    isbns = set()
+    for isbn in record.get('isbn_13', []) + record.get('isbn_10', []):
+        isbn = metadata.to_isbn13(isbn) if isinstance(isbn, str) else ''
+        if isbn:
+            isbns.add(isbn)
+    return isbns
+
+
+def author_keys(record: dict) -> list[str]:
+    keys = []
+    for author in record.get('authors', []):
+        # the authors of editions are {"key": ...}, or (in older records) {"author": {"key": ...}}
+        if isinstance(author, dict):
+            author = author.get('author', author)
+        if isinstance(author, dict) and isinstance(author.get('key'), str):
+            keys.append(key_id(author['key']))
+    return keys
+
+
+def save_editions(records: list[dict]) -> int:
+    """Store a batch of edition records, naming their authors with one query."""
+    names = dict(OpenLibraryAuthor.objects.filter(
+        key__in={key for record in records for key in author_keys(record)},
+    ).values_list('key', 'name'))
+    editions = {}
+    for record in records:
+        publishers = record.get('publishers') or ['']
+        fields = {
+            'title': text(record.get('title'), 1024),
+            'subtitle': text(record.get('subtitle'), 1024),
+            'authors': [names[key] for key in author_keys(record) if key in names],
+            'publisher': text(publishers[0], 256),
+            'publish_date': text(record.get('publish_date'), 32),
+            'physical_format': text(record.get('physical_format'), 64),
+        }
+        for isbn in edition_isbns(record):
+            editions[isbn] = OpenLibraryEdition(isbn=isbn, **fields)
+    OpenLibraryEdition.objects.bulk_create(
+        editions.values(), update_conflicts=True, unique_fields=['isbn'], update_fields=EDITION_FIELDS,
+    )
+    return len(editions)
+
+
+def load_editions(path: str, batch_size: int = BATCH_SIZE) -> int:
+    count = 0
+    batch = []
+    # editions without an ISBN can't be looked up, so they aren't parsed
+    for record in read_records(path, '/type/edition', '"isbn_'):
+        if not record.get('title'):
+            continue
+        batch.append(record)
+        if len(batch) == batch_size:
+            count += save_editions(batch)
+            batch = []
+            logger.debug('Loaded %d ISBNs', count)
+    return count + save_editions(batch)
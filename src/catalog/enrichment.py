@@ -0,0 +1,180 @@
+"""
+Background tagging of books with their classifiers.
+
+Looking up the classifiers of an ISBN (``metadata.classifier_tags()``) is
+slow, and the classifier service is often down, so imports don't wait for
+it: they queue the new book as a ``ClassifierTask`` instead. The
+``enrich_classifiers`` command works through the queue in batches:
+
+- the ISBNs of a batch are looked up concurrently, each from the cache if it
+  was looked up recently, and failed lookups are retried with exponential
+  backoff;
+- the tags of the whole batch are added with a few set-based queries;
+- the tasks of books that couldn't be looked up stay in the queue, to be
+  tried again after a delay that doubles with every failed attempt.
+"""
+
+import logging
+import random
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from catalog import metadata, upstream
+from catalog.models import Book, Category, ClassifierTask, SavedSearch, Tag
+
+logger = logging.getLogger(__name__)
+
+# how long looked up classifiers are cached, in seconds
+CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+@dataclass
+class Options:
+    batch_size: int = 50
+    # concurrent lookups
+    workers: int = 4
+    # retries of a failed lookup, and the delay before the first of them, in seconds
+    retries: int = 2
+    backoff: float = 1.0
+    # delay before a failed task is tried again by a later batch or run, in seconds
+    retry_delay: float = 15 * 60
+    # tasks that failed this many times are left in the queue for inspection
+    max_attempts: int = 5
+
+
+@dataclass
+class Result:
+    tagged: int = 0
+    failed: int = 0
+
+
+def enqueue_missing() -> int:
+    """Queue all books with an ISBN that have no classifier tags and aren't queued yet."""
+    classifier_tags = Book.tags.through.objects.filter(book=OuterRef('pk')).exclude(tag__namespace='')
+    books = Book.objects.exclude(isbn='').filter(
+        ~Exists(classifier_tags),
+        ~Exists(ClassifierTask.objects.filter(book=OuterRef('pk'))),
+    )
+    tasks = ClassifierTask.objects.bulk_create(
+        (ClassifierTask(book_id=book_id) for book_id in books.values_list('id', flat=True).iterator()),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    return len(tasks)
+
+
+def classify(isbn: str, retries: int, backoff: float) -> list[str]:
+    """The classifier tags of an ISBN, from the cache or looked up."""
+    key = f'classifiers:{isbn}'
+    tags = cache.get(key)
+    if tags is not None:
+        return tags
+    for attempt in range(retries + 1):
+        try:
+            tags = metadata.classifier_tags(isbn)
+            break
+        except metadata.ServiceError as e:
+            # a rejected lookup would be rejected again while the service's circuit is open
+            if attempt == retries or isinstance(e, upstream.RejectedError):
+                raise
+            # with jitter, so the workers of a batch don't all retry at the same moment
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.debug('Looking up classifiers for %s failed (%s), retrying in %.1f s', isbn, e, delay)
+            time.sleep(delay)
+    cache.set(key, tags, CACHE_TIMEOUT)
+    return tags
+
+
+def add_tags(tags_by_book: dict[int, list[str]]):
+    """Tag books with the tags written as the given texts, creating the tags that don't exist."""
+    fields_by_text = {text: Tag.parse(text) for texts in tags_by_book.values() for text in texts}
+    if not fields_by_text:
+        return
+    tag_ids = {
+        (tag.namespace, tag.value): tag.id
+        for tag in Tag.objects.filter(Tag.matching(fields_by_text)).only('namespace', 'value')
+    }
+    new_tags = Tag.objects.bulk_create(
+        Tag(**fields) for fields in {(f['namespace'], f['value']): f for f in fields_by_text.values()}.values()
+        if (fields['namespace'], fields['value']) not in tag_ids
+    )
+    tag_ids.update({(tag.namespace, tag.value): tag.id for tag in new_tags})
+
+    Book.tags.through.objects.bulk_create(
+        (
+            Book.tags.through(book_id=book_id, tag_id=tag_ids[fields['namespace'], fields['value']])
+            for book_id, texts in tags_by_book.items()
+            for fields in map(fields_by_text.get, set(texts))
+        ),
+        ignore_conflicts=True,
+    )
+    # bulk_create() doesn't send the signals that keep the categories and saved searches up to date
+    Category.update_for(tags_by_book)
+    SavedSearch.update_for(tags_by_book, 'tags')
+
+
+def process(tasks: list[ClassifierTask], executor: Executor, options: Options) -> Result:
+    futures = {task: executor.submit(classify, task.book.isbn, options.retries, options.backoff) for task in tasks}
+
+    tags_by_book = {}
+    failed = []
+    now = timezone.now()
+    for task, future in futures.items():
+        try:
+            tags_by_book[task.book_id] = future.result()
+        except metadata.ServiceError as e:
+            task.attempts += 1
+            task.next_attempt = now + timedelta(seconds=options.retry_delay * 2 ** (task.attempts - 1))
+            task.error = str(e)
+            failed.append(task)
+            logger.warning('Could not look up classifiers for %s (attempt %d): %s', task.book.isbn, task.attempts, e)
+        except Exception as e:
+            # such as an invalid ISBN, which would fail the same way every time; the task is left
+            # in the queue for inspection, rather than holding up the others
+            task.attempts = max(task.attempts + 1, options.max_attempts)
+            task.error = f'{type(e).__name__}: {e}'
+            failed.append(task)
+            logger.warning('Could not classify %s: %s', task.book.isbn, task.error)
+
+    with transaction.atomic():
+        add_tags(tags_by_book)
+        ClassifierTask.objects.filter(book_id__in=tags_by_book).delete()
+        ClassifierTask.objects.bulk_update(failed, ['attempts', 'next_attempt', 'error'])
+
+    return Result(tagged=len(tags_by_book), failed=len(failed))
+
+
+def due_tasks(until: datetime, max_attempts: int):
+    return (
+        ClassifierTask.objects
+        .filter(next_attempt__lte=until, attempts__lt=max_attempts)
+        .select_related('book')
+        .order_by('next_attempt')
+    )
+
+
+def run(options: Options = None, limit: int = None) -> Result:
+    """Work through the tasks that are due, at most ``limit`` of them."""
+    if options is None:
+        options = Options()
+    total = Result()
+    # tasks that fail are rescheduled after this, so a run doesn't pick them up again
+    started = timezone.now()
+    with ThreadPoolExecutor(options.workers) as executor:
+        while limit is None or total.tagged + total.failed < limit:
+            size = options.batch_size if limit is None else min(options.batch_size, limit - total.tagged - total.failed)
+            tasks = list(due_tasks(started, options.max_attempts)[:size])
+            if not tasks:
+                break
+            result = process(tasks, executor, options)
+            total.tagged += result.tagged
+            total.failed += result.failed
+            logger.info('Classified %d books, %d failed', total.tagged, total.failed)
+    return total
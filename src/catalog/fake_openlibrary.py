@@ -0,0 +1,113 @@
+"""
+A local stand-in for the Open Library services that the catalog calls.
+
+It answers the books API used for ISBN metadata, the edition JSON used to
+look up a book's format, and cover image requests, with records derived
+deterministically from the ISBN. Point ``OPENLIBRARY_URL`` and
+``OPENLIBRARY_COVERS_URL`` at it to run imports and load tests offline.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+WORDS = [
+    'Autumn', 'Bridge', 'City', 'Dark', 'Dream', 'Empire', 'Fire', 'Garden', 'Glass', 'House',
+    'Island', 'Journey', 'Light', 'Memory', 'Moon', 'Night', 'River', 'Salt', 'Shadow', 'Stone',
+]
+NAMES = ['Ada Abbott', 'Jorge Borges', 'Clara Conrad', 'Edith Duras', 'Franz Eliot', 'Grace Hardy', 'Karl Mann']
+PUBLISHERS = ['Penguin', 'Vintage', 'Knopf', 'New Directions', 'Dover']
+FORMATS = ['Paperback', 'Hardcover', 'Mass Market Paperback']
+
+# the smallest valid JPEG header, enough to count as an image
+COVER_IMAGE = bytes.fromhex('ffd8ffe000104a46494600010100000100010000ffd9')
+
+
+def digest(isbn: str) -> bytes:
+    return hashlib.sha256(isbn.encode()).digest()
+
+
+def edition_record(isbn: str) -> dict:
+    """The books API (``jscmd=data``) record for an ISBN."""
+    d = digest(isbn)
+    title = ' '.join(WORDS[b % len(WORDS)] for b in d[:1 + d[0] % 3])
+    record = {
+        'title': f'The {title}',
+        'authors': [{'name': NAMES[b % len(NAMES)]} for b in d[4:5 + d[3] % 2]],
+        'publishers': [{'name': PUBLISHERS[d[6] % len(PUBLISHERS)]}],
+        'publish_date': str(1900 + d[7] % 125),
+    }
+    if d[8] % 4 == 0:
+        record['subtitle'] = 'A Novel'
+    return record
+
+
+def has_cover(isbn: str) -> bool:
+    return digest(isbn)[9] % 2 == 0
+
+
+class FakeOpenLibraryHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeOpenLibrary/1.0'
+    latency = 0.0
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body: bool):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(self.path)
+
+        if url.path in ('/api/books', '/api/books.json'):
+            bibkeys = parse_qs(url.query).get('bibkeys', [''])[0].split(',')
+            data = {key: edition_record(key.removeprefix('ISBN:')) for key in bibkeys if key}
+            return self.respond_json(data, send_body)
+
+        if m := re.fullmatch(r'/isbn/(\w+)\.json', url.path):
+            isbn = m[1]
+            record = edition_record(isbn)
+            return self.respond_json({
+                'title': record['title'],
+                'isbn_13': [isbn],
+                'physical_format': FORMATS[digest(isbn)[10] % len(FORMATS)],
+            }, send_body)
+
+        if (m := re.fullmatch(r'/b/isbn/(\w+)-[SML]\.jpg', url.path)) and has_cover(m[1]):
+            return self.respond(200, 'image/jpeg', COVER_IMAGE, send_body)
+
+        self.respond(404, 'text/plain', b'Not found', send_body)
+
+    def respond_json(self, data, send_body: bool):
+        self.respond(200, 'application/json', json.dumps(data).encode(), send_body)
+
+    def respond(self, status: int, content_type: str, body: bytes, send_body: bool):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host: str = '127.0.0.1', port: int = 0, latency: float = 0.0) -> ThreadingHTTPServer:
+    """Create a fake Open Library server; ``latency`` is added to every response, in seconds."""
+    handler = type('Handler', (FakeOpenLibraryHandler,), {'latency': latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(host: str = '127.0.0.1', port: int = 0, latency: float = 0.0) -> ThreadingHTTPServer:
+    server = make_server(host, port, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,53 @@
+"""
+The filters of the book index, such as ``tag=poetry`` or ``publisher^=Penguin``.
+
+Each filter parameter has a template, which makes the condition on books
+for a value of the parameter. The index and saved searches (see
+``SavedSearch``) build their conditions from these.
+"""
+
+from django.db.models import Q
+
+from catalog.models import Book, Category, Credit, SavedSearch, SeriesMembership
+from catalog.utils import RelatedFilter, combine, filter_group, range_filter_group
+
+# filters on the books' credits, tags and series, as EXISTS subqueries
+CREDITS = RelatedFilter(Credit, 'book')
+TAGS = RelatedFilter(Book.tags.through, 'book')
+SERIES = RelatedFilter(SeriesMembership, 'book')
+
+# membership of the categories, stored and kept up to date by catalog.signals
+CATEGORIES = RelatedFilter(Category.books.through, 'book')
+
+# the books matching saved searches, also stored and kept up to date by catalog.signals
+SAVED_SEARCHES = RelatedFilter(SavedSearch.books.through, 'book')
+
+FILTER_TEMPLATES = {
+    'category': lambda value: CATEGORIES(category__name=value),
+    'format': lambda value: Q(format=value),
+    'publication_date': lambda value: Q(publication_date=value),
+    'isbn': lambda value: Q(isbn=value),
+    'q': lambda value: Q(title__icontains=value) | CREDITS(person__name__icontains=value),
+    **filter_group('title'),
+    **filter_group('publisher'),
+    **filter_group('series', 'series__title', related=SERIES),
+    **filter_group('tag', 'tag__value', related=TAGS, namespace_field='tag__namespace'),
+    **range_filter_group('year', 'publication_year'),
+    **combine(filter_group(role, value_field='person__name', related=CREDITS, role=role) for role in Credit.Role.values)
+}
+
+# what the filters depend on, by parameter name without the operator, besides the books'
+# own fields ("book"): their "credits", "tags", "series" or "categories"; saved searches
+# are updated when that changes (see SavedSearch.update_for())
+FILTER_DEPENDENCIES = {
+    # the categories in turn depend on the tags and credits of the books
+    'category': {'categories', 'tags', 'credits'},
+    'q': {'book', 'credits'},
+    'series': {'series'},
+    'tag': {'tags'},
+    **{role: {'credits'} for role in Credit.Role.values},
+}
+
+
+def dependencies(param_name: str) -> set[str]:
+    return FILTER_DEPENDENCIES.get(param_name.rstrip('~^$<>'), {'book'})
@@ -0,0 +1,63 @@
+"""
+Lightweight rows for listing books in the index.
+
+A page of the index shows a dozen fields of each book with its credits,
+plain tags and series. Building ``Book`` instances for that carries the
+full model state of each book, and their credits, tags and series were
+queried book by book. Instead, the books of a page are read as tuples into
+``BookRow`` objects, which have ``__slots__`` and only the listed fields,
+and their credits, tags and series are read for the whole page with one
+query each.
+"""
+
+from collections import defaultdict
+from typing import Iterable, NamedTuple
+
+from catalog.models import Book, Credit, SeriesMembership
+
+# the fields of the books read into the rows, in the order of BookRow's parameters
+ROW_FIELDS = ('id', 'title', 'subtitle', 'publication_date', 'publisher', 'format', 'isbn')
+
+
+class ListedSeries(NamedTuple):
+    title: str
+    order: int
+
+
+class BookRow:
+    __slots__ = (*ROW_FIELDS, 'credits', 'tags', 'series')
+
+    def __init__(self, id, title, subtitle, publication_date, publisher, format, isbn):
+        self.id = id
+        self.title = title
+        self.subtitle = subtitle
+        self.publication_date = publication_date
+        self.publisher = publisher
+        self.format = format
+        self.isbn = isbn
+        # the names of the credited persons by role, such as credits['author']
+        self.credits: dict[str, list[str]] = defaultdict(list)
+        # the values of the plain tags
+        self.tags: list[str] = []
+        self.series: list[ListedSeries] = []
+
+
+def book_rows(books: Iterable[tuple]) -> list[BookRow]:
+    """Rows for books read as tuples of ``ROW_FIELDS``, such as a page of
+    ``Book.objects.values_list(*ROW_FIELDS)``, with their credits, plain tags
+    and series."""
+    rows = {values[0]: BookRow(*values) for values in books}
+
+    credits = Credit.objects.filter(book__in=rows).order_by('order', 'id')
+    for book_id, role, name in credits.values_list('book', 'role', 'person__name'):
+        rows[book_id].credits[role].append(name)
+
+    tags = Book.tags.through.objects.filter(book__in=rows, tag__namespace='').order_by('tag__value')
+    for book_id, value in tags.values_list('book', 'tag__value'):
+        rows[book_id].tags.append(value)
+
+    memberships = SeriesMembership.objects.filter(book__in=rows).order_by('id')
+    for book_id, title, order in memberships.values_list('book', 'series__title', 'order'):
+        rows[book_id].series.append(ListedSeries(title, order))
+
+    return list(rows.values())
@@ -0,0 +1,195 @@
+"""
+Replay a request log against a running ibis instance.
+
+The request log is a JSONL file with one request per line::
+
+    {"method": "GET", "path": "/books/", "query": "tag=novel&page=2"}
+    {"method": "POST", "path": "/books/", "body": {"action": "tag", "tag": "poetry", "book_id": ["{book_id}"]}}
+    {"method": "POST", "path": "/books/isbn_import", "body": {"isbn": "{isbn}"}}
+
+``query`` may also be an object of parameters. String values in ``path``,
+``query`` and ``body`` are templates: ``{book_id}`` is replaced with the id
+of a random book from the catalog, ``{person_id}`` with the id of a random
+person, and ``{isbn}`` with a fresh ISBN-13 that is not in the catalog.
+
+Requests are sent by a pool of worker threads, each with its own session
+(and CSRF token), and the results are summarized per URL name.
+"""
+
+import json
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urlencode
+
+import requests
+from django.urls import resolve, Resolver404
+
+from catalog.benchmarks import percentile
+from catalog.models import Book, Person
+from catalog.synthetic import isbn13
+
+
+def read_log(path: str) -> list[dict]:
+    with open(path) as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def url_name(path: str) -> str:
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return 'unresolved'
+    return match.url_name or match.view_name or path
+
+
+class TemplateValues:
+    """Supplies values for the placeholders in request templates."""
+
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.book_ids = list(Book.objects.values_list('id', flat=True)[:100000])
+        self.person_ids = list(Person.objects.values_list('id', flat=True)[:100000])
+        # fresh ISBNs use the 979 prefix, which generated catalogs do not use
+        self.isbns = (isbn13(i, prefix='979') for i in count(self.rng.randrange(10 ** 8)))
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key == 'book_id':
+                return self.rng.choice(self.book_ids)
+            if key == 'person_id':
+                return self.rng.choice(self.person_ids)
+            if key == 'isbn':
+                return next(self.isbns)
+        raise KeyError(key)
+
+    def fill(self, value):
+        if isinstance(value, str):
+            return value.format_map(self)
+        if isinstance(value, list):
+            return [self.fill(v) for v in value]
+        if isinstance(value, dict):
+            return {k: self.fill(v) for k, v in value.items()}
+        return value
+
+
+@dataclass
+class Result:
+    name: str
+    status: int
+    duration: float
+    error: Optional[str] = None
+
+    @property
+    def failed(self):
+        return self.error is not None or self.status >= 400
+
+
+@dataclass
+class Report:
+    results: list[Result] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def summary(self) -> dict:
+        by_name = defaultdict(list)
+        for result in self.results:
+            by_name[result.name].append(result)
+
+        return {
+            'requests': len(self.results),
+            'elapsed_s': round(self.elapsed, 3),
+            'throughput_rps': round(len(self.results) / self.elapsed, 2) if self.elapsed else 0,
+            'error_rate': round(sum(r.failed for r in self.results) / len(self.results), 4) if self.results else 0,
+            'urls': {name: summarize(results, self.elapsed) for name, results in sorted(by_name.items())},
+        }
+
+
+def summarize(results: list[Result], elapsed: float) -> dict:
+    durations = sorted(r.duration * 1000 for r in results)
+    errors = sum(r.failed for r in results)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4),
+        'throughput_rps': round(len(results) / elapsed, 2) if elapsed else 0,
+        'mean_ms': round(statistics.mean(durations), 2),
+        'p50_ms': round(percentile(durations, 0.5), 2),
+        'p90_ms': round(percentile(durations, 0.9), 2),
+        'p99_ms': round(percentile(durations, 0.99), 2),
+        'max_ms': round(durations[-1], 2),
+    }
+
+
+class Replayer:
+    def __init__(self, base_url: str, values: TemplateValues, timeout: float = 30.0):
+        self.base_url = base_url.rstrip('/')
+        self.values = values
+        self.timeout = timeout
+        self.local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            # pick up a CSRF cookie for the POST requests
+            session.get(self.base_url + '/books/', timeout=self.timeout)
+        return session
+
+    def send(self, entry: dict) -> Result:
+        method = entry.get('method', 'GET').upper()
+        path = self.values.fill(entry['path'])
+        query = self.values.fill(entry.get('query', ''))
+        if isinstance(query, dict):
+            query = urlencode(query, doseq=True)
+        url = self.base_url + path + ('?' + query if query else '')
+        name = url_name(path)
+
+        session = self.session
+        headers = {}
+        if method != 'GET':
+            headers['X-CSRFToken'] = session.cookies.get('csrftoken', '')
+            headers['Referer'] = self.base_url + '/'
+
+        start = time.perf_counter()
+        try:
+            response = session.request(
+                method, url,
+                data=self.values.fill(entry.get('body')),
+                headers=headers,
+                allow_redirects=False,
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            return Result(name, 0, time.perf_counter() - start, error=str(e))
+        return Result(name, response.status_code, time.perf_counter() - start)
+
+
+def replay(entries: Iterable[dict], replayer: Replayer, concurrency: int) -> Report:
+    report = Report()
+    lock = threading.Lock()
+    iterator: Iterator[dict] = iter(entries)
+
+    def worker():
+        while True:
+            with lock:
+                entry = next(iterator, None)
+            if entry is None:
+                return
+            result = replayer.send(entry)
+            with lock:
+                report.results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    report.elapsed = time.perf_counter() - start
+    return report
@@ -0,0 +1,84 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import django
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from catalog import benchmarks
+from catalog.models import Book
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+class Command(BaseCommand):
+    help = 'Run the catalog scenario benchmarks and report the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Scenarios to run (default: all)')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs per scenario')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed runs per scenario')
+        parser.add_argument('--output', '-o', help='Write the results to this file instead of stdout')
+        parser.add_argument('--compare', help='Results file from an earlier run to compare against')
+        parser.add_argument('--list', action='store_true', help='List the available scenarios')
+
+    def handle(self, *args, scenarios, repeat, warmup, output, compare, list, **options):
+        if list:
+            for name in benchmarks.SCENARIOS:
+                self.stdout.write(name)
+            return
+
+        unknown = set(scenarios) - benchmarks.SCENARIOS.keys()
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+        if not Book.objects.exists():
+            raise CommandError('The catalog is empty; create one with the generate_catalog command')
+
+        def progress(name):
+            self.stderr.write(f'Running {name}')
+
+        # the pages render without collecting the static files first
+        with override_settings(ALLOWED_HOSTS=['testserver'], STATIC_MANIFEST_FALLBACK=True):
+            results = benchmarks.run(scenarios or [*benchmarks.SCENARIOS], repeat, warmup, progress)
+
+        report = {
+            'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'books': Book.objects.count(),
+            'results': results,
+        }
+
+        text = json.dumps(report, indent=2)
+        if output:
+            with open(output, 'w') as fh:
+                fh.write(text + '\n')
+        else:
+            self.stdout.write(text)
+
+        if compare:
+            with open(compare) as fh:
+                baseline = json.load(fh)
+            self.write_comparison(baseline, report)
+
+    def write_comparison(self, baseline: dict, report: dict):
+        self.stderr.write(f'{"scenario":<36} {baseline["revision"] or "baseline":>10} {report["revision"] or "current":>10}  change')
+        for name, result in report['results'].items():
+            if name not in baseline['results']:
+                continue
+            before = baseline['results'][name]['median_ms']
+            after = result['median_ms']
+            change = (after - before) / before * 100 if before else 0
+            self.stderr.write(f'{name:<36} {before:>10.2f} {after:>10.2f}  {change:+.1f}%')
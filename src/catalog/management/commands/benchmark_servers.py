@@ -0,0 +1,41 @@
+import json
+import tempfile
+from pathlib import Path
+
+from django.core.management import BaseCommand, call_command
+
+DEFAULT_LOG = Path(__file__).resolve().parent.parent.parent / 'loadtests' / 'upstream-latency.jsonl'
+
+
+class Command(BaseCommand):
+    help = 'Compare WSGI and ASGI throughput with a slow (fake) Open Library'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=str(DEFAULT_LOG), help='JSONL request log to replay')
+        parser.add_argument('--latency', type=float, default=500, help='Open Library latency, in milliseconds')
+        parser.add_argument('--concurrency', '-c', type=int, default=32)
+        parser.add_argument('--loops', type=int, default=10)
+        parser.add_argument('--output', '-o', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, log, latency, concurrency, loops, output, **options):
+        report = {'latency_ms': latency, 'concurrency': concurrency, 'servers': {}}
+        with tempfile.TemporaryDirectory() as tmp:
+            for server in ('wsgi', 'asgi'):
+                result_file = Path(tmp) / f'{server}.json'
+                call_command(
+                    'loadtest', log, serve=server, concurrency=concurrency, loops=loops, shuffle=True,
+                    openlibrary_latency=latency, output=str(result_file),
+                )
+                report['servers'][server] = json.loads(result_file.read_text())
+
+        text = json.dumps(report, indent=2)
+        if output:
+            Path(output).write_text(text + '\n')
+        else:
+            self.stdout.write(text)
+
+        for server, result in report['servers'].items():
+            self.stderr.write(
+                f'{server}: {result["throughput_rps"]} requests/s, error rate {result["error_rate"]:.2%}, '
+                f'started in {result["startup_ms"]:.0f} ms'
+            )
@@ -0,0 +1,50 @@
+from django.core.management import BaseCommand
+
+from catalog import enrichment
+
+
+class Command(BaseCommand):
+    help = 'Tag the queued books with their classifiers'
+
+    def add_arguments(self, parser):
+        defaults = enrichment.Options()
+        parser.add_argument(
+            '--enqueue-missing', action='store_true',
+            help='First queue all books with an ISBN that have no classifier tags',
+        )
+        parser.add_argument('--limit', type=int, help='Maximum number of books to process')
+        parser.add_argument('--batch-size', type=int, default=defaults.batch_size)
+        parser.add_argument('--workers', type=int, default=defaults.workers, help='Number of concurrent lookups')
+        parser.add_argument(
+            '--retries', type=int, default=defaults.retries, help='Number of retries of a failed lookup',
+        )
+        parser.add_argument(
+            '--backoff', type=float, default=defaults.backoff,
+            help='Delay before the first retry of a lookup, in seconds; doubles with every retry',
+        )
+        parser.add_argument(
+            '--retry-delay', type=float, default=defaults.retry_delay,
+            help='Delay before a book that failed is tried again, in seconds; doubles with every attempt',
+        )
+        parser.add_argument(
+            '--max-attempts', type=int, default=defaults.max_attempts,
+            help='Number of attempts after which a book is no longer tried',
+        )
+
+    def handle(self, *args, enqueue_missing, limit, batch_size, workers, retries, backoff, retry_delay,
+               max_attempts, **options):
+        if enqueue_missing:
+            self.stdout.write(f'Queued {enrichment.enqueue_missing()} books')
+
+        result = enrichment.run(
+            enrichment.Options(
+                batch_size=batch_size,
+                workers=workers,
+                retries=retries,
+                backoff=backoff,
+                retry_delay=retry_delay,
+                max_attempts=max_attempts,
+            ),
+            limit=limit,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Tagged {result.tagged} books, {result.failed} failed'))
@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+
+from catalog.fake_openlibrary import make_server
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake Open Library server for offline imports and load tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0, help='Added latency per response, in milliseconds')
+
+    def handle(self, *args, host, port, latency, **options):
+        server = make_server(host, port, latency / 1000)
+        self.stdout.write(f'Fake Open Library listening on http://{host}:{server.server_port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
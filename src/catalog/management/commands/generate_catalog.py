@@ -0,0 +1,197 @@
+import random
+from itertools import accumulate, islice
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from catalog.models import Book, Person, Credit, Tag, Series, SeriesMembership, Category, SavedSearch
+from catalog.synthetic import isbn13
+
+FIRST_NAMES = [
+    'Ada', 'Alan', 'Alice', 'Amos', 'Anna', 'Arthur', 'Beatrice', 'Bernard', 'Carmen', 'Charles',
+    'Clara', 'Daniel', 'Dora', 'Edith', 'Edward', 'Elena', 'Emil', 'Frances', 'Franz', 'George',
+    'Grace', 'Hannah', 'Henry', 'Ida', 'Isaac', 'Jane', 'Jorge', 'Julia', 'Karl', 'Laura',
+    'Leo', 'Lucia', 'Marcel', 'Maria', 'Mark', 'Nadia', 'Nora', 'Oscar', 'Pablo', 'Paul',
+    'Rosa', 'Ruth', 'Samuel', 'Sara', 'Simone', 'Sofia', 'Thomas', 'Ursula', 'Victor', 'Virginia',
+    'Walter', 'Wanda', 'Yusuf', 'Zora',
+]
+
+LAST_NAMES = [
+    'Abbott', 'Achebe', 'Adler', 'Alcott', 'Baldwin', 'Barnes', 'Borges', 'Bowen', 'Calvino', 'Carter',
+    'Chekhov', 'Colette', 'Conrad', 'Cortázar', 'Dickens', 'Duras', 'Eliot', 'Ellison', 'Ferrante', 'Fitzgerald',
+    'Flaubert', 'Forster', 'Gaskell', 'Gogol', 'Grass', 'Greene', 'Hardy', 'Hesse', 'Hughes', 'Hurston',
+    'Ishiguro', 'James', 'Joyce', 'Kafka', 'Kawabata', 'Keller', 'Lessing', 'Lispector', 'Mann', 'Márquez',
+    'Melville', 'Mishima', 'Morrison', 'Munro', 'Nabokov', 'Naipaul', 'Orwell', 'Pamuk', 'Perec', 'Proust',
+    'Pynchon', 'Queneau', 'Rhys', 'Roth', 'Rushdie', 'Sebald', 'Shelley', 'Smith', 'Sontag', 'Stein',
+    'Tanizaki', 'Tolstoy', 'Trollope', 'Twain', 'Undset', 'Updike', 'Vonnegut', 'Walker', 'Waugh', 'Welty',
+    'Wharton', 'Woolf', 'Yeats', 'Yourcenar', 'Zola', 'Zweig',
+]
+
+TITLE_WORDS = [
+    'Autumn', 'Bridge', 'City', 'Country', 'Dark', 'Daughter', 'Death', 'Dream', 'Empire', 'Evening',
+    'Fire', 'Garden', 'Glass', 'Gold', 'History', 'House', 'Hunger', 'Island', 'Journey', 'King',
+    'Light', 'Long', 'Memory', 'Moon', 'Mountain', 'Night', 'Ocean', 'Old', 'Winter', 'River',
+    'Road', 'Salt', 'Secret', 'Shadow', 'Silence', 'Song', 'Stone', 'Storm', 'Summer', 'Time',
+    'Tower', 'Water', 'Wind', 'World', 'Year',
+]
+
+PUBLISHERS = [
+    'Penguin', 'Vintage', 'Knopf', 'Faber & Faber', 'New Directions', 'Farrar, Straus and Giroux',
+    'Random House', 'HarperCollins', 'Simon & Schuster', 'Picador', 'Grove Press', 'Norton',
+    'Oxford University Press', 'Everyman', 'NYRB Classics', 'Graywolf', 'Dover', 'Scribner',
+    'Little, Brown', 'Bloomsbury',
+]
+
+# genre tags first, so they get the highest weights
+TAGS = [
+    'novel', 'short stories', 'history', 'poetry', 'biography', 'essays', 'philosophy', 'science',
+    'comics', 'play', 'memoir', 'travel', 'art', 'politics', 'religion', 'mathematics', 'music',
+    'cooking', 'reference', 'letters', 'criticism', 'economics', 'nature', 'mythology', 'film',
+]
+
+CLASSIFIER_TAGS = ['ddc:813.54', 'ddc:823.914', 'ddc:891.73', 'lcc:PS3552', 'lcc:PR6023', 'fast:1234;Fiction']
+
+FORMAT_WEIGHTS = {
+    Book.Format.PAPERBACK: 55,
+    Book.Format.HARDCOVER: 25,
+    Book.Format.MASS_MARKET: 12,
+    Book.Format.EBOOK: 5,
+    Book.Format.CHAPBOOK: 2,
+    Book.Format.MAP: 1,
+}
+
+
+def zipf_weights(n: int, s: float = 1.1) -> list[float]:
+    """Cumulative weights for choosing among n ranked items with a Zipf-like distribution."""
+    return list(accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def person_name(i: int) -> tuple[str, str]:
+    """Return a unique (name, sort_name) pair for the i-th generated person."""
+    i, last = divmod(i, len(LAST_NAMES))
+    i, first = divmod(i, len(FIRST_NAMES))
+    i, initial = divmod(i, 26)
+    first_name = FIRST_NAMES[first]
+    last_name = LAST_NAMES[last]
+    middle = chr(ord('A') + initial) + '.'
+    if i:
+        middle += f' {chr(ord("A") + i % 26)}.'
+    return f'{first_name} {middle} {last_name}', f'{last_name}, {first_name} {middle}'
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic catalog of books, persons, tags and series for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1000, help='Number of books to generate')
+        parser.add_argument('--persons', type=int, help='Number of persons (default: a third of the books)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible catalogs')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true', help='Delete the existing catalog first')
+
+    def handle(self, *args, books, persons, seed, batch_size, clear, **options):
+        rng = random.Random(seed)
+        if persons is None:
+            persons = max(books // 3, 10)
+
+        if clear:
+            self.stdout.write('Deleting existing catalog')
+            # the books' credits, tags and category memberships are deleted along with them
+            for model in (Series, Book, Person, Tag):
+                model.objects.all().delete()
+
+        # continue numbering after any existing records, so names and ISBNs stay unique
+        isbn_offset = Book.objects.count()
+        person_offset = Person.objects.count()
+
+        self.stdout.write(f'Creating {persons} persons')
+        person_ids = []
+        for batch in batched(range(person_offset, person_offset + persons), batch_size):
+            created = Person.objects.bulk_create(
+                Person(name=name, sort_name=sort_name) for name, sort_name in map(person_name, batch)
+            )
+            person_ids.extend(p.id for p in created)
+        person_weights = zipf_weights(len(person_ids))
+
+        tags = [Tag.objects.get_or_create(**Tag.parse(value))[0].id for value in TAGS + CLASSIFIER_TAGS]
+        tag_weights = zipf_weights(len(TAGS))
+        publisher_weights = zipf_weights(len(PUBLISHERS))
+        formats, format_weights = zip(*FORMAT_WEIGHTS.items())
+
+        self.stdout.write(f'Creating {books} books')
+        series_number = Series.objects.count()
+        for start in range(0, books, batch_size):
+            count = min(batch_size, books - start)
+            with transaction.atomic():
+                new_books = [
+                    Book(
+                        title=' '.join(rng.sample(TITLE_WORDS, rng.randint(1, 4))),
+                        subtitle='A Novel' if rng.random() < 0.1 else '',
+                        isbn=isbn13(isbn_offset + start + i) if rng.random() < 0.9 else '',
+                        publisher=rng.choices(PUBLISHERS, cum_weights=publisher_weights)[0],
+                        publication_date=str(min(2024, int(rng.triangular(1850, 2025, 2015)))),
+                        format=rng.choices(formats, weights=format_weights)[0],
+                    ) for i in range(count)
+                ]
+                for book in new_books:
+                    book.set_publication_parts()
+                created = Book.objects.bulk_create(new_books)
+                book_ids = [b.id for b in created]
+
+                credits = []
+                taggings = []
+                for book_id in book_ids:
+                    order = 1
+                    for role, probability, max_count in (
+                        (Credit.Role.AUTHOR, 0.97, 3),
+                        (Credit.Role.EDITOR, 0.06, 2),
+                        (Credit.Role.TRANSLATOR, 0.1, 2),
+                        (Credit.Role.ILLUSTRATOR, 0.03, 1),
+                        (Credit.Role.ANNOTATOR, 0.01, 1),
+                    ):
+                        if rng.random() < probability:
+                            # the first person of each role is always credited; later ones are rarer
+                            number = 1 + sum(rng.random() < 0.15 for _ in range(max_count - 1))
+                            for person_id in set(rng.choices(person_ids, cum_weights=person_weights, k=number)):
+                                credits.append(Credit(book_id=book_id, person_id=person_id, role=role, order=order))
+                                order += 1
+
+                    tag_ids = set(rng.choices(tags[:len(TAGS)], cum_weights=tag_weights, k=rng.randint(0, 4)))
+                    if rng.random() < 0.2:
+                        tag_ids.add(rng.choice(tags[len(TAGS):]))
+                    taggings.extend(Book.tags.through(book_id=book_id, tag_id=tag_id) for tag_id in tag_ids)
+
+                Credit.objects.bulk_create(credits)
+                Book.tags.through.objects.bulk_create(taggings)
+
+                # put runs of consecutive books into series
+                memberships = []
+                position = 0
+                while position < len(book_ids):
+                    if rng.random() < 0.02:
+                        size = rng.randint(2, 10)
+                        series_number += 1
+                        series = Series.objects.create(title=f'{rng.choice(TITLE_WORDS)} Cycle {series_number}')
+                        memberships.extend(
+                            SeriesMembership(series=series, book_id=book_id, order=n)
+                            for n, book_id in enumerate(book_ids[position:position + size], start=1)
+                        )
+                        position += size
+                    else:
+                        position += 1
+                SeriesMembership.objects.bulk_create(memberships)
+
+                # bulk_create() doesn't send the signals that keep these up to date
+                Category.update_for(book_ids)
+                Book.update_display_credits(book_ids)
+                SavedSearch.update_for(book_ids)
+
+            self.stdout.write(f'  {start + count} books')
+
+        self.stdout.write(self.style.SUCCESS(f'Generated {books} books and {persons} persons'))
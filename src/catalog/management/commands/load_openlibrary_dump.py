@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand, CommandError
+
+from catalog import dumps
+
+
+class Command(BaseCommand):
+    help = 'Load Open Library dumps, which imports then use before asking Open Library'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', help='Authors dump, such as ol_dump_authors_latest.txt.gz')
+        parser.add_argument('--editions', help='Editions dump, such as ol_dump_editions_latest.txt.gz')
+        parser.add_argument('--batch-size', type=int, default=dumps.BATCH_SIZE)
+
+    def handle(self, *args, authors, editions, batch_size, **options):
+        if not authors and not editions:
+            raise CommandError('Give an authors dump, an editions dump, or both')
+        # the authors first, as the editions are loaded with the names of their authors
+        if authors:
+            self.stdout.write(f'Loaded {dumps.load_authors(authors, batch_size)} authors')
+        if editions:
+            self.stdout.write(f'Loaded {dumps.load_editions(editions, batch_size)} ISBNs')
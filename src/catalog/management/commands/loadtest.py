@@ -0,0 +1,129 @@
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+from django.core.management import BaseCommand, CommandError
+
+from catalog import loadtest
+from catalog.fake_openlibrary import start_in_thread
+
+SERVER_COMMANDS = {
+    'wsgi': ('waitress', ['-m', 'waitress', '--listen', '127.0.0.1:{port}', 'ibis.wsgi:application']),
+    'wsgi-prefork': ('waitress', ['-m', 'ibis.server', '--host', '127.0.0.1', '--port', '{port}']),
+    'asgi': ('uvicorn', ['-m', 'uvicorn', '--port', '{port}', '--no-access-log', '--lifespan', 'off',
+                         'ibis.asgi:application']),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(base_url: str, timeout: float):
+    """Wait until the server answers a first request."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + '/books/', timeout=timeout)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    raise CommandError(f'Server at {base_url} did not answer within {timeout} seconds')
+
+
+class Command(BaseCommand):
+    help = 'Replay a JSONL request log against an ibis instance and report latency per URL name'
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', help='JSONL request log')
+        parser.add_argument('--base-url', help='URL of a running instance to test')
+        parser.add_argument('--serve', choices=SERVER_COMMANDS, help='Start a local WSGI or ASGI instance to test')
+        parser.add_argument('--concurrency', '-c', type=int, default=8)
+        parser.add_argument('--loops', type=int, default=1, help='Number of times to replay the log')
+        parser.add_argument('--shuffle', action='store_true', help='Replay the requests in random order')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--openlibrary-latency', type=float, default=0,
+                            help='Latency of the fake Open Library server, in milliseconds')
+        parser.add_argument('--output', '-o', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, log, base_url, serve, concurrency, loops, shuffle, seed, openlibrary_latency, output,
+               **options):
+        if bool(base_url) == bool(serve):
+            raise CommandError('Give exactly one of --base-url or --serve')
+
+        entries = loadtest.read_log(log) * loops
+        if shuffle:
+            random.Random(seed).shuffle(entries)
+
+        server = None
+        fake = None
+        startup = None
+        try:
+            if serve:
+                fake = start_in_thread(latency=openlibrary_latency / 1000)
+                start = time.perf_counter()
+                base_url, server = self.start_server(serve, f'http://127.0.0.1:{fake.server_port}')
+                startup = time.perf_counter() - start
+                self.stderr.write(f'{serve} server answered its first request after {startup * 1000:.0f} ms')
+
+            replayer = loadtest.Replayer(base_url, loadtest.TemplateValues(seed))
+            self.stderr.write(f'Replaying {len(entries)} requests against {base_url} with concurrency {concurrency}')
+            report = loadtest.replay(entries, replayer, concurrency)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            if fake is not None:
+                fake.shutdown()
+
+        summary = report.summary()
+        summary.update(concurrency=concurrency, server=serve or base_url)
+        if startup is not None:
+            # from starting the server process to the response to its first request
+            summary['startup_ms'] = round(startup * 1000, 1)
+        text = json.dumps(summary, indent=2)
+        if output:
+            with open(output, 'w') as fh:
+                fh.write(text + '\n')
+        else:
+            self.stdout.write(text)
+
+        self.stderr.write(f'{"url name":<24} {"requests":>8} {"errors":>6} {"p50":>8} {"p90":>8} {"p99":>8}')
+        for name, stats in summary['urls'].items():
+            self.stderr.write(
+                f'{name:<24} {stats["requests"]:>8} {stats["errors"]:>6} '
+                f'{stats["p50_ms"]:>8.1f} {stats["p90_ms"]:>8.1f} {stats["p99_ms"]:>8.1f}'
+            )
+        self.stderr.write(f'{summary["throughput_rps"]} requests/s, error rate {summary["error_rate"]:.2%}')
+
+    def start_server(self, kind: str, openlibrary_url: str) -> tuple[str, subprocess.Popen]:
+        module, arguments = SERVER_COMMANDS[kind]
+        if importlib.util.find_spec(module) is None:
+            raise CommandError(f'{module} is not installed')
+
+        port = free_port()
+        env = {
+            **os.environ,
+            'OPENLIBRARY_URL': openlibrary_url,
+            'OPENLIBRARY_COVERS_URL': openlibrary_url,
+            'ALLOWED_HOSTS': '127.0.0.1,localhost',
+            # the pages render without collecting the static files first
+            'STATIC_MANIFEST_FALLBACK': 'true',
+        }
+        command = [sys.executable] + [arg.format(port=port) for arg in arguments]
+        base_url = f'http://127.0.0.1:{port}'
+        server = subprocess.Popen(command, env=env)
+        try:
+            wait_for_server(base_url, timeout=30)
+        except CommandError:
+            server.terminate()
+            raise
+        return base_url, server
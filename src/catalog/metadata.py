@@ -0,0 +1,159 @@
+"""
+Book metadata services used when importing books.
+
+ISBN validation, metadata and format lookups on Open Library, classifiers,
+and the parsing of titles and names from metadata need isbnlib, requests,
+httpx, nameparser and titlecase, which together take longer to import than
+the rest of the catalog app. They are imported here when first used rather
+than when the app loads, so that processes and requests that never import
+a book (browsing the catalog, most management commands, tests) don't pay
+for them.
+
+Requests to the services are limited, retried and cut off when a service
+keeps failing by ``catalog.upstream``.
+"""
+
+import logging
+import re
+from functools import cache
+
+from django.conf import settings
+
+from catalog import upstream
+# raised by the lookups here when a service can't be reached, fails or is unavailable
+from catalog.upstream import ServiceError
+
+logger = logging.getLogger(__name__)
+
+# format of the sort names of persons created from metadata
+SORT_NAME_FORMAT = '{last}, {title} {first} {suffix}'
+
+
+class InvalidISBNError(ValueError):
+    def __init__(self, isbn: str):
+        super().__init__(f'({isbn}) is not a valid ISBN')
+        self.isbn = isbn
+
+
+@cache
+def load_isbnlib():
+    import isbnlib
+
+    isbnlib.config.seturlopentimeout(settings.OPENLIBRARY_TIMEOUT)
+    return isbnlib
+
+
+def is_isbn(value: str) -> bool:
+    isbnlib = load_isbnlib()
+    return isbnlib.is_isbn10(value) or isbnlib.is_isbn13(value)
+
+
+def validate_isbn(value: str):
+    if not is_isbn(value):
+        raise InvalidISBNError(value)
+
+
+def to_isbn13(value: str) -> str:
+    """The ISBN-13 of an ISBN-10 or ISBN-13, without hyphens; empty if ``value`` isn't an ISBN."""
+    isbnlib = load_isbnlib()
+    return isbnlib.to_isbn13(isbnlib.canonical(value)) or ''
+
+
+def isbnlib_call(func, *args):
+    """Call an isbnlib function that makes requests, raising ``ServiceError`` if they fail."""
+    from isbnlib.dev import ISBNLibDevException
+
+    try:
+        return func(*args)
+    except ISBNLibDevException as e:
+        raise ServiceError(str(e) or e.__class__.__name__) from e
+
+
+def meta(isbn: str) -> dict:
+    """Metadata for an ISBN from the books API of Open Library, in the same form as ``isbnlib.meta()``.
+
+    Returns an empty dictionary if Open Library has no record for the ISBN."""
+    isbn = to_isbn13(isbn)
+    r = upstream.get('openlibrary').call(upstream.http, 'GET', f'{settings.OPENLIBRARY_URL}/api/books', params={
+        'bibkeys': f'ISBN:{isbn}',
+        'format': 'json',
+        'jscmd': 'data',
+    })
+    if not r.ok:
+        raise ServiceError(f'Open Library returned status {r.status_code} for {isbn}')
+    record = r.json().get(f'ISBN:{isbn}')
+    return map_record(isbn, record) if record else {}
+
+
+def map_record(isbn: str, record: dict) -> dict:
+    """The metadata of a record of the books API, in the same form as ``isbnlib.meta()``."""
+    title = record.get('title', '').replace(' :', ':')
+    if record.get('subtitle'):
+        title += ' - ' + record['subtitle']
+    publishers = record.get('publishers') or [{'name': ''}]
+    year = re.search(r'\d{4}', record.get('publish_date', ''))
+    return {
+        'ISBN-13': isbn,
+        'Title': title,
+        'Authors': [author['name'] for author in record.get('authors', [])],
+        'Publisher': publishers[0]['name'],
+        'Year': year[0] if year else '',
+    }
+
+
+def physical_format(isbn: str) -> str:
+    """The format of an ISBN, or "?" if it isn't known or Open Library is unavailable."""
+    try:
+        r = upstream.get('openlibrary').call(upstream.http, 'GET', f'{settings.OPENLIBRARY_URL}/isbn/{isbn}.json')
+    except ServiceError as e:
+        logger.warning('Could not look up the format of %s: %s', isbn, e)
+        return '?'
+    return r.json().get('physical_format', '?').lower() if r.ok else '?'
+
+
+def cover_available(url: str) -> bool:
+    """Whether there is a cover at ``url``; ``False`` if the covers service is unavailable."""
+    try:
+        res = upstream.get('covers').call(upstream.http, 'HEAD', url)
+    except ServiceError:
+        return False
+    return res.ok and 'content-type' in res.headers
+
+
+def classifier_tags(isbn: str) -> list[str]:
+    """Classifier tags for an ISBN, such as "ddc:823.914". Raises ``ServiceError``
+    if the classifier service is down or fails; this is slow, see ``catalog.enrichment``,
+    which also retries failed lookups."""
+    isbnlib = load_isbnlib()
+    classifiers = upstream.get('classify').call(isbnlib_call, isbnlib.classify, isbn, retries=0)
+    tags = []
+    for system, value in classifiers.items():
+        if system.lower() == 'fast':
+            for number, description in value.items():
+                tags.append(f'fast:{number};{description}')
+        else:
+            tags.append(f'{system.lower()}:{value}')
+    return tags
+
+
+def split_title(title: str, separator: str = ' - ') -> tuple[str, str]:
+    from titlecase import titlecase
+
+    if separator in title:
+        main, sub = title.split(separator, 1)
+        return titlecase(main), titlecase(sub)
+    else:
+        return titlecase(title), ''
+
+
+def sort_name(name: str) -> str:
+    from nameparser import HumanName
+
+    return str(HumanName(name, string_format=SORT_NAME_FORMAT))
+
+
+def openlibrary_client():
+    """The async Open Library client of ``catalog.openlibrary``, to use with ``async with``."""
+    from catalog import openlibrary
+
+    return openlibrary.client()
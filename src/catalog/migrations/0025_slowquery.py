@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0024_remove_collection_description'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('captured_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('duration', models.FloatField(verbose_name='duration (ms)')),
+                ('alias', models.CharField(max_length=64, verbose_name='database')),
+                ('view', models.CharField(blank=True, max_length=256)),
+                ('path', models.TextField(blank=True)),
+                ('filters', models.TextField(blank=True)),
+                ('sql', models.TextField(verbose_name='SQL')),
+                ('params', models.JSONField(default=list)),
+                ('plan', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name_plural': 'slow queries',
+                'ordering': ['-captured_at'],
+            },
+        ),
+    ]
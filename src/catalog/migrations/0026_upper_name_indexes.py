@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:40
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0025_slowquery'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='catalog_person_name_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='series',
+            index=models.Index(django.db.models.functions.text.Upper('title'), name='catalog_series_title_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(django.db.models.functions.text.Upper('value'), name='catalog_tag_value_upper'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:43
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Q
+
+# the categories that used to be hard-coded in the views
+CATEGORIES = [
+    {'name': 'fiction', 'any_tags': ['novel', 'short stories']},
+    {'name': 'non-fiction', 'no_tags': ['novel', 'short stories', 'poetry', 'comics', 'play']},
+    {'name': 'translated', 'role': 'translator'},
+]
+
+
+def create_categories(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    Credit = apps.get_model('catalog', 'Credit')
+    Category = apps.get_model('catalog', 'Category')
+    Tagging = Book.tags.through
+    Membership = Category.books.through
+
+    # the historical models don't have Category.rule(), so this repeats it
+    def tagged(values):
+        return Q(Exists(Tagging.objects.filter(book=OuterRef('pk'), tag__value__in=values)))
+
+    for fields in CATEGORIES:
+        category = Category.objects.create(**fields)
+        rule = Q()
+        if category.any_tags:
+            rule &= tagged(category.any_tags)
+        if category.no_tags:
+            rule &= ~tagged(category.no_tags)
+        if category.role:
+            rule &= Q(Exists(Credit.objects.filter(book=OuterRef('pk'), role=category.role)))
+        Membership.objects.bulk_create(
+            (Membership(category=category, book_id=book_id)
+             for book_id in Book.objects.filter(rule).values_list('id', flat=True).iterator()),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0026_upper_name_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('any_tags', models.JSONField(blank=True, default=list, help_text='List of tag values; the book must have at least one of them.', verbose_name='tagged with any of')),
+                ('no_tags', models.JSONField(blank=True, default=list, help_text='List of tag values; the book must have none of them.', verbose_name='tagged with none of')),
+                ('role', models.CharField(blank=True, choices=[('author', 'Author'), ('editor', 'Editor'), ('translator', 'Translator'), ('illustrator', 'Illustrator'), ('annotator', 'Annotator')], help_text='The book must credit someone in this role.', max_length=16, verbose_name='with a credit as')),
+                ('books', models.ManyToManyField(blank=True, editable=False, related_name='categories', to='catalog.book')),
+            ],
+            options={
+                'verbose_name_plural': 'categories',
+            },
+        ),
+        migrations.RunPython(create_categories, migrations.RunPython.noop),
+    ]
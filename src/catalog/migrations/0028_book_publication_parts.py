@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:45
+
+import re
+
+from django.db import migrations, models
+
+# a copy of catalog.utils.parse_publication_date() as it was when this migration was written
+MONTHS = {
+    name: number
+    for number, names in enumerate((
+        ('january', 'jan'), ('february', 'feb'), ('march', 'mar'), ('april', 'apr'), ('may',),
+        ('june', 'jun'), ('july', 'jul'), ('august', 'aug'), ('september', 'sep', 'sept'),
+        ('october', 'oct'), ('november', 'nov'), ('december', 'dec'),
+    ), start=1)
+    for name in names
+}
+
+ISO_DATE = re.compile(r'(?<!\d)(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?(?!\d)')
+MONTH_NAME = re.compile(r'\b([a-z]+)\.?\b')
+DAY = re.compile(r'\b(\d{1,2})(?:st|nd|rd|th)?\b')
+
+
+def parse_publication_date(value):
+    value = value.lower()
+    match = ISO_DATE.search(value)
+    if match is None:
+        return None, None, None
+    year, month, day = (int(part) if part else None for part in match.groups())
+    if month is None:
+        rest = value[:match.start()] + ' ' + value[match.end():]
+        month = next((MONTHS[name] for name in MONTH_NAME.findall(rest) if name in MONTHS), None)
+        if month is not None:
+            day = next((int(number) for number in DAY.findall(rest)), None)
+    if month is not None and not 1 <= month <= 12:
+        month = day = None
+    if day is not None and (month is None or not 1 <= day <= 31):
+        day = None
+    return year, month, day
+
+
+def parse_publication_dates(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    books = []
+    for book in Book.objects.only('publication_date').iterator(chunk_size=1000):
+        book.publication_year, book.publication_month, book.publication_day = \
+            parse_publication_date(book.publication_date)
+        if book.publication_year is not None:
+            books.append(book)
+    Book.objects.bulk_update(
+        books, ['publication_year', 'publication_month', 'publication_day'], batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0027_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='publication_day',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='publication_month',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='publication_year',
+            field=models.SmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['publication_year', 'publication_month', 'publication_day'], name='catalog_book_publication'),
+        ),
+        migrations.RunPython(parse_publication_dates, migrations.RunPython.noop),
+    ]
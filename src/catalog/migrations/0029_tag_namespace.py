@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:47
+
+import re
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Concat
+
+# a copy of catalog.utils.split_namespace() as it was when this migration was written
+NAMESPACE = re.compile(r'([a-z][a-z0-9_-]{0,31}):(.*)', re.IGNORECASE | re.DOTALL)
+
+
+def split_namespace(text):
+    match = NAMESPACE.fullmatch(text)
+    if match is None:
+        return '', text
+    return match[1].lower(), match[2]
+
+
+def split_namespaces(apps, schema_editor):
+    Tag = apps.get_model('catalog', 'Tag')
+    tags = []
+    for tag in Tag.objects.filter(value__contains=':').iterator(chunk_size=1000):
+        tag.namespace, tag.value = split_namespace(tag.value)
+        if tag.namespace:
+            tags.append(tag)
+    Tag.objects.bulk_update(tags, ['namespace', 'value'], batch_size=1000)
+
+
+def join_namespaces(apps, schema_editor):
+    Tag = apps.get_model('catalog', 'Tag')
+    Tag.objects.exclude(namespace='').update(value=Concat('namespace', Value(':'), 'value'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0028_book_publication_parts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='tag',
+            name='catalog_tag_value_upper',
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='namespace',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.RunPython(split_namespaces, join_namespaces),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(models.F('namespace'), django.db.models.functions.text.Upper('value'), name='catalog_tag_namespace_upper'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0031_person_sort_name_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['title', 'id'], name='catalog_collection_title'),
+        ),
+        migrations.AddIndex(
+            model_name='series',
+            index=models.Index(fields=['title', 'id'], name='catalog_series_title'),
+        ),
+        migrations.AddIndex(
+            model_name='seriesmembership',
+            index=models.Index(fields=['series', 'order', 'id'], name='catalog_seriesmembership_order'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:56
+
+from django.db import migrations, models
+
+# indexes for the case-insensitive prefix searches of the admin (istartswith, which
+# is UPPER(column::text) LIKE UPPER('prefix%')), on PostgreSQL; these need an operator
+# class that Index() can't give an expression in a way that works on every database
+PATTERN_INDEXES = [
+    ('catalog_book_title_upper_like', 'catalog_book', 'title'),
+    ('catalog_person_name_upper_like', 'catalog_person', 'name'),
+    ('catalog_person_sort_name_upper_like', 'catalog_person', 'sort_name'),
+    ('catalog_series_title_upper_like', 'catalog_series', 'title'),
+    ('catalog_tag_value_upper_like', 'catalog_tag', 'value'),
+]
+
+
+def create_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in PATTERN_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} (UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _table, _column in PATTERN_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0032_group_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['isbn'], name='catalog_book_isbn'),
+        ),
+        migrations.RunPython(create_pattern_indexes, drop_pattern_indexes),
+    ]
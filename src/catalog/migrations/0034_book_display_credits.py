@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:57
+
+from itertools import groupby
+
+from django.db import migrations, models
+
+
+def store_display_credits(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    Credit = apps.get_model('catalog', 'Credit')
+    credits = Credit.objects.order_by('book', 'order', 'id').values_list('book', 'person__name', 'role')
+    books = []
+    for book_id, rows in groupby(credits.iterator(chunk_size=1000), key=lambda row: row[0]):
+        display_credits = ', '.join(
+            name if role == 'author' else f'{name} ({role})' for _, name, role in rows
+        )
+        books.append(Book(id=book_id, display_credits=display_credits))
+    Book.objects.bulk_update(books, ['display_credits'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0033_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='display_credits',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(store_display_credits, migrations.RunPython.noop),
+    ]
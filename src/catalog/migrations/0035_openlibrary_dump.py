@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0034_book_display_credits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenLibraryAuthor',
+            fields=[
+                ('key', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=256)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OpenLibraryEdition',
+            fields=[
+                ('isbn', models.CharField(max_length=13, primary_key=True, serialize=False, verbose_name='ISBN')),
+                ('title', models.CharField(max_length=1024)),
+                ('subtitle', models.CharField(blank=True, max_length=1024)),
+                ('authors', models.JSONField(default=list)),
+                ('publisher', models.CharField(blank=True, max_length=256)),
+                ('publish_date', models.CharField(blank=True, max_length=32)),
+                ('physical_format', models.CharField(blank=True, max_length=64)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0035_openlibrary_dump'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedSearch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('query', models.CharField(help_text='The filters of the index, as in its URL, such as tag=poetry&publisher^=Penguin.', max_length=1024, unique=True)),
+                ('books', models.ManyToManyField(blank=True, editable=False, related_name='saved_searches', to='catalog.book')),
+            ],
+            options={
+                'verbose_name_plural': 'saved searches',
+            },
+        ),
+    ]
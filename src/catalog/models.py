@@ -1,40 +1,90 @@
+import asyncio
+import json
+import re
+from collections import defaultdict
 from functools import cached_property
+from typing import Iterable, TYPE_CHECKING
 from uuid import uuid4
 
-import isbnlib
-import requests
-from django.db import models
-from django.db.models import QuerySet
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, QuerySet, Subquery, Q
+from django.db.models.functions import Upper
+from django.http import QueryDict
 from django.urls import reverse
-from isbnlib import is_isbn10, is_isbn13, NotValidISBNError, ISBNLibException
-from nameparser import HumanName
+from django.utils import timezone
 
-from catalog.utils import split_title, get_format
+from catalog import metadata
+from catalog.utils import FilterSet, RelatedFilter, parse_publication_date, split_namespace
+
+if TYPE_CHECKING:
+    from catalog.openlibrary import OpenLibraryClient
 
 
 class Person(models.Model):
     name = models.CharField(max_length=256)
     sort_name = models.CharField(max_length=256)
 
+    class Meta:
+        indexes = [
+            # for the case-insensitive exact match of the author (editor, ...) filters
+            models.Index(Upper('name'), name='catalog_person_name_upper'),
+            # for the person index, which pages through the persons in this order
+            models.Index(fields=['sort_name', 'id'], name='catalog_person_sort_name'),
+        ]
+
     def __str__(self):
         return self.name
 
     @property
-    def credits(self):
-        return Credit.objects.filter(person=self.id)
+    def credits(self) -> QuerySet['Credit']:
+        return Credit.objects.filter(person=self.id).select_related('book').order_by(
+            'role', F('book__publication_year').asc(nulls_last=True), 'book__title', 'book_id',
+        )
+
+    def get_absolute_url(self):
+        return reverse('show_person', kwargs={'pk': self.pk})
 
 
 class Tag(models.Model):
+    # the classification system of classifier tags, such as "ddc" or "fast"; empty for plain tags
+    namespace = models.CharField(max_length=32, blank=True, default='')
     value = models.CharField(max_length=1024)
 
+    class Meta:
+        indexes = [
+            models.Index(F('namespace'), Upper('value'), name='catalog_tag_namespace_upper'),
+        ]
+
     def __str__(self):
-        return self.value
+        return f'{self.namespace}:{self.value}' if self.namespace else self.value
+
+    @staticmethod
+    def parse(text: str) -> dict:
+        """The fields of the tag written as ``text``, such as "novel" or "ddc:823.914"."""
+        namespace, value = split_namespace(text)
+        return {'namespace': namespace, 'value': value}
+
+    @staticmethod
+    def matching(texts: Iterable[str], prefix: str = '') -> Q:
+        """A condition matching any of the tags written as ``texts``, for
+        ``Tag`` or, with a ``prefix`` such as ``tag__``, for a related model."""
+        values = defaultdict(list)
+        for text in texts:
+            namespace, value = split_namespace(text)
+            values[namespace].append(value)
+        condition = Q(pk__in=[])
+        for namespace, namespace_values in values.items():
+            condition |= Q(**{f'{prefix}namespace': namespace, f'{prefix}value__in': namespace_values})
+        return condition
 
 
 class CoverImage:
     def __init__(self, book: 'Book'):
         self.book = book
-        self.base_url = f'https://covers.openlibrary.org/b/isbn/{self.book.isbn}'
+        self.base_url = f'{settings.OPENLIBRARY_COVERS_URL}/b/isbn/{self.book.isbn}'
 
     @property
     def url(self):
@@ -46,8 +96,10 @@ class CoverImage:
 
     @cached_property
     def is_available(self):
-        res = requests.head(self.url)
-        return res.ok and 'content-type' in res.headers
+        return metadata.cover_available(self.url)
+
+
+PUBLICATION_PARTS = ('publication_year', 'publication_month', 'publication_day')
 
 
 class Book(models.Model):
@@ -65,71 +117,114 @@ class Book(models.Model):
     isbn = models.CharField('ISBN', max_length=13, blank=True)
     publisher = models.CharField(max_length=256)
     publication_date = models.CharField(max_length=32)
+    # parsed from publication_date when the book is saved, for range filters and sorting
+    publication_year = models.SmallIntegerField(null=True, blank=True, editable=False)
+    publication_month = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    publication_day = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
     format = models.CharField(max_length=32, choices=Format.choices)
     tags = models.ManyToManyField(Tag, related_name='books')
     uuid = models.UUIDField('UUID', default=uuid4)
+    # the names of the credited persons, as shown by __str__(); kept up to date by catalog.signals
+    display_credits = models.TextField(blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['publication_year', 'publication_month', 'publication_day'],
+                name='catalog_book_publication',
+            ),
+            # for finding books by ISBN, when importing and in the admin
+            models.Index(fields=['isbn'], name='catalog_book_isbn'),
+        ]
 
     @classmethod
-    def create_from_isbn(cls, isbn):
-        if not (is_isbn10(isbn) or is_isbn13(isbn)):
-            # skip this, not an ISBN
-            # TODO: log this
-            raise NotValidISBNError(isbn)
-
-
-        try:
-            # skip this book, it is already in the catalog
-            # TODO: log this
-            return cls.objects.get(isbn=isbn)
-        except cls.DoesNotExist:
-            book = cls(isbn=isbn)
-
-        try:
-            metadata = isbnlib.meta(isbn, service='openl')
-        except ISBNLibException:
-            raise
-        # TODO: what to do if metadata is empty?
-
-        book.title, book.subtitle = split_title(metadata.get('Title', isbn))
-        book.publisher = metadata.get('Publisher') or '?'
-        book.publication_date = metadata.get('Year') or '?'
-        book.format = get_format(isbn)
-        book.save()
+    async def acreate_from_isbn(cls, client: 'OpenLibraryClient', isbn: str) -> 'Book':
+        """Import a book by its ISBN, or return the book with the ISBN if it is already in the catalog.
+
+        Raises ``InvalidISBNError`` for a value that isn't an ISBN, and ``ServiceError``
+        if Open Library can't be asked for its metadata."""
+        metadata.validate_isbn(isbn)
+
+        # skip this book if it is already in the catalog
+        book = await cls.objects.filter(isbn=isbn).afirst()
+        if book is not None:
+            return book
+
+        # a loaded Open Library dump has most books, and saves asking Open Library
+        edition = await OpenLibraryEdition.objects.filter(isbn=metadata.to_isbn13(isbn)).afirst()
+        if edition is not None:
+            isbn_metadata, book_format = edition.metadata(), edition.book_format()
+        else:
+            # TODO: what to do if metadata is empty?
+            isbn_metadata, book_format = await asyncio.gather(client.metadata(isbn), client.physical_format(isbn))
+        return await sync_to_async(cls.create_from_metadata)(isbn, isbn_metadata, book_format)
 
-        author_names = [HumanName(author) for author in metadata.get('Authors', [])]
+    @classmethod
+    @transaction.atomic
+    def create_from_metadata(cls, isbn: str, isbn_metadata: dict, book_format: str):
+        """Create a book from ISBN metadata in the form returned by ``isbnlib.meta()``.
+
+        The book is created with its authors or not at all, also when an import
+        is cancelled while the book is being created."""
+        book = cls(isbn=isbn)
+        book.title, book.subtitle = metadata.split_title(isbn_metadata.get('Title', isbn))
+        book.publisher = isbn_metadata.get('Publisher') or '?'
+        book.publication_date = isbn_metadata.get('Year') or '?'
+        book.format = book_format
+        book.save()
 
-        for i, author_name in enumerate(author_names, start=1):
+        for i, author_name in enumerate(isbn_metadata.get('Authors', []), start=1):
             author, _is_new = Person.objects.get_or_create(
-                name=author_name.original,
-                defaults={'sort_name': str(author_name)}
+                name=author_name,
+                defaults={'sort_name': metadata.sort_name(author_name)}
             )
             book.add_author(author, order=i)
+        # as stored by catalog.signals when the authors were added
+        book.refresh_from_db(fields=['display_credits'])
 
-        # add tags for classifiers
-        # XXX: skip getting classifiers for now; see https://github.com/xlcnd/isbnlib/issues/138
-        # for tag_value in get_classifier_tags(isbn):
-        #     tag, _ = Tag.objects.get_or_create(value=tag_value)
-        #     book.tags.add(tag)
+        # classifier tags are slow to look up, so they are added later (see catalog.enrichment)
+        if book.isbn:
+            ClassifierTask.objects.create(book=book)
 
         return book
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.cover_image = CoverImage(self)
+    def save(self, **kwargs):
+        self.set_publication_parts()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'publication_date' in update_fields:
+            kwargs['update_fields'] = {*update_fields, *PUBLICATION_PARTS}
+        super().save(**kwargs)
+
+    def set_publication_parts(self):
+        """Set the publication year, month and day from the free-form publication date.
+
+        ``save()`` calls this; books created with ``bulk_create()`` need to call it first."""
+        for field, value in zip(PUBLICATION_PARTS, parse_publication_date(self.publication_date)):
+            setattr(self, field, value)
 
     def __str__(self):
-        names = ', '.join(str(credit.person_with_role) for credit in self.credits())
-        return f'{self.title}, by {names}'
+        return f'{self.title}, by {self.display_credits}'
+
+    @classmethod
+    def update_display_credits(cls, book_ids: Iterable[int]):
+        """Update the credits shown by ``__str__()`` of the given books, after
+        their credits or the names of their persons changed."""
+        book_ids = set(book_ids)
+        names = defaultdict(list)
+        credits = Credit.objects.filter(book__in=book_ids).order_by('book', 'order', 'id')
+        for book_id, name, role in credits.values_list('book', 'person__name', 'role'):
+            names[book_id].append(Credit.name_with_role(name, role))
+        books = []
+        for book in cls.objects.filter(id__in=book_ids).only('display_credits'):
+            display_credits = ', '.join(names[book.id])
+            if book.display_credits != display_credits:
+                book.display_credits = display_credits
+                books.append(book)
+        cls.objects.bulk_update(books, ['display_credits'], batch_size=1000)
 
     def credits(self) -> QuerySet['Credit']:
         return Credit.objects.filter(book=self.id).order_by('order')
 
-    def __getattr__(self, item):
-        if item in Credit.Role:
-            return self.persons.filter(credit__role=item).order_by('credit__order')
-        else:
-            raise AttributeError(f"'{self.__class__}' object has no attribute '{item}'")
-
     def add_author(self, author: Person, order: int = 1):
         self.persons.add(author, through_defaults={'role': Credit.Role.AUTHOR, 'order': order})
 
@@ -137,10 +232,14 @@ class Book(models.Model):
         return self.series.through.objects.filter(book=self)
 
     def sorted_tags(self) -> QuerySet[Tag]:
-        return self.tags.order_by('value')
+        return self.tags.order_by('namespace', 'value')
 
     def plain_tags(self):
-        return self.tags.exclude(value__contains=':').order_by('value')
+        return self.tags.filter(namespace='').order_by('value')
+
+    @cached_property
+    def cover_image(self) -> CoverImage:
+        return CoverImage(self)
 
     def get_absolute_url(self):
         return reverse("show_book", kwargs={"pk": self.pk})
@@ -155,6 +254,14 @@ class Series(models.Model):
 
     class Meta:
         verbose_name_plural = "series"
+        indexes = [
+            models.Index(Upper('title'), name='catalog_series_title_upper'),
+            # for the series index, which pages through the series in this order
+            models.Index(fields=['title', 'id'], name='catalog_series_title'),
+        ]
+
+    def get_absolute_url(self):
+        return reverse('show_series', kwargs={'pk': self.pk})
 
 
 class Credit(models.Model):
@@ -175,9 +282,13 @@ class Credit(models.Model):
 
     @property
     def person_with_role(self):
-        output = str(self.person.name)
-        if self.role != Credit.Role.AUTHOR:
-            output += f' ({self.role})'
+        return self.name_with_role(self.person.name, self.role)
+
+    @staticmethod
+    def name_with_role(name: str, role: str) -> str:
+        output = str(name)
+        if role != Credit.Role.AUTHOR:
+            output += f' ({role})'
         return output
 
 
@@ -186,6 +297,12 @@ class SeriesMembership(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     order = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        indexes = [
+            # for listing the books of a series in order
+            models.Index(fields=['series', 'order', 'id'], name='catalog_seriesmembership_order'),
+        ]
+
     def __str__(self):
         return f'Book {self.order} of {self.series.title}'
 
@@ -194,5 +311,244 @@ class Collection(models.Model):
     title = models.CharField(max_length=1024)
     books = models.ManyToManyField(Book)
 
+    class Meta:
+        indexes = [
+            # for the collection index, which pages through the collections in this order
+            models.Index(fields=['title', 'id'], name='catalog_collection_title'),
+        ]
+
     def __str__(self):
         return self.title
+
+    def get_absolute_url(self):
+        return reverse('show_collection', kwargs={'pk': self.pk})
+
+
+class Category(models.Model):
+    """A category of books for browsing, such as fiction, defined by a rule.
+
+    A book is in the category if it matches all the parts of the rule that
+    are set. The members are stored, and kept up to date when the books'
+    tags and credits change (see ``catalog.signals``), so that browsing a
+    category is a lookup in its membership table."""
+
+    name = models.CharField(max_length=64, unique=True)
+    any_tags = models.JSONField(
+        'tagged with any of', default=list, blank=True,
+        help_text='List of tag values; the book must have at least one of them.',
+    )
+    no_tags = models.JSONField(
+        'tagged with none of', default=list, blank=True,
+        help_text='List of tag values; the book must have none of them.',
+    )
+    role = models.CharField(
+        'with a credit as', max_length=16, choices=Credit.Role.choices, blank=True,
+        help_text='The book must credit someone in this role.',
+    )
+    books = models.ManyToManyField(Book, related_name='categories', blank=True, editable=False)
+
+    class Meta:
+        verbose_name_plural = 'categories'
+
+    def __str__(self):
+        return self.name
+
+    def rule(self) -> Q:
+        tags = RelatedFilter(Book.tags.through, 'book')
+        rule = Q()
+        if self.any_tags:
+            rule &= tags(Tag.matching(self.any_tags, 'tag__'))
+        if self.no_tags:
+            rule &= ~tags(Tag.matching(self.no_tags, 'tag__'))
+        if self.role:
+            rule &= RelatedFilter(Credit, 'book')(role=self.role)
+        return rule
+
+    def update_books(self, books: QuerySet[Book] = None):
+        """Update the membership of the given books (by default, all books)."""
+        if books is None:
+            books = Book.objects.all()
+        memberships = Category.books.through.objects.filter(category=self)
+        members = set(books.filter(self.rule()).values_list('id', flat=True))
+        current = set(memberships.filter(book__in=books).values_list('book_id', flat=True))
+        memberships.filter(book_id__in=current - members).delete()
+        Category.books.through.objects.bulk_create(
+            Category.books.through(category=self, book_id=book_id) for book_id in members - current
+        )
+
+    @classmethod
+    def update_for(cls, book_ids):
+        """Update the categories of the given books, after their tags or credits changed."""
+        books = Book.objects.filter(id__in=list(book_ids))
+        for category in cls.objects.all():
+            category.update_books(books)
+
+
+class SavedSearch(models.Model):
+    """A search of the index that is used often, such as ``format=hardcover&tag=translated``.
+
+    The query is stored in canonical form (see ``FilterSet.canonical()``),
+    so that the index recognizes it however its filters are ordered. The
+    matching books are stored, and kept up to date when books change (see
+    ``catalog.signals``): only the searches that filter on what changed are
+    evaluated again, and only against the changed books. Opening the search
+    in the index is then a lookup in its membership table."""
+
+    name = models.CharField(max_length=64, unique=True)
+    query = models.CharField(
+        max_length=1024, unique=True,
+        help_text='The filters of the index, as in its URL, such as tag=poetry&publisher^=Penguin.',
+    )
+    books = models.ManyToManyField(Book, related_name='saved_searches', blank=True, editable=False)
+
+    class Meta:
+        verbose_name_plural = 'saved searches'
+
+    def __str__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return reverse('index') + '?' + self.query
+
+    def params(self) -> QueryDict:
+        # the query can be given as a URL of the index, too
+        return QueryDict(self.query.partition('?')[2] if '?' in self.query else self.query)
+
+    def filters(self) -> tuple[FilterSet, Q]:
+        # the filters are defined on the models, so they're imported here
+        from catalog.filters import FILTER_TEMPLATES
+
+        filters = FilterSet()
+        condition = Q()
+        for filter_query in filters.build(FILTER_TEMPLATES, self.params()):
+            condition &= filter_query
+        return filters, condition
+
+    def condition(self) -> Q:
+        return self.filters()[1]
+
+    def clean(self):
+        filters, _ = self.filters()
+        if not filters:
+            raise ValidationError({'query': 'The query has none of the filters of the index.'})
+        self.query = filters.canonical()
+
+    def depends_on(self, changed: str) -> bool:
+        """Whether the results can change when the books' fields ("book"), or their "credits",
+        "tags", "series" or "categories" change."""
+        from catalog.filters import dependencies
+
+        return any(changed in dependencies(param_name) for param_name in self.params())
+
+    def update_books(self, books: QuerySet[Book] = None):
+        """Update which of the given books (by default, all books) match."""
+        if books is None:
+            books = Book.objects.all()
+        memberships = SavedSearch.books.through.objects.filter(savedsearch=self)
+        members = set(books.filter(self.condition()).values_list('id', flat=True))
+        current = set(memberships.filter(book__in=books).values_list('book_id', flat=True))
+        memberships.filter(book_id__in=current - members).delete()
+        SavedSearch.books.through.objects.bulk_create(
+            SavedSearch.books.through(savedsearch=self, book_id=book_id) for book_id in members - current
+        )
+
+    @classmethod
+    def update_for(cls, book_ids, changed: str = None):
+        """Update the searches that depend on what changed of the given books (see
+        ``depends_on()``), or all searches for new books (``changed`` is None)."""
+        books = Book.objects.filter(id__in=list(book_ids))
+        for search in cls.objects.all():
+            if changed is None or search.depends_on(changed):
+                search.update_books(books)
+
+    @classmethod
+    def update_all(cls, changed: str):
+        """Update the searches that depend on what changed of all books, such as a category's rule."""
+        for search in cls.objects.all():
+            if search.depends_on(changed):
+                search.update_books()
+
+
+class ClassifierTask(models.Model):
+    """A book waiting to be tagged with its classifiers by the ``enrich_classifiers`` command."""
+
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, related_name='classifier_task')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'Classifiers for {self.book_id}'
+
+
+class OpenLibraryAuthor(models.Model):
+    """An author from an Open Library authors dump, to name the authors of ``OpenLibraryEdition``."""
+
+    # such as "OL23919A"
+    key = models.CharField(max_length=32, primary_key=True)
+    name = models.CharField(max_length=256)
+
+    def __str__(self):
+        return self.name
+
+
+class OpenLibraryEdition(models.Model):
+    """The metadata of an ISBN from an Open Library editions dump, loaded by the
+    ``load_openlibrary_dump`` command, which imports use before asking Open Library."""
+
+    isbn = models.CharField('ISBN', max_length=13, primary_key=True)
+    title = models.CharField(max_length=1024)
+    subtitle = models.CharField(max_length=1024, blank=True)
+    authors = models.JSONField(default=list)
+    publisher = models.CharField(max_length=256, blank=True)
+    publish_date = models.CharField(max_length=32, blank=True)
+    physical_format = models.CharField(max_length=64, blank=True)
+
+    def __str__(self):
+        return f'{self.isbn}: {self.title}'
+
+    def metadata(self) -> dict:
+        """The metadata in the same form as ``isbnlib.meta()``."""
+        title = self.title
+        if self.subtitle:
+            title += ' - ' + self.subtitle
+        year = re.search(r'\d{4}', self.publish_date)
+        return {
+            'ISBN-13': self.isbn,
+            'Title': title,
+            'Authors': self.authors,
+            'Publisher': self.publisher,
+            'Year': year[0] if year else '',
+        }
+
+    def book_format(self) -> str:
+        return self.physical_format.lower() or '?'
+
+
+class SlowQuery(models.Model):
+    captured_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    duration = models.FloatField('duration (ms)')
+    alias = models.CharField('database', max_length=64)
+    view = models.CharField(max_length=256, blank=True)
+    path = models.TextField(blank=True)
+    filters = models.TextField(blank=True)
+    sql = models.TextField('SQL')
+    params = models.JSONField(default=list)
+    plan = models.TextField(blank=True)
+
+    @classmethod
+    def record(cls, params, **fields):
+        # parameters may contain values that JSON can't represent, so store those as strings
+        params = json.loads(json.dumps(params, default=str))
+        cls.objects.create(params=params, **fields)
+
+        # keep only the most recent samples
+        cutoff = cls.objects.order_by('-id').values_list('id', flat=True)[settings.SLOW_QUERY_STORE_SIZE:][:1]
+        cls.objects.filter(id__lte=Subquery(cutoff)).delete()
+
+    def __str__(self):
+        return f'{self.duration:.0f} ms in {self.view or self.path}'
+
+    class Meta:
+        verbose_name_plural = "slow queries"
+        ordering = ['-captured_at']
@@ -0,0 +1,81 @@
+"""
+Async client for the Open Library services used by the async views.
+
+Requests go through an ``httpx.AsyncClient`` and at most
+``OPENLIBRARY_CONCURRENCY`` of them are in flight at once for each client,
+so an import of a long list of ISBNs doesn't flood Open Library. Like the
+sync lookups in ``catalog.metadata``, they are rate limited, retried and
+cut off when Open Library keeps failing by ``catalog.upstream``.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import httpx
+from django.conf import settings
+
+from catalog import upstream
+from catalog.metadata import map_record
+from catalog.upstream import ServiceError
+
+logger = logging.getLogger(__name__)
+
+
+class OpenLibraryClient:
+    def __init__(self, client: httpx.AsyncClient, concurrency: int):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(self, method: str, url: str, upstream_name: str = 'openlibrary', **kwargs) -> httpx.Response:
+        async with self.semaphore:
+            return await upstream.get(upstream_name).acall(self.send, method, url, **kwargs)
+
+    async def send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            raise ServiceError(str(e)) from e
+        if response.status_code >= 500:
+            raise ServiceError(f'{url} returned status {response.status_code}')
+        return response
+
+    async def metadata(self, isbn: str) -> dict:
+        """Metadata for an ISBN from the books API, in the same form as ``isbnlib.meta()``.
+
+        Returns an empty dictionary if Open Library has no record for the ISBN."""
+        response = await self.request('GET', f'{settings.OPENLIBRARY_URL}/api/books', params={
+            'bibkeys': f'ISBN:{isbn}',
+            'format': 'json',
+            'jscmd': 'data',
+        })
+        if response.is_error:
+            raise ServiceError(f'Open Library returned status {response.status_code} for {isbn}')
+        record = response.json().get(f'ISBN:{isbn}')
+        if not record:
+            return {}
+        return map_record(isbn, record)
+
+    async def physical_format(self, isbn: str) -> str:
+        """The format of an ISBN, or "?" if it isn't known or Open Library is unavailable."""
+        try:
+            response = await self.request(
+                'GET', f'{settings.OPENLIBRARY_URL}/isbn/{isbn}.json', follow_redirects=True,
+            )
+        except ServiceError as e:
+            logger.warning('Could not look up the format of %s: %s', isbn, e)
+            return '?'
+        return response.json().get('physical_format', '?').lower() if response.is_success else '?'
+
+    async def cover_available(self, url: str) -> bool:
+        response = await self.request('HEAD', url, upstream_name='covers')
+        return response.is_success and 'content-type' in response.headers
+
+
+@asynccontextmanager
+async def client() -> AsyncIterator[OpenLibraryClient]:
+    concurrency = settings.OPENLIBRARY_CONCURRENCY
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=settings.OPENLIBRARY_TIMEOUT, limits=limits) as http_client:
+        yield OpenLibraryClient(http_client, concurrency)
@@ -0,0 +1,120 @@
+"""
+Keeps data stored for browsing up to date:
+
+- the category membership of books (see ``Category``), when their tags or
+  credits change, when tags are renamed, and when categories are added or
+  their rules changed;
+- the credits shown by ``Book.__str__()`` (``Book.display_credits``), when
+  the credits of books change and when persons are renamed;
+- the books matching saved searches (see ``SavedSearch``), when books are
+  added or changed, and when their credits, tags, series or categories
+  change; only the searches that filter on what changed are updated.
+"""
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from catalog.models import Book, Category, Credit, Person, SavedSearch, Series, SeriesMembership, Tag
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance: Book, created: bool, raw=False, **kwargs):
+    # a new book without any tags or credits can already match a rule, such as a category
+    # of books without certain tags
+    if raw:
+        return
+    if created:
+        Category.update_for([instance.id])
+    SavedSearch.update_for([instance.id], None if created else 'book')
+
+
+# Book.persons goes through Credit, but adding persons to a book creates the credits without
+# sending post_save for them
+@receiver(m2m_changed, sender=Book.tags.through)
+@receiver(m2m_changed, sender=Book.persons.through)
+def relation_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # clearing the books of a tag or person; find out which books they are before they're gone
+        instance._cleared_book_ids = list(instance.books.values_list('id', flat=True))
+        return
+    if action in ('post_add', 'post_remove'):
+        book_ids = pk_set if reverse else [instance.id]
+    elif action == 'post_clear':
+        book_ids = getattr(instance, '_cleared_book_ids', []) if reverse else [instance.id]
+    else:
+        return
+    Category.update_for(book_ids)
+    if sender is Book.persons.through:
+        Book.update_display_credits(book_ids)
+        SavedSearch.update_for(book_ids, 'credits')
+    else:
+        SavedSearch.update_for(book_ids, 'tags')
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance: Tag, created: bool, raw=False, **kwargs):
+    # a renamed tag can start or stop matching the rules
+    if not created and not raw:
+        book_ids = list(instance.books.values_list('id', flat=True))
+        Category.update_for(book_ids)
+        SavedSearch.update_for(book_ids, 'tags')
+
+
+@receiver(post_save, sender=Credit)
+def credit_saved(sender, instance: Credit, raw=False, **kwargs):
+    if not raw:
+        Category.update_for([instance.book_id])
+        Book.update_display_credits([instance.book_id])
+        SavedSearch.update_for([instance.book_id], 'credits')
+
+
+@receiver(post_delete, sender=Credit)
+def credit_deleted(sender, instance: Credit, origin=None, **kwargs):
+    # nothing to update when the credits are deleted along with their books
+    if isinstance(origin, Book) or getattr(origin, 'model', None) is Book:
+        return
+    Category.update_for([instance.book_id])
+    Book.update_display_credits([instance.book_id])
+    SavedSearch.update_for([instance.book_id], 'credits')
+
+
+@receiver(post_save, sender=Person)
+def person_saved(sender, instance: Person, created: bool, raw=False, **kwargs):
+    # the person may have been renamed; only the books that show a different name are written
+    if not created and not raw:
+        book_ids = list(Credit.objects.filter(person=instance).values_list('book_id', flat=True))
+        Book.update_display_credits(book_ids)
+        SavedSearch.update_for(book_ids, 'credits')
+
+
+@receiver(post_save, sender=SeriesMembership)
+@receiver(post_delete, sender=SeriesMembership)
+def series_membership_changed(sender, instance: SeriesMembership, raw=False, origin=None, **kwargs):
+    if raw or isinstance(origin, Book) or getattr(origin, 'model', None) is Book:
+        return
+    SavedSearch.update_for([instance.book_id], 'series')
+
+
+@receiver(post_save, sender=Series)
+def series_saved(sender, instance: Series, created: bool, raw=False, **kwargs):
+    # a renamed series can start or stop matching the searches
+    if not created and not raw:
+        SavedSearch.update_for(instance.books.values_list('id', flat=True), 'series')
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance: Category, raw=False, **kwargs):
+    if not raw:
+        instance.update_books()
+        SavedSearch.update_all('categories')
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance: Category, **kwargs):
+    SavedSearch.update_all('categories')
+
+
+@receiver(post_save, sender=SavedSearch)
+def saved_search_saved(sender, instance: SavedSearch, raw=False, **kwargs):
+    if not raw:
+        instance.update_books()
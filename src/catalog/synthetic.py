@@ -0,0 +1,13 @@
+"""
+Synthetic data for the generated catalogs, benchmarks and load tests.
+"""
+
+
+def isbn13(i: int, prefix: str = '978') -> str:
+    """The i-th ISBN-13 with the given prefix, with a valid check digit.
+
+    The generated catalogs use the "978" prefix; benchmarks and load tests
+    add books with "979", so they don't collide with the generated ones."""
+    digits = f'{prefix}{i:09d}'
+    total = sum(int(d) * (1 if n % 2 == 0 else 3) for n, d in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
@@ -8,3 +8,10 @@ def paginate(context, page_links=None):
     if page_links is None:
         page_links = context.get('page_links')
     return {'page_links': page_links}
+
+
+@register.inclusion_tag('catalog/cursor_pagination.html', takes_context=True)
+def paginate_cursor(context, page_links=None):
+    if page_links is None:
+        page_links = context.get('page_links')
+    return {'page_links': page_links}
@@ -1,3 +1,1247 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from base64 import urlsafe_b64encode
+from collections import defaultdict
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import (
+    LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from catalog import dumps, enrichment, fake_openlibrary, filters, loadtest, metadata, upstream
+from catalog.admin import EstimatedCountPaginator
+from catalog.listing import ROW_FIELDS, book_rows
+from catalog.management.commands.loadtest import free_port, wait_for_server
+from catalog.metadata import ServiceError
+from catalog.models import (
+    Book, Category, ClassifierTask, Collection, Credit, OpenLibraryEdition, Person, SavedSearch, Series,
+    SeriesMembership, Tag,
+)
+from catalog.utils import KeysetPaginator, estimated_count, parse_publication_date, sync_iterator
+from ibis import instrumentation, routers
+from ibis.storage import StaticFilesStorage
+
+# time that django.setup() may take in a fresh interpreter, in seconds
+IMPORT_TIME_BUDGET = 1.0
+
+# imported by catalog.metadata when needed, never when the app loads
+LAZY_MODULES = ['httpx', 'isbnlib', 'nameparser', 'requests', 'titlecase']
+
+SETUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+print(json.dumps({'duration': time.perf_counter() - start, 'modules': sorted(sys.modules)}))
+"""
+
+
+class ImportTimeTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # the fastest of a few runs, to keep the test stable on a busy machine
+        cls.runs = [cls.run_setup() for _ in range(3)]
+
+    @staticmethod
+    def run_setup() -> dict:
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'ibis.settings'}
+        result = subprocess.run(
+            [sys.executable, '-c', SETUP_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        return json.loads(result.stdout)
+
+    def test_setup_within_budget(self):
+        duration = min(run['duration'] for run in self.runs)
+        self.assertLess(duration, IMPORT_TIME_BUDGET, f'django.setup() took {duration:.3f} s')
+
+    def test_metadata_dependencies_not_imported(self):
+        modules = set(self.runs[0]['modules'])
+        self.assertEqual([name for name in LAZY_MODULES if name in modules], [])
+
+
+def migrated_database(test: SimpleTestCase) -> str:
+    """The URL of a new SQLite database with the tables of the apps, for servers
+    started by a test, which can't use the test database; removed after the test."""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    url = f'sqlite:///{directory.name}/ibis.db'
+    subprocess.run(
+        [sys.executable, 'manage.py', 'migrate', '--no-input'],
+        cwd=settings.BASE_DIR, env={**os.environ, 'DATABASE_URL': url}, capture_output=True, check=True,
+    )
+    return url
+
+
+def write_log(test: SimpleTestCase, entries: list[dict]) -> str:
+    """A request log for the load test, removed after the test."""
+    fd, path = tempfile.mkstemp(suffix='.jsonl')
+    test.addCleanup(os.remove, path)
+    with os.fdopen(fd, 'w') as fh:
+        fh.writelines(json.dumps(entry) + '\n' for entry in entries)
+    return path
+
+
+class ReplayTests(LiveServerTestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Dubliners')
+        Person.objects.create(name='James Joyce')
+
+    def test_report(self):
+        log = write_log(self, [
+            {'method': 'GET', 'path': '/books/', 'query': {'tag': 'poetry'}},
+            {'method': 'GET', 'path': '/books/{book_id}'},
+            {'method': 'GET', 'path': '/books/persons/{person_id}'},
+            {'method': 'POST', 'path': '/books/', 'body': {'action': 'tag', 'tag': 'poetry', 'book_id': ['{book_id}']}},
+            {'method': 'GET', 'path': '/books/0'},
+        ])
+        replayer = loadtest.Replayer(self.live_server_url, loadtest.TemplateValues(seed=0))
+        report = loadtest.replay(loadtest.read_log(log) * 2, replayer, concurrency=2)
+        summary = report.summary()
+
+        self.assertEqual(summary['requests'], 10)
+        self.assertEqual(
+            {name: (stats['requests'], stats['errors']) for name, stats in summary['urls'].items()},
+            {'index': (4, 0), 'show_book': (4, 2), 'show_person': (2, 0)},
+        )
+        self.assertEqual(summary['error_rate'], 0.2)
+        for stats in summary['urls'].values():
+            self.assertLessEqual(stats['p50_ms'], stats['p90_ms'])
+            self.assertLessEqual(stats['p90_ms'], stats['max_ms'])
+        # the POSTs passed the CSRF check
+        self.assertEqual(list(self.book.tags.values_list('value', flat=True)), ['poetry'])
+
+
+class LoadTestServeTests(TestCase):
+    def test_served(self):
+        log = write_log(self, [
+            {'method': 'GET', 'path': '/books/'},
+            {'method': 'GET', 'path': '/books/persons/'},
+            {'method': 'POST', 'path': '/books/isbn_import', 'body': {'isbn': '{isbn}'}},
+        ])
+        stdout = StringIO()
+        with mock.patch.dict(os.environ, {'DATABASE_URL': migrated_database(self)}):
+            call_command('loadtest', log, serve='wsgi', concurrency=2, loops=2, stdout=stdout, stderr=StringIO())
+
+        summary = json.loads(stdout.getvalue())
+        self.assertEqual(summary['requests'], 6)
+        self.assertEqual(summary['error_rate'], 0)
+        self.assertEqual(set(summary['urls']), {'index', 'person_index', 'import_by_isbn'})
+
+
+class StaticFilesStorageTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # a static root without the manifest of collectstatic
+        self.storage = StaticFilesStorage(location=directory.name, base_url='/static/')
+
+    def test_fallback(self):
+        with override_settings(STATIC_MANIFEST_FALLBACK=True):
+            self.assertEqual(self.storage.url('catalog/index.css'), '/static/catalog/index.css')
+
+    def test_strict(self):
+        with override_settings(STATIC_MANIFEST_FALLBACK=False):
+            with self.assertRaisesMessage(ValueError, 'catalog/index.css'):
+                self.storage.url('catalog/index.css')
+
+
+@override_settings(INSTRUMENTATION=True)
+class SlowQueryTests(SimpleTestCase):
+    def test_response_not_waiting_for_explain(self):
+        explaining = threading.Event()
+
+        def explain(alias, sql, params):
+            explaining.wait(5)
+            return 'Seq Scan on catalog_book'
+
+        def view(request):
+            instrumentation.current().slow_queries.append(
+                instrumentation.QuerySample('default', 'SELECT 1', (), 2.0),
+            )
+            return HttpResponse()
+
+        middleware = instrumentation.InstrumentationMiddleware(view)
+        with mock.patch('ibis.instrumentation.explain', side_effect=explain), \
+                mock.patch('catalog.models.SlowQuery.record') as record, \
+                self.assertLogs('ibis.instrumentation', 'INFO'):
+            response = middleware(RequestFactory().get('/books/?tag=poetry'))
+            self.assertEqual(response.status_code, 200)
+            record.assert_not_called()
+
+            explaining.set()
+            instrumentation._slow_queries.join()
+
+        record.assert_called_once()
+        self.assertEqual(record.call_args.kwargs['plan'], 'Seq Scan on catalog_book')
+        self.assertEqual(record.call_args.kwargs['path'], '/books/?tag=poetry')
+
+
+@override_settings(INSTRUMENTATION=True)
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        Book.objects.create(title='Harmonium')
+
+    def get(self, path):
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('ibis.instrumentation', 'INFO') as logs:
+            response = self.client.get(path)
+        self.assertEqual(len(logs.records), 1)
+        return response, len(queries), logs.records[0]
+
+    def test_server_timing(self):
+        response, query_count, _ = self.get(reverse('index'))
+        entries = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(list(entries), ['db', 'tpl', 'total'])
+        self.assertRegex(entries['db'], rf'^dur=[\d.]+;desc="Database \({query_count}\)"$')
+        self.assertRegex(entries['tpl'], r'^dur=[\d.]+;desc="Templates \(1\)"$')
+        self.assertRegex(entries['total'], r'^dur=[\d.]+$')
+
+    def test_log_line(self):
+        _, query_count, record = self.get(reverse('index') + '?tag=poetry')
+        self.assertEqual(record.levelname, 'INFO')
+        self.assertTrue(record.getMessage().startswith('method=GET path=/books/ view=index status=200 slow=False '))
+        self.assertEqual(
+            {key: record.metrics[key] for key in ('db_count', 'tpl_count', 'filters')},
+            {'db_count': query_count, 'tpl_count': 1, 'filters': 'tag=poetry'},
+        )
+        self.assertGreaterEqual(record.metrics['total_ms'], record.metrics['db_ms'])
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_request(self):
+        _, _, record = self.get(reverse('index'))
+        self.assertEqual(record.levelname, 'WARNING')
+        self.assertIs(record.metrics['slow'], True)
+
+    @override_settings(INSTRUMENTATION=False)
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            instrumentation.InstrumentationMiddleware(lambda request: HttpResponse())
+        with self.assertNoLogs('ibis.instrumentation'):
+            response = self.client.get(reverse('index'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class PreforkServerTests(SimpleTestCase):
+    def test_serve_and_stop(self):
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        env = {
+            **os.environ,
+            'DATABASE_URL': migrated_database(self),
+            'ALLOWED_HOSTS': '127.0.0.1',
+            'STATIC_MANIFEST_FALLBACK': 'true',
+        }
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'ibis.server', '--host', '127.0.0.1', '--port', str(port),
+             '--workers', '2', '--graceful-timeout', '5'],
+            cwd=settings.BASE_DIR, env=env, stderr=subprocess.PIPE, text=True,
+        )
+        self.addCleanup(server.stderr.close)
+        self.addCleanup(server.kill)
+
+        wait_for_server(base_url, timeout=30)
+        response = requests.get(base_url + '/books/', timeout=10)
+        self.assertEqual(response.status_code, 200)
+
+        server.send_signal(signal.SIGTERM)
+        self.assertEqual(server.wait(timeout=15), 0)
+        log = server.stderr.read()
+        self.assertIn('Shutting down', log)
+        # the workers stopped by themselves, within the graceful timeout
+        self.assertNotIn('did not stop in time', log)
+        self.assertNotIn('Traceback', log)
+        with self.assertRaises(ConnectionRefusedError):
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+
+
+@override_settings(REPLICA_STICKINESS=10)
+class ReplicaRoutingTests(TransactionTestCase):
+    """The database chosen for reads, which is looked up but not queried, as
+    the replica is an alias the test database doesn't have."""
+
+    def setUp(self):
+        self.enterContext(mock.patch('ibis.routers.replicas', return_value=['replica1']))
+        # the router finds the replicas when it's created
+        self.enterContext(override_settings(DATABASE_ROUTERS=['ibis.routers.ReplicaRouter']))
+
+    @staticmethod
+    def view(request):
+        if 'write' in request.GET:
+            Tag.objects.create(value='poetry')
+        if 'atomic' in request.GET:
+            with transaction.atomic():
+                return HttpResponse(Book.objects.all().db)
+        return HttpResponse(Book.objects.all().db)
+
+    def get_response(self, request):
+        return routers.ReplicaMiddleware(self.view)(request)
+
+    def test_reads_of_request(self):
+        factory = RequestFactory()
+        for request, alias, sticky in (
+            (factory.get('/'), 'replica1', False),
+            (factory.head('/'), 'replica1', False),
+            (factory.post('/'), 'default', True),
+            (factory.get('/?write'), 'default', True),
+            (factory.get('/?atomic'), 'default', False),
+        ):
+            with self.subTest(method=request.method, path=request.get_full_path()):
+                response = self.get_response(request)
+                self.assertEqual(response.content.decode(), alias)
+                self.assertEqual(routers.PRIMARY_COOKIE in response.cookies, sticky)
+
+    def test_sticky_after_write(self):
+        cookie = self.get_response(RequestFactory().post('/')).cookies[routers.PRIMARY_COOKIE]
+        self.assertEqual(cookie['max-age'], 10)
+        self.assertTrue(cookie['httponly'])
+
+        # until the cookie expires, the client's reads stay on the primary
+        request = RequestFactory().get('/')
+        request.COOKIES[routers.PRIMARY_COOKIE] = cookie.value
+        response = self.get_response(request)
+        self.assertEqual(response.content, b'default')
+        # a read doesn't extend the stickiness
+        self.assertNotIn(routers.PRIMARY_COOKIE, response.cookies)
+
+    def test_outside_request(self):
+        self.assertEqual(Book.objects.all().db, 'default')
+
+    async def test_async_request(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = routers.ReplicaMiddleware(view)
+        response = await middleware(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'replica1')
+        response = await middleware(RequestFactory().post('/'))
+        self.assertEqual(response.content, b'default')
+        self.assertIn(routers.PRIMARY_COOKIE, response.cookies)
+
+    def test_not_used_without_replicas(self):
+        with mock.patch('ibis.routers.replicas', return_value=[]):
+            with self.assertRaises(MiddlewareNotUsed):
+                routers.ReplicaMiddleware(self.view)
+            self.assertEqual(routers.ReplicaRouter().db_for_read(Book), 'default')
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.profile_dir = directory.name
+        Book.objects.create(title='Dubliners')
+
+    def get_profiled(self, is_staff: bool, mode: str):
+        self.client.force_login(User.objects.create(username='reader', is_staff=is_staff))
+        # sampled often enough to catch the view of a small index
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_SAMPLE_INTERVAL=0.1):
+            return self.client.get(reverse('index'), {'_profile': mode})
+
+    def test_staff_request_profiled(self):
+        for mode in ('sample', 'trace'):
+            with self.subTest(mode=mode):
+                User.objects.all().delete()
+                response = self.get_profiled(True, mode)
+                stacks = os.path.join(self.profile_dir, response['X-Profile-Stacks'])
+                with open(stacks) as fh:
+                    self.assertIn('catalog.views.IndexView.get', fh.read())
+                self.assertIn('functions by inclusive', response.content.decode())
+
+    async def test_async_request_profiled(self):
+        user = await User.objects.acreate(username='reader', is_staff=True)
+        await self.async_client.aforce_login(user)
+        with override_settings(PROFILE_DIR=self.profile_dir):
+            response, _ = await asyncio.gather(
+                self.async_client.get(reverse('index'), {'_profile': 'trace'}),
+                self.async_client.get(reverse('person_index')),
+            )
+        with open(os.path.join(self.profile_dir, response['X-Profile-Stacks'])) as fh:
+            stacks = fh.read()
+        # the sync view runs in a worker thread, which is recorded, but the other request isn't
+        self.assertIn('catalog.views.IndexView.get', stacks)
+        self.assertNotIn('catalog.views.PersonIndexView', stacks)
+
+    def test_other_request_not_profiled(self):
+        response = self.get_profiled(False, 'trace')
+        self.assertNotIn('X-Profile-Stacks', response)
+        self.assertContains(response, 'Dubliners')
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+
+class ClassifierEnrichmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title='Dubliners', isbn='9780140186475')
+        self.options = enrichment.Options(backoff=0)
+
+    def stub_classify(self, *results):
+        """Stub classifier lookups, which return (or raise) the given results in turn."""
+        patcher = mock.patch('catalog.metadata.classifier_tags', side_effect=results)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_enqueue_missing(self):
+        Book.objects.create(title='No ISBN', isbn='')
+        classified = Book.objects.create(title='Classified', isbn='9780141182803')
+        classified.tags.add(Tag.objects.create(namespace='ddc', value='823.912'))
+
+        self.assertEqual(enrichment.enqueue_missing(), 1)
+        self.assertEqual(enrichment.enqueue_missing(), 0)
+        self.assertEqual(list(ClassifierTask.objects.values_list('book', flat=True)), [self.book.id])
+
+    def test_import_queues_book(self):
+        book = Book.create_from_metadata('9780141182803', {'Title': 'Ulysses'}, 'paperback')
+        self.assertTrue(ClassifierTask.objects.filter(book=book).exists())
+
+    def test_tags_added(self):
+        existing = Tag.objects.create(namespace='ddc', value='823.912')
+        ClassifierTask.objects.create(book=self.book)
+        self.stub_classify(['ddc:823.912', 'fast:1234;Fiction'])
+
+        result = enrichment.run(self.options)
+
+        self.assertEqual((result.tagged, result.failed), (1, 0))
+        self.assertEqual(sorted(map(str, self.book.tags.all())), ['ddc:823.912', 'fast:1234;Fiction'])
+        self.assertEqual(Tag.objects.filter(namespace='ddc').get(), existing)
+        self.assertFalse(ClassifierTask.objects.exists())
+
+    def test_lookup_retried(self):
+        ClassifierTask.objects.create(book=self.book)
+        classify = self.stub_classify(ServiceError('down'), ['ddc:823.912'])
+
+        result = enrichment.run(self.options)
+
+        self.assertEqual((result.tagged, result.failed), (1, 0))
+        self.assertEqual(classify.call_count, 2)
+
+    def test_failed_task_rescheduled(self):
+        task = ClassifierTask.objects.create(book=self.book)
+        classify = self.stub_classify(*[ServiceError('down')] * 3)
+
+        with self.assertLogs('catalog.enrichment', 'WARNING'):
+            result = enrichment.run(self.options)
+
+        self.assertEqual((result.tagged, result.failed), (0, 1))
+        self.assertEqual(classify.call_count, self.options.retries + 1)
+        task.refresh_from_db()
+        self.assertEqual((task.attempts, task.error), (1, 'down'))
+        self.assertGreater(task.next_attempt, timezone.now())
+        # not due again yet
+        self.assertEqual(enrichment.run(self.options).failed, 0)
+
+    def test_invalid_isbn_not_blocking(self):
+        from isbnlib import NotValidISBNError
+
+        invalid = Book.objects.create(title='Typo', isbn='978014018647')
+        task = ClassifierTask.objects.create(book=invalid, next_attempt=timezone.now() - timedelta(days=1))
+        ClassifierTask.objects.create(book=self.book)
+        self.stub_classify(NotValidISBNError(invalid.isbn), ['ddc:823.912'])
+
+        with self.assertLogs('catalog.enrichment', 'WARNING'):
+            result = enrichment.run(enrichment.Options(backoff=0, workers=1))
+
+        self.assertEqual((result.tagged, result.failed), (1, 1))
+        task.refresh_from_db()
+        self.assertEqual(task.attempts, self.options.max_attempts)
+        self.assertIn('NotValidISBNError', task.error)
+        # no longer due, so it doesn't hold up later runs
+        self.assertEqual(enrichment.run(self.options).failed, 0)
+
+    def test_lookups_cached(self):
+        ClassifierTask.objects.create(book=self.book)
+        other = Book.objects.create(title='Dubliners', isbn=self.book.isbn)
+        classify = self.stub_classify(['ddc:823.912'])
+
+        enrichment.run(self.options)
+        ClassifierTask.objects.create(book=other)
+        enrichment.run(self.options)
+
+        self.assertEqual(classify.call_count, 1)
+        self.assertEqual(list(map(str, other.tags.all())), ['ddc:823.912'])
+
+    def test_command(self):
+        self.stub_classify(['ddc:823.912'])
+        out = StringIO()
+        call_command('enrich_classifiers', '--enqueue-missing', '--backoff', '0', stdout=out)
+        self.assertIn('Tagged 1 books, 0 failed', out.getvalue())
+
+
+def dump_line(record_type: str, record: dict) -> str:
+    return '\t'.join([record_type, record['key'], '1', '2024-01-01T00:00:00', json.dumps(record)]) + '\n'
+
+
+class OpenLibraryDumpTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.authors = os.path.join(directory.name, 'authors.txt.gz')
+        self.editions = os.path.join(directory.name, 'editions.txt.gz')
+        self.write_dump(self.authors, [
+            dump_line('/type/author', {'key': '/authors/OL1A', 'name': 'James Joyce'}),
+            dump_line('/type/redirect', {'key': '/authors/OL2A', 'location': '/authors/OL1A'}),
+        ])
+        self.write_dump(self.editions, [
+            dump_line('/type/edition', {
+                'key': '/books/OL1M',
+                'title': 'Dubliners',
+                'subtitle': 'Stories',
+                'authors': [{'key': '/authors/OL1A'}],
+                'publishers': ['Penguin'],
+                'publish_date': 'June 1993',
+                'physical_format': 'Paperback',
+                'isbn_10': ['0140186476'],
+                'isbn_13': ['9780140186475'],
+            }),
+            dump_line('/type/edition', {'key': '/books/OL2M', 'title': 'No ISBN'}),
+            'not a record\n',
+        ])
+
+    @staticmethod
+    def write_dump(path: str, lines: list[str]):
+        with gzip.open(path, 'wt', encoding='utf-8') as fh:
+            fh.writelines(lines)
+
+    def test_load(self):
+        self.assertEqual(dumps.load_authors(self.authors), 1)
+        self.assertEqual(dumps.load_editions(self.editions), 1)
+
+        edition = OpenLibraryEdition.objects.get()
+        self.assertEqual(edition.metadata(), {
+            'ISBN-13': '9780140186475',
+            'Title': 'Dubliners - Stories',
+            'Authors': ['James Joyce'],
+            'Publisher': 'Penguin',
+            'Year': '1993',
+        })
+        self.assertEqual(edition.book_format(), 'paperback')
+
+    def test_load_again_updates(self):
+        call_command('load_openlibrary_dump', authors=self.authors, editions=self.editions, stdout=StringIO())
+        self.write_dump(self.authors, [dump_line('/type/author', {'key': '/authors/OL1A', 'name': 'J. Joyce'})])
+        call_command('load_openlibrary_dump', authors=self.authors, editions=self.editions, stdout=StringIO())
+        self.assertEqual(OpenLibraryEdition.objects.get().authors, ['J. Joyce'])
+
+    def test_import_without_network(self):
+        call_command('load_openlibrary_dump', authors=self.authors, editions=self.editions, stdout=StringIO())
+        with mock.patch('catalog.openlibrary.OpenLibraryClient.metadata', side_effect=ServiceError('offline')):
+            response = self.client.post(reverse('import_by_isbn'), {'isbn': '0140186476'})
+        book = Book.objects.get(isbn='0140186476')
+        self.assertRedirects(response, reverse('show_book', args=[book.pk]), fetch_redirect_response=False)
+        self.assertEqual((book.title, book.subtitle, book.format), ('Dubliners', 'Stories', 'paperback'))
+        self.assertEqual(str(book), 'Dubliners, by James Joyce')
+
+
+class OpenLibraryLookupTests(TestCase):
+    def setUp(self):
+        server = fake_openlibrary.start_in_thread()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.enterContext(override_settings(OPENLIBRARY_URL=f'http://127.0.0.1:{server.server_port}'))
+        self.addCleanup(upstream._upstreams.clear)
+        upstream._upstreams.clear()
+
+    def test_meta_from_configured_url(self):
+        record = fake_openlibrary.edition_record('9780140186475')
+        isbn_metadata = metadata.meta('0140186476')
+        self.assertEqual(isbn_metadata['ISBN-13'], '9780140186475')
+        self.assertEqual(isbn_metadata['Title'].split(' - ')[0], record['title'])
+        self.assertEqual(isbn_metadata['Authors'], [author['name'] for author in record['authors']])
+
+    def test_import(self):
+        record = fake_openlibrary.edition_record('9780140186475')
+        response = self.client.post(reverse('import_by_isbn'), {'isbn': '9780140186475'})
+        book = Book.objects.get(isbn='9780140186475')
+        self.assertRedirects(response, reverse('show_book', args=[book.pk]), fetch_redirect_response=False)
+        self.assertEqual(book.title, metadata.split_title(record['title'])[0])
+        self.assertEqual(book.publisher, record['publishers'][0]['name'])
+
+        # imported again, the book is found rather than looked up
+        with mock.patch('catalog.openlibrary.OpenLibraryClient.metadata') as lookup:
+            response = self.client.post(reverse('import_by_isbn'), {'isbn': '9780140186475'})
+        self.assertRedirects(response, reverse('show_book', args=[book.pk]), fetch_redirect_response=False)
+        lookup.assert_not_called()
+
+    def test_import_errors(self):
+        response = self.client.post(reverse('import_by_isbn'), {'isbn': '123'})
+        content = b''.join(response.streaming_content).decode()
+        self.assertRegex(content, r'<td>123</td>\s*<td>False</td>')
+        self.assertIn('Imported 0 of 1 ISBN.', content)
+
+    async def test_same_as_async_client(self):
+        async with metadata.openlibrary_client() as client:
+            async_metadata = await client.metadata('9780140186475')
+        self.assertEqual(await sync_to_async(metadata.meta)('9780140186475'), async_metadata)
+
+
+@override_settings(
+    UPSTREAM_RATE=1000, UPSTREAM_BURST=10, UPSTREAM_MAX_WAIT=1, UPSTREAM_RETRIES=2, UPSTREAM_BACKOFF=0,
+    UPSTREAM_FAILURE_THRESHOLD=3, UPSTREAM_RESET_TIMEOUT=60,
+)
+class UpstreamTests(SimpleTestCase):
+    def setUp(self):
+        # the upstreams are shared by the process, and made again here with the settings above
+        self.addCleanup(upstream._upstreams.clear)
+        upstream._upstreams.clear()
+        self.upstream = upstream.get('test')
+
+    def test_retried(self):
+        func = mock.Mock(side_effect=[ServiceError('down'), 'result'])
+        self.assertEqual(self.upstream.call(func), 'result')
+        self.assertEqual(func.call_count, 2)
+
+    def test_circuit_opens(self):
+        func = mock.Mock(side_effect=ServiceError('down'))
+        with self.assertRaises(ServiceError), self.assertLogs('catalog.upstream', 'WARNING'):
+            self.upstream.call(func)
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(upstream.circuit_states(), {'test_circuit': 'open'})
+
+        # fails fast without calling
+        with self.assertRaises(upstream.RejectedError):
+            self.upstream.call(func)
+        self.assertEqual(func.call_count, 3)
+
+    def test_circuit_closes_after_trial(self):
+        with self.assertRaises(ServiceError), self.assertLogs('catalog.upstream', 'WARNING'):
+            self.upstream.call(mock.Mock(side_effect=ServiceError('down')))
+        self.upstream.breaker.opened -= 60
+        self.assertEqual(self.upstream.breaker.state, 'half-open')
+
+        self.assertEqual(self.upstream.call(mock.Mock(return_value='result')), 'result')
+        self.assertEqual(upstream.circuit_states(), {})
+
+    def test_cancelled_trial_releases_circuit(self):
+        with self.assertRaises(ServiceError), self.assertLogs('catalog.upstream', 'WARNING'):
+            self.upstream.call(mock.Mock(side_effect=ServiceError('down')))
+        self.upstream.breaker.opened -= 60
+
+        async def cancelled():
+            raise asyncio.CancelledError
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(self.upstream.acall(cancelled))
+        with self.assertRaises(KeyError):
+            self.upstream.call(mock.Mock(side_effect=KeyError('title')))
+        # the circuit is still half-open, and lets the next trial call through
+        self.assertEqual(self.upstream.breaker.state, 'half-open')
+        self.assertEqual(self.upstream.call(mock.Mock(return_value='result')), 'result')
+
+    @override_settings(UPSTREAM_RATE=1, UPSTREAM_BURST=2, UPSTREAM_MAX_WAIT=0.1)
+    def test_rate_limited(self):
+        self.upstream = upstream.Upstream('test')
+        func = mock.Mock(return_value='result')
+        self.upstream.call(func)
+        self.upstream.call(func)
+        with self.assertRaises(upstream.RejectedError):
+            self.upstream.call(func)
+        self.assertEqual(func.call_count, 2)
+
+    def test_format_lookup_degrades(self):
+        with mock.patch('catalog.upstream.http', side_effect=ServiceError('down')) as http:
+            with self.assertLogs('catalog', 'WARNING'):
+                self.assertEqual(metadata.physical_format('9780140186475'), '?')
+                self.assertEqual(metadata.physical_format('9780140186475'), '?')
+        # the second lookup was rejected, without a request
+        self.assertEqual(http.call_count, 3)
+
+
+class PublicationDateTests(TestCase):
+    def test_parse(self):
+        for value, parts in (
+            ('1999', (1999, None, None)),
+            ('1999-05-12', (1999, 5, 12)),
+            ('May 1999', (1999, 5, None)),
+            ('12 May 1999', (1999, 5, 12)),
+            ('Sept. 3rd, 1999', (1999, 9, 3)),
+            ('c1985', (1985, None, None)),
+            ('1999-13', (1999, None, None)),
+            ('1999-02-32', (1999, 2, None)),
+            ('?', (None, None, None)),
+            ('', (None, None, None)),
+        ):
+            with self.subTest(value=value):
+                self.assertEqual(parse_publication_date(value), parts)
+
+    def test_save(self):
+        book = Book.objects.create(title='Harmonium', publication_date='May 1923')
+        book.publication_date = '12 June 1931'
+        book.save(update_fields=['publication_date'])
+        book.refresh_from_db()
+        self.assertEqual((book.publication_year, book.publication_month, book.publication_day), (1931, 6, 12))
+
+    def test_year_filters(self):
+        books = {
+            year: Book.objects.create(title=str(year), publication_date=str(year)) for year in (1985, 1990, 1999, 2005)
+        }
+        Book.objects.create(title='Undated', publication_date='?')
+        for param, value, years in (
+            ('year', '1990', [1990]),
+            ('year', '1990..1999', [1990, 1999]),
+            ('year', '1990..', [1990, 1999, 2005]),
+            ('year', '..1990', [1985, 1990]),
+            ('year>', '1990', [1999, 2005]),
+            ('year<', '1990', [1985]),
+        ):
+            with self.subTest(param=param, value=value):
+                condition = filters.FILTER_TEMPLATES[param](value)
+                self.assertEqual(set(Book.objects.filter(condition)), {books[year] for year in years})
+
+        # values that aren't years are ignored
+        for param, value in (('year', 'nineties'), ('year', '1990..later'), ('year', '..'), ('year>', '?')):
+            with self.subTest(param=param, value=value):
+                self.assertIsNone(filters.FILTER_TEMPLATES[param](value))
+
+    def test_add_filter(self):
+        for name, operation, status in (
+            ('year', '>', 302),
+            ('year', '', 302),
+            ('title', '^', 302),
+            # the index offers every operator for every filter, but not all of them exist
+            ('title', '>', 400),
+            ('year', '~', 400),
+        ):
+            with self.subTest(name=name, operation=operation):
+                response = self.client.post(reverse('index'), {
+                    'filter_name': name, 'filter_operation': operation, 'filter_value': '1990',
+                })
+                self.assertEqual(response.status_code, status)
+                if status == 302:
+                    self.assertEqual(response['Location'], 'http://testserver/books/?' + urlencode({name + operation: 1990}))
+
+
+class TagNamespaceTests(TestCase):
+    def setUp(self):
+        self.ddc = Tag.objects.create(namespace='ddc', value='823.912')
+        self.plain = Tag.objects.create(value='823.912')
+        self.novel = Tag.objects.create(value='novel')
+        self.book = Book.objects.create(title='Ulysses')
+        self.book.tags.add(self.ddc)
+        self.other = Book.objects.create(title='Untitled')
+        self.other.tags.add(self.plain, self.novel)
+
+    def test_parse(self):
+        for text, fields in (
+            ('novel', {'namespace': '', 'value': 'novel'}),
+            ('ddc:823.912', {'namespace': 'ddc', 'value': '823.912'}),
+            ('DDC:823.912', {'namespace': 'ddc', 'value': '823.912'}),
+            ('fast:1234;Fiction: Irish', {'namespace': 'fast', 'value': '1234;Fiction: Irish'}),
+            ('1984:a novel', {'namespace': '', 'value': '1984:a novel'}),
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(Tag.parse(text), fields)
+
+    def test_matching(self):
+        tags = Tag.objects.filter(Tag.matching(['ddc:823.912', 'novel', 'lcc:PR6019']))
+        self.assertEqual(set(tags), {self.ddc, self.novel})
+        self.assertFalse(Tag.objects.filter(Tag.matching([])).exists())
+        books = Book.objects.filter(Tag.matching(['823.912'], prefix='tags__'))
+        self.assertEqual(list(books), [self.other])
+
+    def test_filter(self):
+        for param, value, books in (
+            ('tag', 'ddc:823.912', [self.book]),
+            ('tag', 'DDC:823.912', [self.book]),
+            ('tag', '823.912', [self.other]),
+            ('tag^', 'ddc:823', [self.book]),
+            ('tag~', 'ddc:23.9', [self.book]),
+            ('tag', 'lcc:823.912', []),
+        ):
+            with self.subTest(param=param, value=value):
+                self.assertEqual(list(Book.objects.filter(filters.FILTER_TEMPLATES[param](value))), books)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        # more persons with the same sort name than fit on a page, so pages split them by id
+        self.persons = [
+            Person.objects.create(name=name, sort_name=sort_name)
+            for name, sort_name in (
+                ('Anne Carson', 'Carson, Anne'), ('John Smith', 'Smith, John'), ('Jon Smith', 'Smith, John'),
+                ('J. Smith', 'Smith, John'), ('Johnny Smith', 'Smith, John'), ('Wallace Stevens', 'Stevens, Wallace'),
+            )
+        ]
+        self.paginator = KeysetPaginator(Person.objects.all(), ['sort_name', 'id'], 2)
+
+    def test_pages_forward_and_back(self):
+        pages = [self.paginator.get_page()]
+        while pages[-1].has_next:
+            pages.append(self.paginator.get_page(after=pages[-1].next_cursor))
+        self.assertEqual([person for page in pages for person in page], self.persons)
+        self.assertEqual([(page.has_previous, page.has_next) for page in pages], [(False, True), (True, True), (True, False)])
+
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = self.paginator.get_page(before=page.previous_cursor)
+            self.assertEqual(list(page), list(expected))
+        self.assertFalse(page.has_previous)
+
+    def test_descending(self):
+        paginator = KeysetPaginator(Person.objects.all(), ['-sort_name', '-id'], 4)
+        first = paginator.get_page()
+        second = paginator.get_page(after=first.next_cursor)
+        self.assertEqual(list(first) + list(second), self.persons[::-1])
+        self.assertEqual(list(paginator.get_page(before=second.previous_cursor)), list(first))
+
+    def test_links(self):
+        url = reverse('person_index')
+        with mock.patch('catalog.views.PERSON_PAGE_SIZE', 2):
+            first = self.client.get(url)
+            self.assertNotContains(first, 'previous</a>')
+            next_url = re.search(r'href="([^"]*)">next</a>', first.content.decode())[1]
+            self.assertContains(self.client.get(next_url), 'previous</a>')
+
+            cursor = self.paginator.cursor(self.persons[3])
+            last = self.client.get(url, {'after': cursor})
+            self.assertContains(last, 'Stevens, Wallace')
+            self.assertContains(last, 'previous</a>')
+            self.assertNotContains(last, 'next</a>')
+
+    def test_tampered_cursor(self):
+        def encode(value):
+            return urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+        url = reverse('person_index')
+        for cursor in ('nonsense', '%%%', encode({'sort_name': 'Smith'}), encode(['Smith']), encode(['Smith', 'x'])):
+            for param in ('after', 'before'):
+                with self.subTest(cursor=cursor, param=param):
+                    self.assertEqual(self.client.get(url, {param: cursor}).status_code, 400)
+
+    def test_person_queries(self):
+        person = self.persons[0]
+        series = Series.objects.create(title='Collected Works')
+        for title in ('Nox', 'Float', 'Red Doc>'):
+            book = Book.objects.create(title=title)
+            Credit.objects.create(book=book, person=person, role='author')
+            SeriesMembership.objects.create(series=series, book=book)
+            book.tags.add(Tag.objects.get_or_create(value='poetry')[0])
+        Credit.objects.create(book=book, person=person, role='translator')
+
+        # the person, the credits with their books, and the books' series and tags
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('show_person', args=[person.id]))
+        self.assertContains(response, 'Red Doc&gt;')
+        self.assertContains(response, '3 books')
+
+
+class GroupViewTests(TestCase):
+    def setUp(self):
+        author = Person.objects.create(name='Anne Carson')
+        self.series = Series.objects.create(title='Collected Works')
+        self.collection = Collection.objects.create(title='Favourites')
+        self.books = []
+        for order, title in ((3, 'Red Doc>'), (1, 'Nox'), (2, 'Float')):
+            book = Book.objects.create(title=title)
+            Credit.objects.create(book=book, person=author, role='author')
+            SeriesMembership.objects.create(series=self.series, book=book, order=order)
+            self.collection.books.add(book)
+            self.books.append(book)
+        Series.objects.create(title='Unfinished')
+        Collection.objects.create(title='Wish List')
+
+    @staticmethod
+    def link(content: str, text: str) -> str:
+        return re.search(rf'href="([^"]*)">{text}</a>', content)[1]
+
+    def test_indexes(self):
+        for url_name, group, other in (
+            ('series_index', self.series, 'Unfinished'),
+            ('collection_index', self.collection, 'Wish List'),
+        ):
+            with self.subTest(url_name=url_name):
+                # the groups, with their number of books in a subquery
+                with self.assertNumQueries(1):
+                    response = self.client.get(reverse(url_name))
+                self.assertRegex(
+                    response.content.decode(),
+                    rf'<a href="{group.get_absolute_url()}">{group.title}</a></td>\s*<td>3</td>',
+                )
+                self.assertRegex(response.content.decode(), rf'>{other}</a></td>\s*<td>0</td>')
+
+    def test_index_links(self):
+        for url_name, titles in (
+            ('series_index', ['Collected Works', 'Unfinished']),
+            ('collection_index', ['Favourites', 'Wish List']),
+        ):
+            with self.subTest(url_name=url_name), mock.patch('catalog.views.GROUP_PAGE_SIZE', 1):
+                first = self.client.get(reverse(url_name))
+                self.assertContains(first, titles[0])
+                self.assertNotContains(first, titles[1])
+                self.assertNotContains(first, 'previous</a>')
+
+                second = self.client.get(self.link(first.content.decode(), 'next'))
+                self.assertContains(second, titles[1])
+                self.assertNotContains(second, 'next</a>')
+                back = self.client.get(self.link(second.content.decode(), 'previous'))
+                self.assertContains(back, titles[0])
+
+    def test_series(self):
+        # the series, the memberships with their books, and the books' credits
+        with self.assertNumQueries(3):
+            response = self.client.get(self.series.get_absolute_url())
+        content = response.content.decode()
+        self.assertEqual(re.findall(r'<li value="(\d+)">\s*<a href="[^"]*">([^<]*)</a>', content), [
+            ('1', 'Nox'), ('2', 'Float'), ('3', 'Red Doc&gt;'),
+        ])
+        self.assertEqual(content.count('Anne Carson</a>'), 3)
+
+    def test_collection(self):
+        # the collection, its books, and their credits
+        with self.assertNumQueries(3):
+            response = self.client.get(self.collection.get_absolute_url())
+        content = response.content.decode()
+        self.assertEqual(re.findall(r'<li>\s*<a href="[^"]*">([^<]*)</a>', content), ['Float', 'Nox', 'Red Doc&gt;'])
+        self.assertEqual(content.count('Anne Carson</a>'), 3)
+
+    def test_group_links(self):
+        for group, titles in (
+            (self.series, ['Nox', 'Float', 'Red Doc&gt;']),
+            (self.collection, ['Float', 'Nox', 'Red Doc&gt;']),
+        ):
+            with self.subTest(group=group), mock.patch('catalog.views.GROUP_PAGE_SIZE', 2):
+                first = self.client.get(group.get_absolute_url())
+                self.assertNotContains(first, 'previous</a>')
+                self.assertNotContains(first, titles[2])
+
+                second = self.client.get(self.link(first.content.decode(), 'next'))
+                self.assertContains(second, titles[2])
+                self.assertNotContains(second, titles[0])
+                self.assertNotContains(second, 'next</a>')
+                self.assertContains(second, 'previous</a>')
+
+    def test_missing(self):
+        for url_name in ('show_series', 'show_collection'):
+            with self.subTest(url_name=url_name):
+                self.assertEqual(self.client.get(reverse(url_name, args=[0])).status_code, 404)
+
+
+class EstimatedCountTests(TestCase):
+    def setUp(self):
+        for name in ('Anne Carson', 'Louise Glück', 'James Joyce', 'Wallace Stevens', 'Ocean Vuong'):
+            Person.objects.create(name=name, sort_name=name)
+        # the statistics read by estimated_count(), from SQLite's sqlite_stat1 table
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        # added after the statistics were made, so only an exact count includes it
+        Person.objects.create(name='Anne Michaels', sort_name='Michaels, Anne')
+
+    def test_estimated_count(self):
+        self.assertEqual(estimated_count(Person.objects.all()), 5)
+        self.assertIsNone(estimated_count(Person.objects.filter(name__startswith='Anne')))
+        self.assertIsNone(estimated_count(Person.objects.distinct()))
+
+    def count(self, queryset) -> int:
+        return EstimatedCountPaginator(queryset.order_by('pk'), 2).count
+
+    def test_paginator(self):
+        # the estimate of a small table is counted instead
+        self.assertEqual(self.count(Person.objects.all()), 6)
+        with mock.patch.object(EstimatedCountPaginator, 'threshold', 3):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.count(Person.objects.all()), 5)
+            # filtered lists are counted
+            self.assertEqual(self.count(Person.objects.filter(name__startswith='Anne')), 2)
+
+    def test_change_list(self):
+        self.client.force_login(User.objects.create(username='admin', is_staff=True, is_superuser=True))
+        url = reverse('admin:catalog_person_changelist')
+        with mock.patch.object(EstimatedCountPaginator, 'threshold', 3):
+            self.assertContains(self.client.get(url), '5 persons')
+            searched = self.client.get(url, {'q': 'Anne'})
+        self.assertContains(searched, '2 results')
+        # without the count of all persons, which would have to count the table
+        self.assertNotContains(searched, ' total</a>')
+
+
+class RelatedFilterTests(TestCase):
+    def setUp(self):
+        self.joyces = Book.objects.create(title='Letters')
+        for name in ('James Joyce', 'Lucia Joyce'):
+            Credit.objects.create(book=self.joyces, person=Person.objects.create(name=name), role='author')
+        self.joyces.tags.add(Tag.objects.create(value='poetry'), Tag.objects.create(value='prose poetry'))
+        self.untagged = Book.objects.create(title='Untitled')
+
+    def assertNoJoin(self, books):
+        # the subquery joins the related rows with their persons or tags, but the books aren't joined
+        select, _, where = str(books.query).upper().partition(' WHERE ')
+        self.assertIn('EXISTS', where)
+        self.assertNotIn('JOIN', select)
+        self.assertNotIn('DISTINCT', select)
+
+    def test_matching_related_rows_not_repeated(self):
+        for param, value in (('author~', 'joyce'), ('tag~', 'poetry'), ('tag$', 'poetry')):
+            with self.subTest(param=param):
+                books = Book.objects.filter(filters.FILTER_TEMPLATES[param](value))
+                self.assertEqual(list(books), [self.joyces])
+                self.assertNoJoin(books)
+
+    def test_negated(self):
+        # books with none of the matching tags, including books without any tags
+        books = Book.objects.filter(~filters.FILTER_TEMPLATES['tag~']('poetry'))
+        self.assertEqual(list(books), [self.untagged])
+        self.assertNoJoin(books)
+
+        # a book with a tag that doesn't match is excluded if another tag matches
+        books = Book.objects.exclude(filters.FILTER_TEMPLATES['tag']('poetry'))
+        self.assertEqual(list(books), [self.untagged])
+
+
+class CategoryTests(TestCase):
+    def setUp(self):
+        self.poetry = Tag.objects.create(value='poetry')
+        self.fiction = Tag.objects.create(value='fiction')
+        self.category = Category.objects.create(name='Poetry', any_tags=['poetry'])
+        self.book = Book.objects.create(title='Harmonium')
+        self.other = Book.objects.create(title='Ulysses')
+
+    def assertMembers(self, *books):
+        self.assertEqual(set(self.category.books.all()), set(books))
+
+    def test_tags_of_book(self):
+        self.book.tags.add(self.poetry, self.fiction)
+        self.assertMembers(self.book)
+        self.book.tags.remove(self.poetry)
+        self.assertMembers()
+        self.book.tags.add(self.poetry)
+        self.book.tags.clear()
+        self.assertMembers()
+
+    def test_books_of_tag(self):
+        self.poetry.books.add(self.book, self.other)
+        self.assertMembers(self.book, self.other)
+        self.poetry.books.remove(self.other)
+        self.assertMembers(self.book)
+        # the books are found before they're cleared
+        self.poetry.books.clear()
+        self.assertMembers()
+
+    def test_tags_inline_of_admin(self):
+        self.client.force_login(User.objects.create(username='admin', is_staff=True, is_superuser=True))
+        url = reverse('admin:catalog_book_change', args=[self.book.id])
+        data = {
+            'title': 'Harmonium', 'subtitle': '', 'isbn': '', 'format': 'hardcover', 'publisher': 'Knopf',
+            'publication_date': '1923',
+            'credit_set-TOTAL_FORMS': 0, 'credit_set-INITIAL_FORMS': 0,
+            'Book_tags-TOTAL_FORMS': 1, 'Book_tags-INITIAL_FORMS': 0, 'Book_tags-0-tag': self.poetry.id,
+        }
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.assertMembers(self.book)
+
+        tagging = Book.tags.through.objects.get()
+        data.update({
+            'Book_tags-INITIAL_FORMS': 1, 'Book_tags-0-id': tagging.id, 'Book_tags-0-book': self.book.id,
+            'Book_tags-0-DELETE': 'on',
+        })
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.assertMembers()
+
+    def test_tag_renamed(self):
+        self.book.tags.add(self.fiction)
+        self.fiction.value = 'poetry'
+        self.fiction.save()
+        self.assertMembers(self.book)
+
+    def test_rule_changed(self):
+        self.book.tags.add(self.poetry)
+        self.other.tags.add(self.fiction)
+        self.category.any_tags = ['fiction']
+        self.category.save()
+        self.assertMembers(self.other)
+
+        self.category.any_tags = []
+        self.category.no_tags = ['fiction']
+        self.category.save()
+        self.assertMembers(self.book)
+
+    def test_credits(self):
+        self.category.any_tags = []
+        self.category.role = 'translator'
+        self.category.save()
+        credit = Credit.objects.create(book=self.book, person=Person.objects.create(name='Anne'), role='translator')
+        self.assertMembers(self.book)
+        credit.delete()
+        self.assertMembers()
+
+    def test_new_book(self):
+        self.category.any_tags = []
+        self.category.no_tags = ['fiction']
+        self.category.save()
+        self.assertMembers(self.book, self.other)
+        self.assertIn(Book.objects.create(title='Spring and All'), self.category.books.all())
+
+
+class DisplayCreditsTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Inferno')
+        self.dante = Person.objects.create(name='Dante Alighieri')
+        self.credit = Credit.objects.create(book=self.book, person=self.dante, role='author', order=1)
+
+    def assertCredits(self, expected):
+        book = Book.objects.get(id=self.book.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(book), f'Inferno, by {expected}')
+
+    def test_credits_changed(self):
+        self.assertCredits('Dante Alighieri')
+        translator = Credit.objects.create(
+            book=self.book, person=Person.objects.create(name='Mary Jo Bang'), role='translator', order=2,
+        )
+        self.assertCredits('Dante Alighieri, Mary Jo Bang (translator)')
+
+        translator.role = 'illustrator'
+        translator.order = 0
+        translator.save()
+        self.assertCredits('Mary Jo Bang (illustrator), Dante Alighieri')
+
+        translator.delete()
+        self.assertCredits('Dante Alighieri')
+
+    def test_persons_of_book(self):
+        bang = Person.objects.create(name='Mary Jo Bang')
+        self.book.persons.add(bang, through_defaults={'role': 'translator', 'order': 2})
+        self.assertCredits('Dante Alighieri, Mary Jo Bang (translator)')
+        self.book.persons.remove(self.dante)
+        self.assertCredits('Mary Jo Bang (translator)')
+        self.book.persons.clear()
+        self.assertCredits('')
+
+    def test_person_renamed(self):
+        self.dante.name = 'Dante'
+        self.dante.save()
+        self.assertCredits('Dante')
+        self.dante.delete()
+        self.assertCredits('')
+
+
+class BookRowTests(TestCase):
+    def setUp(self):
+        series = Series.objects.create(title='Divine Comedy')
+        fiction = Tag.objects.create(value='fiction')
+        poetry = Tag.objects.create(value='poetry')
+        ddc = Tag.objects.create(namespace='ddc', value='851.1')
+        names = ['Dante Alighieri', 'Mary Jo Bang', 'Henry Wadsworth Longfellow']
+        persons = [Person.objects.create(name=name) for name in names]
+        for number in range(6):
+            book = Book.objects.create(title=f'Canto {number}', publisher='Penguin', format='paperback')
+            for order, (person, role) in enumerate(zip(persons[number % 3:], ('author', 'translator', 'editor'))):
+                Credit.objects.create(book=book, person=person, role=role, order=2 - order)
+            book.tags.add(*[poetry, ddc, fiction][number % 2:])
+            if number % 3:
+                SeriesMembership.objects.create(series=series, book=book, order=number)
+
+    def test_same_as_books(self):
+        rows = book_rows(Book.objects.order_by('id').values_list(*ROW_FIELDS))
+        books = Book.objects.order_by('id')
+        self.assertEqual(len(rows), books.count())
+        for row, book in zip(rows, books):
+            with self.subTest(book=book.title):
+                self.assertEqual([getattr(row, field) for field in ROW_FIELDS], [getattr(book, f) for f in ROW_FIELDS])
+                credits = defaultdict(list)
+                for credit in book.credit_set.order_by('order', 'id').select_related('person'):
+                    credits[credit.role].append(credit.person.name)
+                self.assertEqual(row.credits, credits)
+                self.assertEqual(row.tags, [tag.value for tag in book.tags.filter(namespace='').order_by('value')])
+                self.assertEqual(
+                    [(series.title, series.order) for series in row.series],
+                    [(m.series.title, m.order) for m in book.seriesmembership_set.order_by('id')],
+                )
+
+    def test_index_queries_constant(self):
+        def count_queries(page_size):
+            with mock.patch('catalog.views.PAGE_SIZE', page_size), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('index'), {'publisher': 'Penguin'})
+            self.assertContains(response, 'name="book_id"', count=page_size)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(6))
+
+
+class SavedSearchTests(TestCase):
+    def setUp(self):
+        self.poetry = Tag.objects.create(value='poetry')
+        self.book = Book.objects.create(title='Harmonium', publisher='Penguin Classics', format='hardcover')
+        self.book.tags.add(self.poetry)
+        Book.objects.create(title='Ulysses', publisher='Penguin Classics', format='hardcover')
+        self.search = SavedSearch(name='Penguin poetry', query='publisher^=Penguin&tag=poetry&page=2')
+        self.search.full_clean()
+        self.search.save()
+
+    def test_canonical_query(self):
+        self.assertEqual(self.search.query, 'publisher^=Penguin&tag=poetry')
+        self.assertEqual(list(self.search.books.all()), [self.book])
+
+    def test_index_uses_stored_books(self):
+        url = reverse('index') + '?tag=poetry&publisher^=Penguin'
+        self.assertContains(self.client.get(url), 'Harmonium')
+        # the stored books are listed, not the books matching the filters
+        self.search.books.clear()
+        self.assertNotContains(self.client.get(url), 'Harmonium')
+
+    def test_updated_for_changed_books(self):
+        other = Book.objects.create(title='Tender Buttons', publisher='Penguin Modern', format='paperback')
+        other.tags.add(self.poetry)
+        self.assertEqual(self.search.books.count(), 2)
+
+        self.book.publisher = 'Knopf'
+        self.book.save()
+        self.assertEqual(list(self.search.books.all()), [other])
+
+    def test_only_dependent_searches_updated(self):
+        translated = SavedSearch.objects.create(name='Translated by Anne', query='translator=Anne')
+        update_books = SavedSearch.update_books
+        with mock.patch.object(SavedSearch, 'update_books', autospec=True, side_effect=update_books) as updated:
+            Credit.objects.create(book=self.book, person=Person.objects.create(name='Anne'), role='translator')
+        # the search by publisher and tag doesn't depend on the credits
+        self.assertEqual([call.args[0] for call in updated.call_args_list], [translated])
+        self.assertEqual(list(translated.books.all()), [self.book])
+
+
+class SyncIteratorTests(SimpleTestCase):
+    def test_iterate(self):
+        async def numbers():
+            for number in range(3):
+                await asyncio.sleep(0)
+                yield number
+
+        self.assertEqual(list(sync_iterator(numbers())), [0, 1, 2])
+
+    def test_cancelled_when_closed(self):
+        cancelled = []
+
+        async def forever():
+            try:
+                while True:
+                    yield 'item'
+                    await asyncio.sleep(0.01)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        iterator = sync_iterator(forever())
+        self.assertEqual(next(iterator), 'item')
+        iterator.close()
+        self.assertEqual(cancelled, [True])
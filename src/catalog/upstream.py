@@ -0,0 +1,266 @@
+"""
+Calls to the upstream services that books are looked up on.
+
+When Open Library (or the classifier service) slows down or fails, calls to
+it must not hold up the processes that make them. Each upstream host has an
+``Upstream`` that every call to it goes through, from sync code with
+``call()`` and from async code with ``acall()``:
+
+- a token bucket limits the rate of calls to ``UPSTREAM_RATE`` per second,
+  with bursts of up to ``UPSTREAM_BURST``; a call that would have to wait
+  longer than ``UPSTREAM_MAX_WAIT`` for its turn fails instead;
+- failed calls are retried up to ``UPSTREAM_RETRIES`` times, after a
+  jittered delay starting at ``UPSTREAM_BACKOFF`` that doubles with every
+  retry;
+- a circuit breaker opens after ``UPSTREAM_FAILURE_THRESHOLD`` consecutive
+  failures; calls then fail at once with ``RejectedError`` for
+  ``UPSTREAM_RESET_TIMEOUT`` seconds, after which a single trial call is let
+  through, which closes the circuit if it succeeds.
+
+A call fails by raising ``ServiceError``, which the functions making the
+requests raise for network errors, timeouts and server errors. Callers that
+can do without an answer, such as the format and cover lookups, catch it
+and carry on without.
+
+The limits and the state of the circuits are kept per process. Time spent
+waiting for the rate limit is reported as ``<upstream>_wait`` in the
+request metrics, retries and rejected calls as ``<upstream>_retries`` and
+``<upstream>_rejected`` in the request log line, and the state of every
+circuit that isn't closed as ``<upstream>_circuit``.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from functools import cache
+from typing import Callable, Optional, TypeVar
+
+from django.conf import settings
+
+from ibis import instrumentation
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class ServiceError(Exception):
+    """A metadata service could not be reached or returned an error."""
+
+
+class RejectedError(ServiceError):
+    """A call that wasn't made, because its circuit is open or it would wait too long for the rate limit."""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """Take a token, and return how long to wait before using it; if that
+        would be longer than ``max_wait``, take none and return ``None``."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+            if wait > max_wait:
+                return None
+            # the token may be taken before it is there; the wait makes up for it
+            self.tokens -= 1
+            return wait
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = 0.0
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.failure_threshold:
+            return self.CLOSED
+        if time.monotonic() - self.opened < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        """Whether a call may be made now; when the circuit is half-open, only one at a time is."""
+        with self.lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.trial_running = False
+
+    def release(self):
+        """Give up a call that was allowed but not made."""
+        with self.lock:
+            self.trial_running = False
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.failure_threshold:
+                # (re)open the circuit, also when a trial call failed
+                self.opened = time.monotonic()
+
+
+class Upstream:
+    def __init__(self, name: str):
+        self.name = name
+        self.bucket = TokenBucket(settings.UPSTREAM_RATE, settings.UPSTREAM_BURST)
+        self.breaker = CircuitBreaker(settings.UPSTREAM_FAILURE_THRESHOLD, settings.UPSTREAM_RESET_TIMEOUT)
+
+    def count(self, event: str):
+        metrics = instrumentation.current()
+        if metrics is not None:
+            key = f'{self.name}_{event}'
+            metrics.annotations[key] = metrics.annotations.get(key, 0) + 1
+
+    def admit(self) -> float:
+        """Check the circuit and the rate limit before an attempt, and return how long to wait before it."""
+        if not self.breaker.allow():
+            self.count('rejected')
+            raise RejectedError(f'{self.name} is unavailable after repeated failures')
+        wait = self.bucket.reserve(settings.UPSTREAM_MAX_WAIT)
+        if wait is None:
+            self.breaker.release()
+            self.count('rejected')
+            raise RejectedError(f'Too many requests to {self.name}')
+        metrics = instrumentation.current()
+        if wait and metrics is not None:
+            metrics.record(f'{self.name}_wait', wait)
+        return wait
+
+    def failed(self, error: ServiceError, attempt: int, retries: int) -> Optional[float]:
+        """Record a failed attempt, and return how long to wait before retrying it, if it's retried."""
+        self.breaker.failed()
+        if attempt == retries or self.breaker.state != CircuitBreaker.CLOSED:
+            if self.breaker.state == CircuitBreaker.OPEN:
+                logger.warning('Circuit for %s is open: %s', self.name, error)
+            return None
+        self.count('retries')
+        # with jitter, so that the calls that failed together aren't retried together
+        delay = settings.UPSTREAM_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+        logger.debug('Call to %s failed (%s), retrying in %.1f s', self.name, error, delay)
+        return delay
+
+    def call(self, func: Callable[..., T], *args, retries: int = None, **kwargs) -> T:
+        if retries is None:
+            retries = settings.UPSTREAM_RETRIES
+        for attempt in range(retries + 1):
+            wait = self.admit()
+            try:
+                time.sleep(wait)
+                with instrumentation.timed(self.name):
+                    result = func(*args, **kwargs)
+            except ServiceError as e:
+                delay = self.failed(e, attempt, retries)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            except BaseException:
+                # such as an error in func: neither a success nor a failure of the service
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.succeeded()
+                return result
+
+    async def acall(self, func: Callable, *args, retries: int = None, **kwargs):
+        """``call()`` for a coroutine function."""
+        if retries is None:
+            retries = settings.UPSTREAM_RETRIES
+        for attempt in range(retries + 1):
+            wait = self.admit()
+            try:
+                await asyncio.sleep(wait)
+                with instrumentation.timed(self.name):
+                    result = await func(*args, **kwargs)
+            except ServiceError as e:
+                delay = self.failed(e, attempt, retries)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            except BaseException:
+                # such as a cancelled call: neither a success nor a failure of the service
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.succeeded()
+                return result
+
+
+_upstreams: dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def get(name: str) -> Upstream:
+    """The upstream of the given name, such as "openlibrary", shared by the whole process."""
+    with _upstreams_lock:
+        try:
+            return _upstreams[name]
+        except KeyError:
+            upstream = _upstreams[name] = Upstream(name)
+            return upstream
+
+
+def circuit_states() -> dict[str, str]:
+    """The state of the circuits that aren't closed, for the request log line."""
+    return {
+        f'{upstream.name}_circuit': upstream.breaker.state
+        for upstream in list(_upstreams.values())
+        if upstream.breaker.state != CircuitBreaker.CLOSED
+    }
+
+
+@cache
+def session():
+    """The HTTP session shared by the sync calls, whose connection pool for
+    each host has at most ``OPENLIBRARY_CONCURRENCY`` connections; threads
+    beyond that wait for a connection rather than opening more."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=settings.OPENLIBRARY_CONCURRENCY, pool_block=True)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+
+def http(method: str, url: str, **kwargs):
+    """Make a request with the shared session, raising ``ServiceError`` for network errors,
+    timeouts and server errors."""
+    import requests
+
+    try:
+        response = session().request(method, url, timeout=settings.OPENLIBRARY_TIMEOUT, **kwargs)
+    except requests.RequestException as e:
+        raise ServiceError(str(e)) from e
+    if response.status_code >= 500:
+        raise ServiceError(f'{url} returned status {response.status_code}')
+    return response
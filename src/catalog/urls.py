@@ -10,9 +10,16 @@ urlpatterns = [
     path('<int:pk>', views.BookView.as_view(), name='show_book'),
     path('<int:pk>/metadata', views.EditBookView.as_view(), name='edit_book'),
     path('<int:pk>/tags', views.BookTagsView.as_view(), name='book_tags'),
+    path('<int:pk>/cover', views.book_cover, name='book_cover'),
     path('<int:pk>/<str:field>', views.BookFieldView.as_view(), name='book_field'),
     path('<int:pk>/<str:field>/edit', views.EditBookFieldView.as_view(), name='edit_book_field'),
     path('credits/<int:pk>', views.ShowCreditView.as_view(), name='credit'),
     path('credits/<int:pk>/edit', views.EditCreditView.as_view(), name='edit_credit'),
     path('find', views.find, name='find'),
+    path('persons/', views.PersonIndexView.as_view(), name='person_index'),
+    path('persons/<int:pk>', views.PersonView.as_view(), name='show_person'),
+    path('series/', views.SeriesIndexView.as_view(), name='series_index'),
+    path('series/<int:pk>', views.SeriesView.as_view(), name='show_series'),
+    path('collections/', views.CollectionIndexView.as_view(), name='collection_index'),
+    path('collections/<int:pk>', views.CollectionView.as_view(), name='show_collection'),
 ]
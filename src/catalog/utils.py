@@ -1,16 +1,23 @@
+import asyncio
+import json
+import operator
+import queue
+import re
+import threading
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import namedtuple
 from functools import reduce
-from typing import Iterable, Mapping, Any
+from typing import AsyncIterable, Iterable, Iterator, Mapping, Any, Optional, Sequence
 from urllib.parse import urlencode
 
-import requests
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
 from django.core.exceptions import ValidationError, BadRequest
 from django.core.paginator import Page
-from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections
+from django.db.models import Count, Exists, OuterRef, Q, QuerySet, Subquery
+from django.db.models.functions import Coalesce
 from django.http import QueryDict
-from isbnlib import classify
-from isbnlib.dev import ServiceIsDownError
-from titlecase import titlecase
 from urlobject import URLObject
 
 Filter = namedtuple('Filter', ('name', 'value', 'label'))
@@ -29,6 +36,10 @@ class FilterSet:
                             filter_label = f'{param_name.rstrip("^")} begins with "{param_value}"'
                         elif param_name.endswith('$'):
                             filter_label = f'{param_name.rstrip("$")} ends with "{param_value}"'
+                        elif param_name.endswith('>'):
+                            filter_label = f'{param_name.rstrip(">")} after {param_value}'
+                        elif param_name.endswith('<'):
+                            filter_label = f'{param_name.rstrip("<")} before {param_value}'
                         else:
                             filter_label = f'{param_name}: {param_value}'
                         self.add(param_name, param_value, filter_label)
@@ -59,6 +70,11 @@ class FilterSet:
     def __str__(self):
         return urlencode([(f.name, f.value) for f in self.filters], safe='~^$') if self.filters else ''
 
+    def canonical(self) -> str:
+        """The filters as a query string in a fixed order; the filters all have to match, so their
+        order makes no difference to the books that do."""
+        return urlencode(sorted((f.name, f.value) for f in self.filters), safe='~^$')
+
     def add(self, name, value, label=None):
         if label is None:
             label = f'{name}: {value}'
@@ -102,48 +118,223 @@ class PaginationLinks:
             return None
 
 
-def get_classifier_tags(isbn: str) -> list[str]:
-    try:
-        classifiers = classify(isbn)
-    except ServiceIsDownError:
-        return []
-    tags = []
-    for system, value in classifiers.items():
-        if system.lower() == 'fast':
-            for number, description in value.items():
-                tags.append(f'fast:{number};{description}')
+class KeysetPage:
+    def __init__(self, object_list: list, has_next: bool, has_previous: bool, paginator: 'KeysetPaginator'):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.paginator = paginator
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        return self.paginator.cursor(self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self) -> Optional[str]:
+        return self.paginator.cursor(self.object_list[0]) if self.has_previous else None
+
+
+class KeysetPaginator:
+    """Paginates a queryset by the values of the ordering fields of the rows
+    just before or after a page, rather than by offset.
+
+    The database finds a page with an index on the ordering fields no matter
+    how deep into the list it is, where an offset makes it read and skip all
+    the rows before the page, and there is no count of all the rows. Pages are
+    addressed by cursors, which encode the ordering values of the last row of
+    the previous page (``after``) or of the first row of the next page
+    (``before``). The ordering must be unique, so ``fields`` usually end with
+    the primary key; a field prefixed with "-" is in descending order."""
+
+    def __init__(self, queryset: QuerySet, fields: Sequence[str], per_page: int):
+        self.queryset = queryset
+        self.fields = fields
+        self.per_page = per_page
+
+    def cursor(self, obj) -> str:
+        values = [getattr(obj, field.lstrip('-')) for field in self.fields]
+        return urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode()).decode()
+
+    def decode(self, cursor: str) -> list:
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            raise BadRequest(f'Not a valid cursor: {cursor}')
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise BadRequest(f'Not a valid cursor: {cursor}')
+        return values
+
+    def condition(self, values: list, forward: bool) -> Q:
+        """The rows after (or before) the row with the given ordering values.
+
+        For fields (a, b) after (x, y) this is ``a >= x AND (a > x OR b > y)``,
+        where the first part bounds the scan of an index on (a, b)."""
+        conditions = []
+        equal = Q()
+        for field, value in zip(self.fields, values):
+            name = field.lstrip('-')
+            lookup = 'gt' if forward != field.startswith('-') else 'lt'
+            conditions.append(equal & Q(**{f'{name}__{lookup}': value}))
+            equal &= Q(**{name: value})
+        first = self.fields[0]
+        bound = 'gte' if forward != first.startswith('-') else 'lte'
+        return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & reduce(operator.or_, conditions)
+
+    def filter(self, queryset: QuerySet, cursor: str, forward: bool) -> QuerySet:
+        try:
+            return queryset.filter(self.condition(self.decode(cursor), forward))
+        except (TypeError, ValueError, ValidationError):
+            # values of the wrong type for their fields
+            raise BadRequest(f'Not a valid cursor: {cursor}')
+
+    def get_page(self, after: str = None, before: str = None) -> KeysetPage:
+        if before:
+            # read backwards from the cursor, then put the page back in order
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in self.fields]
+            rows = self.filter(self.queryset, before, forward=False).order_by(*ordering)
+            rows = list(rows[:self.per_page + 1])
+            object_list = rows[:self.per_page][::-1]
+            return KeysetPage(object_list, has_next=True, has_previous=len(rows) > self.per_page, paginator=self)
+
+        queryset = self.queryset.order_by(*self.fields)
+        if after:
+            queryset = self.filter(queryset, after, forward=True)
+        rows = list(queryset[:self.per_page + 1])
+        return KeysetPage(
+            rows[:self.per_page], has_next=len(rows) > self.per_page, has_previous=bool(after), paginator=self,
+        )
+
+
+class CursorLinks:
+    """Links to the pages before and after a ``KeysetPage``, for the pagination template."""
+
+    def __init__(self, url: URLObject, page: KeysetPage, after_param='after', before_param='before'):
+        self.url = url.del_query_param(after_param).del_query_param(before_param)
+        self.page = page
+        self.after_param = after_param
+        self.before_param = before_param
+
+    @property
+    def first(self):
+        return self.url
+
+    @property
+    def previous(self):
+        if self.page.has_previous:
+            return self.url.set_query_param(self.before_param, self.page.previous_cursor)
+        else:
+            return None
+
+    @property
+    def next(self):
+        if self.page.has_next:
+            return self.url.set_query_param(self.after_param, self.page.next_cursor)
         else:
-            tags.append(f'{system.lower()}:{value}')
-    return tags
+            return None
+
+
+def estimated_count(queryset: QuerySet) -> Optional[int]:
+    """The number of rows in the table of an unfiltered queryset, as estimated
+    from the database's statistics, without counting them.
+
+    Returns ``None`` if the queryset is filtered, or the database has no
+    statistics for the table (it was never analyzed)."""
+    if queryset.query.has_filters() or queryset.query.distinct:
+        return None
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        # e.g. SQLite without a statistics table
+        return None
+    if row is None or row[0] is None:
+        return None
+    # the first number of SQLite's statistics is the number of rows
+    estimate = int(float(str(row[0]).split()[0]))
+    # PostgreSQL estimates tables that were never analyzed as -1
+    return estimate if estimate >= 0 else None
 
 
 def getlines(text: str) -> list[str]:
     return list(str(s) for s in filter(len, (map(str.strip, text.splitlines()))))
 
 
-def split_title(title: str, separator: str = ' - ') -> tuple[str, str]:
-    if separator in title:
-        main, sub = title.split(separator, 1)
-        return titlecase(main), titlecase(sub)
-    else:
-        return titlecase(title), ''
+class RelatedFilter:
+    """Builds conditions on the rows of a related model as correlated
+    ``EXISTS`` subqueries, rather than as joins.
+
+    A join with a one-to-many or many-to-many relation repeats a row for
+    every related row that matches, so the query needs ``DISTINCT``; an
+    ``EXISTS`` subquery only tests for a match. Lookups are relative to
+    ``model``, which refers to the filtered row with ``field``, and all the
+    lookups in one call must match the same related row."""
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+
+    def __call__(self, *args, **lookups) -> Q:
+        related = self.model.objects.filter(*args, **lookups, **{self.field: OuterRef('pk')})
+        return Q(Exists(related))
+
+
+NAMESPACE = re.compile(r'([a-z][a-z0-9_-]{0,31}):(.*)', re.IGNORECASE | re.DOTALL)
+
+
+def split_namespace(text: str) -> tuple[str, str]:
+    """Split a namespace-qualified value such as "ddc:823.914" into its
+    namespace and value. Values without a namespace get an empty one."""
+    match = NAMESPACE.fullmatch(text)
+    if match is None:
+        return '', text
+    return match[1].lower(), match[2]
 
 
-def get_format(isbn):
-    r = requests.get(f'https://openlibrary.org/isbn/{isbn}.json')
-    return r.json().get('physical_format', '?').lower() if r.ok else '?'
+def related_count(related: QuerySet, field: str, count: Count = None) -> Coalesce:
+    """An annotation with the number of rows of ``related`` that refer to the
+    annotated row with ``field`` (or another ``count`` of them).
+
+    This is a correlated subquery rather than a join with the related rows,
+    so a page of rows only counts the related rows of the rows on the page."""
+    if count is None:
+        count = Count('pk')
+    counts = related.filter(**{field: OuterRef('pk')}).values(field).annotate(count=count).values('count')
+    return Coalesce(Subquery(counts), 0)
 
 
 class QueryTemplate:
-    def __init__(self, value_field, extra_fields=None):
+    def __init__(self, value_field, extra_fields=None, related: RelatedFilter = None, namespace_field=None):
         if extra_fields is None:
             extra_fields = {}
         self.value_field = value_field
         self.extra_fields = extra_fields
+        self.related = related
+        # values may be qualified with a namespace, which must match this field exactly
+        self.namespace_field = namespace_field
 
     def __call__(self, value):
-        params = {self.value_field: value}
+        if self.namespace_field is not None:
+            namespace, value = split_namespace(value)
+            params = {self.namespace_field: namespace, self.value_field: value}
+        else:
+            params = {self.value_field: value}
         params.update(self.extra_fields)
+        if self.related is not None:
+            return self.related(**params)
         return Q(**params)
 
     def __repr__(self):
@@ -158,19 +349,102 @@ PREDICATES = {
 }
 
 
-def filter_group(param_name, value_field=None, **extra_fields):
+def filter_group(param_name, value_field=None, related: RelatedFilter = None, namespace_field=None, **extra_fields):
     if value_field is None:
         value_field = param_name
     return {
-        param_name + suffix: QueryTemplate(f'{value_field}__{predicate}', extra_fields)
+        param_name + suffix: QueryTemplate(f'{value_field}__{predicate}', extra_fields, related, namespace_field)
         for suffix, predicate in PREDICATES.items()
     }
 
 
+def parse_int(value: str) -> Optional[int]:
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def range_filter(field: str, value: str) -> Optional[Q]:
+    """A filter on an integer field for a value like ``1990``, or a range like
+    ``1990..1999`` (inclusive, and either end can be left out)."""
+    start, separator, end = (part.strip() for part in value.partition('..'))
+    if not separator:
+        number = parse_int(start)
+        return None if number is None else Q(**{field: number})
+    lookups = {}
+    for lookup, part in (('gte', start), ('lte', end)):
+        if part:
+            number = parse_int(part)
+            if number is None:
+                return None
+            lookups[f'{field}__{lookup}'] = number
+    return Q(**lookups) if lookups else None
+
+
+def range_filter_group(param_name, value_field=None):
+    """Filters on an integer field: ``name`` for a value or a range (see
+    ``range_filter()``), and ``name>`` and ``name<`` for the values after and
+    before a value. Values that aren't integers are ignored."""
+    if value_field is None:
+        value_field = param_name
+
+    def compare(lookup):
+        def template(value):
+            number = parse_int(value)
+            return None if number is None else Q(**{f'{value_field}__{lookup}': number})
+        return template
+
+    return {
+        param_name: lambda value: range_filter(value_field, value),
+        param_name + '>': compare('gt'),
+        param_name + '<': compare('lt'),
+    }
+
+
 def combine(dict_iter: Iterable[dict]) -> dict:
     return reduce(lambda a, b: {**a, **b}, dict_iter)
 
 
+MONTHS = {
+    name: number
+    for number, names in enumerate((
+        ('january', 'jan'), ('february', 'feb'), ('march', 'mar'), ('april', 'apr'), ('may',),
+        ('june', 'jun'), ('july', 'jul'), ('august', 'aug'), ('september', 'sep', 'sept'),
+        ('october', 'oct'), ('november', 'nov'), ('december', 'dec'),
+    ), start=1)
+    for name in names
+}
+
+ISO_DATE = re.compile(r'(?<!\d)(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?(?!\d)')
+MONTH_NAME = re.compile(r'\b([a-z]+)\.?\b')
+DAY = re.compile(r'\b(\d{1,2})(?:st|nd|rd|th)?\b')
+
+DateParts = namedtuple('DateParts', ('year', 'month', 'day'))
+
+
+def parse_publication_date(value: str) -> DateParts:
+    """Parse the year, and the month and day if present, of a free-form
+    publication date such as "1999", "1999-05-12", "May 1999" or
+    "12 May 1999". Parts that can't be found, or are out of range, are ``None``."""
+    value = value.lower()
+    match = ISO_DATE.search(value)
+    if match is None:
+        return DateParts(None, None, None)
+    year, month, day = (int(part) if part else None for part in match.groups())
+    if month is None:
+        # a month name, with an optional day number before or after it
+        rest = value[:match.start()] + ' ' + value[match.end():]
+        month = next((MONTHS[name] for name in MONTH_NAME.findall(rest) if name in MONTHS), None)
+        if month is not None:
+            day = next((int(number) for number in DAY.findall(rest)), None)
+    if month is not None and not 1 <= month <= 12:
+        month = day = None
+    if day is not None and (month is None or not 1 <= day <= 31):
+        day = None
+    return DateParts(year, month, day)
+
+
 def find_object(uuid: str, search_targets: Mapping[Any, str]):
     for cls, view_name in search_targets.items():
         try:
@@ -184,3 +458,48 @@ def find_object(uuid: str, search_targets: Mapping[Any, str]):
 
     # found nothing
     return None, None
+
+
+def sync_iterator(aiterable: AsyncIterable) -> Iterator:
+    """Iterate over an async iterable from sync code, as a WSGI server does
+    over a streaming response: the iterable runs on an event loop in a
+    thread of its own, and is cancelled when the iterator is closed early."""
+    items = queue.Queue()
+    done = object()
+
+    async def produce():
+        try:
+            # the database connections of the sync code it calls are its own, and closed when it ends
+            async with ThreadSensitiveContext():
+                try:
+                    async for item in aiterable:
+                        items.put(item)
+                finally:
+                    await sync_to_async(connections.close_all)()
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(produce())
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        loop.run_until_complete(loop.shutdown_asyncgens())
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while (item := items.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # does nothing if the task is done
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+        loop.close()
@@ -1,43 +1,35 @@
+import asyncio
 import re
-from typing import Iterable, Iterator
+from collections import Counter
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, TYPE_CHECKING
 from urllib.parse import urlencode
 
 from django.core.exceptions import BadRequest
+from django.core.handlers.asgi import ASGIRequest
 from django.core.paginator import Paginator
-from django.db.models import OuterRef, Subquery, Q
-from django.http import HttpRequest, HttpResponseRedirect, Http404, QueryDict
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery
+from django.http import HttpRequest, HttpResponseRedirect, Http404, QueryDict, StreamingHttpResponse
 from django.http.response import HttpResponseRedirectBase
-from django.shortcuts import render
+from django.shortcuts import render, aget_object_or_404
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
 from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.views.generic import TemplateView, UpdateView, DetailView, FormView
-from isbnlib import ISBNLibException
-from nameparser.config import CONSTANTS
 from urlobject import URLObject
 
+from ibis.instrumentation import annotate
+from . import metadata
+from .filters import FILTER_TEMPLATES, SAVED_SEARCHES
 from .forms import ImportForm, SingleISBNForm, SingleTagForm, BookForm, CreditForm
-from .models import Book, Credit, Tag, Person
-from .utils import getlines, filter_group, combine, FilterSet, \
-    PaginationLinks, find_object
-
-CATEGORIES = {
-    'fiction': Q(tags__value__in=['novel', 'short stories']),
-    'non-fiction': ~Q(tags__value__in=['novel', 'short stories', 'poetry', 'comics', 'play']),
-    'translated': Q(credit__role=Credit.Role.TRANSLATOR),
-}
+from .listing import ROW_FIELDS, book_rows
+from .models import Book, Credit, Tag, Person, Series, SeriesMembership, Collection, Category, \
+    SavedSearch
+from .utils import getlines, FilterSet, PaginationLinks, find_object, KeysetPaginator, CursorLinks, \
+    related_count, sync_iterator
 
-FILTER_TEMPLATES = {
-    'category': lambda value: CATEGORIES.get(value, None),
-    'format': lambda value: Q(format=value),
-    'publication_date': lambda value: Q(publication_date=value),
-    'isbn': lambda value: Q(isbn=value),
-    'q': lambda value: Q(title__icontains=value) | Q(persons__name__icontains=value),
-    **filter_group('title'),
-    **filter_group('publisher'),
-    **filter_group('series', 'series__title'),
-    **filter_group('tag', 'tags__value'),
-    **combine(filter_group(role, value_field='persons__name', credit__role=role) for role in Credit.Role.values)
-}
+if TYPE_CHECKING:
+    from .openlibrary import OpenLibraryClient
 
 FILTER_LABELS = {
     'Title': 'title',
@@ -46,16 +38,25 @@ FILTER_LABELS = {
     'Series': 'series',
     'Tag': 'tag',
     'Publisher': 'publisher',
+    'Year': 'year',
 }
 
 PAGE_PARAM_NAME = 'page'
 
 PAGE_SIZE = 10
 
+PERSON_PAGE_SIZE = 50
+
+# series and collections per page of their indexes, and books per page of a series or collection
+GROUP_PAGE_SIZE = 50
+
 
 def append_filter(request: HttpRequest) -> HttpResponseRedirect:
     url = URLObject(request.build_absolute_uri())
     filter_param = request.POST['filter_name'] + request.POST['filter_operation']
+    # not every operator applies to every filter, such as "after" to anything but the year
+    if filter_param not in FILTER_TEMPLATES:
+        raise BadRequest(f'Not a valid filter: {filter_param}')
     filter_value = request.POST['filter_value']
     new_url = url.add_query_param(filter_param, filter_value)
     return HttpResponseRedirect(new_url)
@@ -71,7 +72,7 @@ class IndexView(View):
             if action == 'tag':
                 # bulk tagging
                 tag_value = self.request.POST['tag']
-                tag, _ = Tag.objects.get_or_create(value=tag_value)
+                tag, _ = Tag.objects.get_or_create(**Tag.parse(tag_value))
                 for book_id in book_ids:
                     book = Book.objects.get(pk=book_id)
                     book.tags.add(tag)
@@ -87,25 +88,39 @@ class IndexView(View):
     def get(self, _request):
         booklist = Book.objects.all()
         filters = FilterSet()
+        filter_queries = list(filters.build(FILTER_TEMPLATES, self.request.GET))
 
-        for filter_query in filters.build(FILTER_TEMPLATES, self.request.GET):
-            booklist = booklist.filter(filter_query)
+        # the books of a saved search are stored, and looked up rather than filtered
+        saved_search = SavedSearch.objects.filter(query=filters.canonical()).first() if filters else None
+        if saved_search is not None:
+            booklist = booklist.filter(SAVED_SEARCHES(savedsearch=saved_search))
+            annotate(saved_search=saved_search.name)
+        else:
+            for filter_query in filter_queries:
+                booklist = booklist.filter(filter_query)
+
+        annotate(filters=str(filters))
 
         first_author = Credit.objects.filter(book=OuterRef('pk'), order=1)[:1]
 
-        booklist = booklist.distinct().order_by(
+        # the filters don't join any related rows, so the books need no DISTINCT
+        booklist = booklist.order_by(
             Subquery(first_author.values('person__sort_name')),
-            'publication_date'
+            F('publication_year').asc(nulls_last=True),
+            F('publication_month').asc(nulls_first=True),
+            F('publication_day').asc(nulls_first=True),
         )
 
-        paginator = Paginator(booklist, PAGE_SIZE)
+        paginator = Paginator(booklist.values_list(*ROW_FIELDS), PAGE_SIZE)
         page = paginator.get_page(self.request.GET.get(PAGE_PARAM_NAME, 1))
+        # the page lists rows rather than books, see catalog.listing
+        page.object_list = book_rows(page.object_list)
 
         url = URLObject(self.request.build_absolute_uri())
 
         return render(self.request, 'catalog/index.html', context={
             'url': url,
-            'categories': CATEGORIES.keys(),
+            'categories': Category.objects.values_list('name', flat=True),
             'filter_names': FILTER_LABELS,
             'page_obj': page,
             'filters': filters,
@@ -114,26 +129,184 @@ class IndexView(View):
         })
 
 
-class BookView(DetailView):
-    model = Book
+class BookView(View):
     template_name = 'catalog/book.html'
-    context_object_name = 'book'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context.update({
+    async def get(self, request, pk):
+        book = await aget_object_or_404(Book, pk=pk)
+        # load everything the template shows here, so that rendering doesn't query the database
+        return TemplateResponse(request, self.template_name, context={
+            'book': book,
+            'credits': [credit async for credit in book.credits().select_related('person')],
+            'series_memberships': [
+                membership async for membership in book.series_memberships().select_related('series')
+            ],
+            'tags': [tag async for tag in book.sorted_tags()],
+            'persons': [person async for person in Person.objects.all()],
             'tag_form': SingleTagForm(),
             'isbn_form': SingleISBNForm(),
-            'persons': Person.objects.all(),
         })
+
+
+def role_counts() -> dict:
+    """Annotations of persons with the number of books they are credited on in
+    each role, as ``author_count``, ``editor_count`` and so on."""
+    return {
+        f'{role}_count': related_count(Credit.objects.filter(role=role), 'person', Count('book', distinct=True))
+        for role in Credit.Role.values
+    }
+
+
+class PersonIndexView(View):
+    def get(self, _request):
+        paginator = KeysetPaginator(Person.objects.annotate(**role_counts()), ['sort_name', 'id'], PERSON_PAGE_SIZE)
+        page = paginator.get_page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        url = URLObject(self.request.build_absolute_uri())
+
+        return render(self.request, 'catalog/person_index.html', context={
+            'page_obj': page,
+            'page_links': CursorLinks(url, page),
+        })
+
+
+class PersonView(DetailView):
+    model = Person
+    template_name = 'catalog/person.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # the credits with their books, and the books' series and tags, in three queries
+        credits = list(self.object.credits.prefetch_related(
+            Prefetch(
+                'book__seriesmembership_set',
+                queryset=SeriesMembership.objects.select_related('series').order_by('series__title'),
+            ),
+            Prefetch('book__tags', queryset=Tag.objects.filter(namespace='').order_by('value')),
+        ))
+
+        # a person can be credited on a book in more than one role
+        books = list({credit.book_id: credit.book for credit in credits}.values())
+        series = {
+            membership.series_id: membership.series
+            for book in books
+            for membership in book.seriesmembership_set.all()
+        }
+        tags = Counter(tag.value for book in books for tag in book.tags.all())
+
+        context.update(
+            credits=credits,
+            book_count=len(books),
+            series=sorted(series.values(), key=lambda s: s.title),
+            tags=tags.most_common(),
+        )
+        return context
+
+
+def book_credits(prefix: str = '') -> Prefetch:
+    """Prefetches the credits of books (or of the books at ``prefix``) in order,
+    with their persons, as ``ordered_credits``."""
+    return Prefetch(
+        f'{prefix}credit_set',
+        queryset=Credit.objects.select_related('person').order_by('order'),
+        to_attr='ordered_credits',
+    )
+
+
+class GroupIndexView(View):
+    """Lists series or collections, with their number of books."""
+    model = None
+    # the model that puts books in the groups, and its field referring to the group
+    members = None
+    group_field = None
+    title = None
+    detail_view_name = None
+
+    def get(self, _request):
+        groups = self.model.objects.annotate(book_count=related_count(self.members.objects.all(), self.group_field))
+        paginator = KeysetPaginator(groups, ['title', 'id'], GROUP_PAGE_SIZE)
+        page = paginator.get_page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        url = URLObject(self.request.build_absolute_uri())
+
+        return render(self.request, 'catalog/group_index.html', context={
+            'title': self.title,
+            'detail_view_name': self.detail_view_name,
+            'page_obj': page,
+            'page_links': CursorLinks(url, page),
+        })
+
+
+class SeriesIndexView(GroupIndexView):
+    model = Series
+    members = SeriesMembership
+    group_field = 'series'
+    title = 'Series'
+    detail_view_name = 'show_series'
+
+
+class CollectionIndexView(GroupIndexView):
+    model = Collection
+    members = Collection.books.through
+    group_field = 'collection'
+    title = 'Collections'
+    detail_view_name = 'show_collection'
+
+
+class SeriesView(DetailView):
+    model = Series
+    template_name = 'catalog/series.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # the members in order with their books in one query, and the books' credits in another
+        memberships = (
+            SeriesMembership.objects
+            .filter(series=self.object)
+            .select_related('book')
+            .prefetch_related(book_credits('book__'))
+        )
+        paginator = KeysetPaginator(memberships, ['order', 'id'], GROUP_PAGE_SIZE)
+        page = paginator.get_page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        context.update(
+            page_obj=page,
+            page_links=CursorLinks(URLObject(self.request.build_absolute_uri()), page),
+        )
+        return context
+
+
+class CollectionView(DetailView):
+    model = Collection
+    template_name = 'catalog/collection.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        books = Book.objects.filter(collection=self.object).prefetch_related(book_credits())
+        paginator = KeysetPaginator(books, ['title', 'id'], GROUP_PAGE_SIZE)
+        page = paginator.get_page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        context.update(
+            page_obj=page,
+            page_links=CursorLinks(URLObject(self.request.build_absolute_uri()), page),
+        )
         return context
 
 
+async def book_cover(request, pk):
+    book = await aget_object_or_404(Book, pk=pk)
+    async with metadata.openlibrary_client() as client:
+        try:
+            is_available = await client.cover_available(book.cover_image.url)
+        except metadata.ServiceError:
+            is_available = False
+    return TemplateResponse(request, 'catalog/book_cover.html', context={
+        'book': book,
+        'is_available': is_available,
+    })
+
+
 class BookTagsView(FormView):
     form_class = SingleTagForm
 
     def form_valid(self, form):
-        tag, _ = Tag.objects.get_or_create(value=form.cleaned_data['tag'])
+        tag, _ = Tag.objects.get_or_create(**Tag.parse(form.cleaned_data['tag']))
         book = Book.objects.all().get(pk=self.kwargs['pk'])
         book.tags.add(tag)
         return HttpResponseRedirect(reverse('show_book', args=[book.pk]))
@@ -162,41 +335,72 @@ class ImportBooksView(FormView):
 class ImportByISBNView(TemplateView):
     template_name = 'catalog/import_by_isbn.html'
 
-    def post(self, _request):
+    async def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    async def post(self, _request):
         if 'isbn' in self.request.POST:
             isbns = [self.request.POST['isbn']]
         elif 'isbns' in self.request.POST:
             isbns = getlines(self.request.POST['isbns'])
         else:
             isbns = []
-
-        sort_name_format = '{last}, {title} {first} {suffix}'
-        CONSTANTS.string_format = sort_name_format
-
-        import_results = []
-        for isbn in isbns:
-            try:
-                book = Book.create_from_isbn(isbn)
-                import_results.append({
-                    'isbn': isbn,
-                    'success': True,
-                    'id': book.id,
-                    'title': book.title,
-                })
-            except ISBNLibException as e:
-                import_results.append({
-                    'isbn': isbn,
-                    'success': False,
-                    'message': str(e),
-                })
-
-        if len(import_results) == 1 and import_results[0]['success']:
-            url = reverse('show_book', kwargs={'pk': import_results[0]['id']})
-            return HttpResponseRedirect(url)
+        # duplicates are only imported once
+        isbns = list(dict.fromkeys(isbns))
+
+        if len(isbns) == 1:
+            async with metadata.openlibrary_client() as client:
+                result = await import_isbn(client, isbns[0])
+            if result['success']:
+                return HttpResponseRedirect(reverse('show_book', kwargs={'pk': result['id']}))
+            results = iterate(result)
         else:
-            return render(self.request, 'catalog/import_results.html', context={'results': import_results})
-            #url = self.request.POST.get('redirect', reverse('index'))
-
+            results = import_isbns(isbns)
+
+        # the results are sent as they come in, rather than when all the ISBNs are imported
+        chunks = import_result_chunks(results, len(isbns))
+        if not isinstance(self.request, ASGIRequest):
+            chunks = sync_iterator(chunks)
+        response = StreamingHttpResponse(chunks, content_type='text/html; charset=utf-8')
+        # for proxies that would otherwise buffer the response
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+async def iterate(*items):
+    for item in items:
+        yield item
+
+
+async def import_isbns(isbns: list[str]) -> AsyncIterator[dict]:
+    """Import ISBNs concurrently, yielding the result of each as soon as it is imported."""
+    async with metadata.openlibrary_client() as client:
+        tasks = [asyncio.create_task(import_isbn(client, isbn)) for isbn in isbns]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # when the client went away; the books imported so far are kept, and
+            # books that are being saved are saved completely (see Book.create_from_metadata())
+            for task in tasks:
+                task.cancel()
+
+
+async def import_result_chunks(results: AsyncIterable[dict], total: int) -> AsyncIterator[str]:
+    yield render_to_string('catalog/import_results_start.html', {'total': total})
+    imported = 0
+    async for result in results:
+        imported += result['success']
+        yield render_to_string('catalog/import_result.html', {'result': result})
+    yield render_to_string('catalog/import_results_end.html', {'imported': imported, 'total': total})
+
+
+async def import_isbn(client: 'OpenLibraryClient', isbn: str) -> dict:
+    try:
+        book = await Book.acreate_from_isbn(client, isbn)
+    except (metadata.InvalidISBNError, metadata.ServiceError, ValueError) as e:
+        return {'isbn': isbn, 'success': False, 'message': str(e)}
+    return {'isbn': isbn, 'success': True, 'id': book.id, 'title': book.title}
 
 
 class BulkEditBooksView(FormView):
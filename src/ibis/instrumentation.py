@@ -0,0 +1,401 @@
+"""
+Per-request performance instrumentation for ibis.
+
+When ``INSTRUMENTATION`` is enabled, ``InstrumentationMiddleware`` collects
+the number and duration of database queries, the time spent rendering
+templates, and the time spent waiting on outbound metadata services for
+each request. The totals are reported in a ``Server-Timing`` response header
+and as a single structured log line per request.
+
+Code that wants to be included in the breakdown wraps the work in
+``timed('<metric>')``. Outside an instrumented request this is a single
+context variable lookup, so it is safe to leave in place when
+instrumentation is disabled.
+
+If ``SLOW_QUERY_THRESHOLD`` is set, a sample of the queries that exceed it
+is stored, together with an ``EXPLAIN (ANALYZE, BUFFERS)`` plan, as
+``catalog.models.SlowQuery`` records. Explaining them runs the queries
+again, so a background thread does it after the response has been returned;
+samples are dropped while ``MAX_QUEUED_SLOW_QUERIES`` are waiting.
+
+The log line also counts the database connections opened during the request
+and, when ``DATABASE_POOL`` is enabled, the state of the connection pool at
+the end of the request, and it shows the calls to metadata services that
+were retried or rejected and the circuits that are open (see
+``catalog.upstream``).
+"""
+
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import close_old_connections, connections, transaction
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+QuerySample = namedtuple('QuerySample', ('alias', 'sql', 'params', 'duration'))
+
+# upper bound on the number of slow queries sampled from a single request
+MAX_SAMPLES_PER_REQUEST = 3
+
+# upper bound on the number of slow queries waiting to be explained and stored
+MAX_QUEUED_SLOW_QUERIES = 100
+
+# descriptions used in the Server-Timing header
+METRIC_DESCRIPTIONS = {
+    'db': 'Database',
+    'tpl': 'Templates',
+    'openlibrary': 'Open Library',
+    'covers': 'Open Library covers',
+    'classify': 'Classifier service',
+}
+
+
+class Metric:
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def add(self, duration: float):
+        self.count += 1
+        self.duration += duration
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+        self.metrics: dict[str, Metric] = {}
+        self.annotations: dict[str, Any] = {}
+        self.slow_queries: list[QuerySample] = []
+
+    def record(self, name: str, duration: float):
+        try:
+            metric = self.metrics[name]
+        except KeyError:
+            metric = self.metrics[name] = Metric()
+        metric.add(duration)
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    @property
+    def total(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def server_timing(self) -> str:
+        entries = []
+        for name, metric in self.metrics.items():
+            description = METRIC_DESCRIPTIONS.get(name, name)
+            entries.append(
+                f'{name};dur={metric.duration * 1000:.1f};desc="{description} ({metric.count})"'
+            )
+        entries.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(entries)
+
+    def log_fields(self) -> dict[str, Any]:
+        fields = {'total_ms': round(self.total * 1000, 1)}
+        for name, metric in self.metrics.items():
+            fields[f'{name}_count'] = metric.count
+            fields[f'{name}_ms'] = round(metric.duration * 1000, 1)
+        fields.update(self.annotations)
+        return fields
+
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar('request_metrics', default=None)
+
+
+def current() -> Optional[RequestMetrics]:
+    return _current.get()
+
+
+@contextmanager
+def timed(name: str):
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record(name, time.perf_counter() - start)
+
+
+def instrumented(name: str) -> Callable:
+    """Decorator version of ``timed()``."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**fields):
+    """Attach extra fields to the log line of the current request."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.annotations.update(fields)
+
+
+class QueryTimer:
+    """Database execute wrapper that counts and times the queries made while
+    handling an instrumented request, and keeps a sample of the SELECT
+    queries slower than ``SLOW_QUERY_THRESHOLD``.
+
+    One is installed on every database connection; it looks up the current
+    request's metrics itself, so it also sees queries that async views run
+    in worker threads."""
+
+    def __init__(self, alias: str):
+        self.alias = alias
+        if settings.SLOW_QUERY_THRESHOLD is not None:
+            self.slow_threshold = settings.SLOW_QUERY_THRESHOLD / 1000
+        else:
+            self.slow_threshold = None
+        self.sample_rate = settings.SLOW_QUERY_SAMPLE_RATE
+
+    def __call__(self, execute, sql, params, many, context):
+        metrics = _current.get()
+        if metrics is None:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            metrics.record('db', duration)
+            if self.slow_threshold is not None and duration >= self.slow_threshold and not many:
+                self.sample(metrics, sql, params, duration)
+
+    def sample(self, metrics: RequestMetrics, sql, params, duration):
+        if len(metrics.slow_queries) >= MAX_SAMPLES_PER_REQUEST:
+            return
+        if not sql.lstrip()[:6].upper() == 'SELECT':
+            # EXPLAIN ANALYZE executes the statement, so never sample writes
+            return
+        if random.random() >= self.sample_rate:
+            return
+        metrics.slow_queries.append(QuerySample(self.alias, sql, params, duration))
+
+
+def install_query_timer(connection, **kwargs):
+    # connection_created is sent again every time a connection is reopened
+    if not any(isinstance(wrapper, QueryTimer) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(QueryTimer(connection.alias))
+
+    # with a pool, this is sent for each connection taken from the pool
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.annotations['db_connects'] = metrics.annotations.get('db_connects', 0) + 1
+
+
+def pool_stats() -> dict[str, int]:
+    """Size, idle connections and waiting requests of the connection pools of this process."""
+    fields = {}
+    for alias, database in settings.DATABASES.items():
+        if not database.get('OPTIONS', {}).get('pool'):
+            continue
+        # the pools are shared by all threads, so this works from any thread
+        stats = connections[alias].pool.get_stats()
+        prefix = 'pool' if alias == 'default' else f'pool_{alias}'
+        fields[f'{prefix}_size'] = stats.get('pool_size', 0)
+        fields[f'{prefix}_available'] = stats.get('pool_available', 0)
+        fields[f'{prefix}_waiting'] = stats.get('requests_waiting', 0)
+    return fields
+
+
+def circuit_states() -> dict[str, str]:
+    """The state of the circuits of the metadata services that aren't closed."""
+    from catalog import upstream
+
+    return upstream.circuit_states()
+
+
+def explain(alias: str, sql: str, params) -> str:
+    """Run ``EXPLAIN (ANALYZE, BUFFERS)`` for a query and return the plan.
+
+    Only PostgreSQL is supported; for other databases this returns an
+    empty string. The statement is run in its own transaction, bounded by
+    ``SLOW_QUERY_EXPLAIN_TIMEOUT``."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return ''
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        cursor.execute(f'SET LOCAL statement_timeout = {int(settings.SLOW_QUERY_EXPLAIN_TIMEOUT)}')
+        cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+def store_slow_query(sample: QuerySample, context: dict[str, str]):
+    from catalog.models import SlowQuery
+
+    try:
+        plan = explain(sample.alias, sample.sql, sample.params)
+    except Exception as e:
+        logger.warning('Unable to explain slow query: %s', e)
+        plan = ''
+    SlowQuery.record(
+        sql=sample.sql,
+        params=sample.params,
+        duration=sample.duration * 1000,
+        alias=sample.alias,
+        plan=plan,
+        **context,
+    )
+
+
+_slow_queries: queue.Queue = queue.Queue(MAX_QUEUED_SLOW_QUERIES)
+_slow_query_thread: Optional[threading.Thread] = None
+_slow_query_thread_lock = threading.Lock()
+
+
+def store_queued_slow_queries():
+    while True:
+        sample, context = _slow_queries.get()
+        try:
+            store_slow_query(sample, context)
+        except Exception:
+            logger.exception('Unable to store slow query')
+        finally:
+            # like at the end of a request
+            close_old_connections()
+            _slow_queries.task_done()
+
+
+def queue_slow_queries(request, metrics: RequestMetrics):
+    """Queue the slow queries of a request, to be explained and stored by a background thread."""
+    global _slow_query_thread
+
+    with _slow_query_thread_lock:
+        if _slow_query_thread is None:
+            _slow_query_thread = threading.Thread(
+                target=store_queued_slow_queries, name='slow-queries', daemon=True,
+            )
+            _slow_query_thread.start()
+
+    match = request.resolver_match
+    context = {
+        'view': match.view_name if match else '',
+        'path': request.get_full_path(),
+        'filters': metrics.annotations.get('filters', ''),
+    }
+    for sample in metrics.slow_queries:
+        try:
+            _slow_queries.put_nowait((sample, context))
+        except queue.Full:
+            logger.warning('Dropping slow query samples, %d are waiting already', MAX_QUEUED_SLOW_QUERIES)
+            break
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('tpl'):
+            return super().render(context, request)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend whose templates report their rendering time.
+
+    Only top-level renders are timed; includes and inclusion tags are part
+    of the template that uses them."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name).template, self)
+
+
+def format_log_value(value: Any) -> str:
+    value = str(value)
+    if not value or any(c in value for c in ' "='):
+        return json.dumps(value)
+    return value
+
+
+def format_log_line(fields: dict[str, Any]) -> str:
+    return ' '.join(f'{key}={format_log_value(value)}' for key, value in fields.items())
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.slow_threshold = settings.SLOW_REQUEST_THRESHOLD / 1000
+
+        connection_created.connect(install_query_timer, dispatch_uid='install_query_timer')
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        metrics.finish()
+
+        self.report(request, response, metrics)
+        if metrics.slow_queries:
+            queue_slow_queries(request, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        metrics.finish()
+
+        self.report(request, response, metrics)
+        if metrics.slow_queries:
+            queue_slow_queries(request, metrics)
+        return response
+
+    def report(self, request, response, metrics: RequestMetrics):
+        response['Server-Timing'] = metrics.server_timing()
+
+        match = request.resolver_match
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else '-',
+            'status': response.status_code,
+            'slow': metrics.total >= self.slow_threshold,
+            **metrics.log_fields(),
+            **pool_stats(),
+            **circuit_states(),
+        }
+        level = logging.WARNING if fields['slow'] else logging.INFO
+        logger.log(level, format_log_line(fields), extra={'metrics': fields})
@@ -0,0 +1,288 @@
+"""
+On-demand profiling of single requests.
+
+A staff user can ask for a request to be profiled by adding a ``_profile``
+query parameter or an ``X-Profile`` header. The value picks the profiler:
+
+``sample`` (the default)
+    a sampling profiler that records the request's stacks every
+    ``PROFILE_SAMPLE_INTERVAL`` milliseconds; low overhead, statistical.
+``trace``
+    a deterministic profiler that records every Python function call and
+    return; exact, but it slows the request down considerably.
+
+Both produce a collapsed-stack file (one ``frame;frame;frame weight`` line
+per distinct stack, the input format of flamegraph.pl and speedscope) and
+a plain text summary of the top ``PROFILE_TOP_N`` functions, saved in
+``PROFILE_DIR``. The file names are returned in ``X-Profile-Stacks`` and
+``X-Profile-Summary`` response headers. When profiling was requested with
+the query parameter, the response body is replaced with the summary.
+
+Requests that don't ask for profiling only pay for a check of the query
+string and headers.
+
+When serving over ASGI, a profiled request is handled from a thread of its
+own, like a sync middleware does, so that asgiref runs the sync code of the
+request (sync views, ORM queries and template rendering) in that thread,
+which is recorded. The request's async code runs on the event loop, among
+other requests; it is recorded only while the loop runs the tasks of the
+profiled request, which are recognized by their context. Only one request
+at a time should be traced, since tracing replaces the profile function of
+the event loop thread.
+"""
+
+import asyncio
+import sys
+import threading
+from abc import ABC, abstractmethod
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from types import FrameType, CodeType
+from typing import Optional
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+# the profiler of the request that the current code runs for, in the request's context, which its
+# threads and tasks inherit
+_profiler: ContextVar[Optional['Profiler']] = ContextVar('profiler', default=None)
+
+
+def frame_label(code: CodeType, module: str) -> str:
+    return f'{module}.{code.co_qualname}'
+
+
+class Profiler(ABC):
+    def __init__(self, root: CodeType):
+        # frames above the root (the server and middleware) are left out of the stacks
+        self.root = root
+        self.stacks = Counter()
+        # unit of the stack weights, for the summary
+        self.unit = 'samples'
+
+    @abstractmethod
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """Start recording the current thread; if it runs an event loop, only while that runs
+        the tasks of the profiled request."""
+
+    @abstractmethod
+    def stop(self):
+        """Stop recording the current thread."""
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {weight}\n' for stack, weight in self.stacks.most_common())
+
+    def summary(self, top: int) -> str:
+        total = sum(self.stacks.values()) or 1
+        inclusive = Counter()
+        exclusive = Counter()
+        for stack, weight in self.stacks.items():
+            frames = stack.split(';')
+            exclusive[frames[-1]] += weight
+            for frame in set(frames):
+                inclusive[frame] += weight
+
+        lines = [f'{total} {self.unit} in {len(self.stacks)} distinct stacks', '']
+        for title, counter in (('Inclusive', inclusive), ('Self', exclusive)):
+            lines.append(f'Top {top} functions by {title.lower()} {self.unit}:')
+            for label, weight in counter.most_common(top):
+                lines.append(f'{weight:>10} {weight / total:>7.1%}  {label}')
+            lines.append('')
+        return '\n'.join(lines)
+
+
+class SamplingProfiler(Profiler):
+    def __init__(self, root: CodeType, interval: float):
+        super().__init__(root)
+        self.interval = interval
+        # the recorded threads, with the event loop that each runs, if any
+        self.threads: dict[int, Optional[asyncio.AbstractEventLoop]] = {}
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        self.threads[threading.get_ident()] = loop
+        if not self.thread.is_alive():
+            self.thread.start()
+
+    def stop(self):
+        self.threads.pop(threading.get_ident(), None)
+        # sampling ends with the last recorded thread
+        if not self.threads:
+            self.stopping.set()
+            self.thread.join()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, loop in list(self.threads.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                if loop is None:
+                    self.sample(frame, self.root)
+                    continue
+                task = asyncio.current_task(loop)
+                if task is not None and task.get_context().get(_profiler) is self:
+                    # the stack of the task, from the coroutine it runs
+                    root = getattr(task.get_coro(), 'cr_code', None)
+                    if root is not None:
+                        self.sample(frame, root)
+
+    def sample(self, frame: Optional[FrameType], root: CodeType):
+        labels = []
+        while frame is not None:
+            labels.append(frame_label(frame.f_code, frame.f_globals.get('__name__', '?')))
+            if frame.f_code is root:
+                break
+            frame = frame.f_back
+        else:
+            # the request isn't inside the profiled call (yet, or any more)
+            return
+        self.stacks[';'.join(reversed(labels))] += 1
+
+
+class TracingProfiler(Profiler):
+    def __init__(self, root: CodeType):
+        super().__init__(root)
+        self.unit = 'microseconds'
+        # the stack and the time of the last event, of each recorded thread
+        self.local = threading.local()
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        self.local.stack = []
+        self.local.last = time.perf_counter()
+        sys.setprofile(self.trace)
+
+    def stop(self):
+        sys.setprofile(None)
+
+    def trace(self, frame: FrameType, event: str, arg):
+        # leaves out the other requests, whose tasks the event loop thread runs too
+        if _profiler.get() is not self:
+            return
+        now = time.perf_counter()
+        local = self.local
+        stack = local.stack
+        if stack:
+            self.stacks[';'.join(stack)] += round((now - local.last) * 1_000_000)
+        if event == 'call':
+            stack.append(frame_label(frame.f_code, frame.f_globals.get('__name__', '?')))
+        elif event == 'c_call':
+            name = getattr(arg, '__qualname__', None) or getattr(arg, '__name__', repr(arg))
+            stack.append(f'{getattr(arg, "__module__", None) or "builtins"}.{name}')
+        elif event in ('return', 'c_return', 'c_exception') and stack:
+            stack.pop()
+        local.last = time.perf_counter()
+
+
+def profile_mode(request) -> Optional[str]:
+    if PROFILE_HEADER in request.META:
+        return request.META[PROFILE_HEADER] or 'sample'
+    if PROFILE_PARAM in request.META.get('QUERY_STRING', ''):
+        if PROFILE_PARAM in request.GET:
+            return request.GET[PROFILE_PARAM] or 'sample'
+    return None
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        mode = profile_mode(request)
+        if mode is None or not request.user.is_staff:
+            return self.get_response(request)
+
+        profiler = self.make_profiler(mode, self.profile.__code__)
+        token = _profiler.set(profiler)
+        profiler.start()
+        try:
+            response = self.profile(request)
+        finally:
+            profiler.stop()
+            _profiler.reset(token)
+        return self.finish(request, response, profiler)
+
+    async def __acall__(self, request):
+        mode = profile_mode(request)
+        if mode is None or not await sync_to_async(lambda: request.user.is_staff)():
+            return await self.get_response(request)
+
+        profiler = self.make_profiler(mode, self.profile_thread.__code__)
+        token = _profiler.set(profiler)
+        profiler.start(asyncio.get_running_loop())
+        try:
+            response = await sync_to_async(self.profile_thread)(request, profiler)
+        finally:
+            profiler.stop()
+            _profiler.reset(token)
+        return await sync_to_async(self.finish)(request, response, profiler)
+
+    @staticmethod
+    def make_profiler(mode: str, root: CodeType) -> Profiler:
+        if mode == 'trace':
+            return TracingProfiler(root)
+        else:
+            return SamplingProfiler(root, settings.PROFILE_SAMPLE_INTERVAL / 1000)
+
+    def profile(self, request):
+        response = self.get_response(request)
+        # render lazy responses here, so that template rendering is included
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        return response
+
+    def profile_thread(self, request, profiler: Profiler):
+        # the thread-sensitive code that the request runs, such as sync views, runs in this thread
+        # while it waits for the request
+        profiler.start()
+        try:
+            return async_to_sync(self.aprofile)(request)
+        finally:
+            profiler.stop()
+
+    async def aprofile(self, request):
+        response = await self.get_response(request)
+        if hasattr(response, 'render') and callable(response.render):
+            await sync_to_async(response.render)()
+        return response
+
+    def finish(self, request, response, profiler: Profiler):
+        stacks_file, summary_file = self.save(request, profiler)
+        if PROFILE_HEADER not in request.META:
+            response = HttpResponse(summary_file.read_text(), content_type='text/plain; charset=utf-8')
+        response['X-Profile-Stacks'] = stacks_file.name
+        response['X-Profile-Summary'] = summary_file.name
+        return response
+
+    def save(self, request, profiler: Profiler) -> tuple[Path, Path]:
+        directory = Path(settings.PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        name = f'{datetime.now():%Y%m%d-%H%M%S-%f}-{view_name}'
+
+        stacks_file = directory / f'{name}.collapsed'
+        stacks_file.write_text(profiler.collapsed())
+
+        summary = f'{request.method} {request.get_full_path()}\n\n' + profiler.summary(settings.PROFILE_TOP_N)
+        summary_file = directory / f'{name}.txt'
+        summary_file.write_text(summary)
+        return stacks_file, summary_file
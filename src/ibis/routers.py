@@ -0,0 +1,126 @@
+"""
+Routing of reads to read replicas.
+
+When ``DATABASE_REPLICA_URLS`` lists one or more replicas of the default
+database, ``ReplicaRouter`` sends the reads made while handling a request to
+a randomly chosen replica, and everything else to the primary (``default``):
+writes, reads in a transaction, and all queries made outside a request, such
+as in management commands.
+
+Replicas lag behind the primary, so reads stick to the primary to make sure
+a client always sees its own writes:
+
+- for the rest of a request once it has written anything;
+- for the whole of a request with an unsafe method (a POST, such as a bulk
+  edit, an import or an inline field edit), as it usually reads what it is
+  about to change;
+- for ``REPLICA_STICKINESS`` seconds after a client's last write, through a
+  cookie set by ``ReplicaMiddleware``.
+"""
+
+import random
+from contextvars import ContextVar
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY_COOKIE = 'ibis_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class RoutingState:
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned: bool):
+        # read from the primary
+        self.pinned = pinned
+        # something was written to the primary
+        self.wrote = False
+
+
+_state: ContextVar[Optional[RoutingState]] = ContextVar('routing_state', default=None)
+
+
+def replicas() -> list[str]:
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.replicas = replicas()
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.pinned or not self.replicas:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """Tracks the reads and writes of each request for ``ReplicaRouter``,
+    and keeps a client's reads on the primary for a while after it wrote."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state = RoutingState(pinned=self.pin(request))
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=self.pin(request))
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(request, response, state)
+
+    @staticmethod
+    def pin(request) -> bool:
+        return request.method not in SAFE_METHODS or PRIMARY_COOKIE in request.COOKIES
+
+    @staticmethod
+    def finish(request, response, state: RoutingState):
+        if state.wrote or request.method not in SAFE_METHODS:
+            response.set_cookie(
+                PRIMARY_COOKIE, '1',
+                max_age=settings.REPLICA_STICKINESS,
+                secure=request.is_secure(),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -0,0 +1,306 @@
+"""
+Pre-forking WSGI server for ibis.
+
+The parent process sets up Django, loads the application and warms it up
+(imports the URLconf and views, compiles all templates) before it opens the
+listening socket and forks the worker processes, so workers share the
+warmed-up memory and accept traffic as soon as they start. Each worker
+serves the shared socket with waitress, with its own pool of threads.
+
+Options can be given on the command line or in environment variables::
+
+    ibis --workers 4 --threads 8
+    SERVER_WORKERS=4 SERVER_THREADS=8 python -m ibis.server
+
+Signals handled by the parent process:
+
+``TERM``, ``INT``
+    graceful shutdown: workers stop accepting connections and shut down
+    waitress, which gives the requests in progress a few seconds to finish
+    and cancels the ones still queued; workers that haven't exited after
+    ``--graceful-timeout`` seconds are killed.
+``HUP``
+    graceful restart: a new set of workers is started, then the old ones
+    are shut down gracefully. The new workers are forked from the parent
+    too, so they run the code it loaded when it started: deploying new code
+    needs a full restart of the server.
+``TTIN``, ``TTOU``
+    add or remove a worker.
+
+Workers that die are replaced.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from pathlib import Path
+
+# named explicitly, as this module is usually run as __main__
+logger = logging.getLogger('ibis.server')
+
+# for reporting the startup time
+STARTED = time.perf_counter()
+
+
+def env_default(name: str, default, cast=str):
+    value = os.environ.get(name)
+    return cast(value) if value else default
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='ibis', description='Serve ibis with pre-forked waitress workers.')
+    parser.add_argument(
+        '--host', default=env_default('SERVER_HOST', '0.0.0.0'),
+        help='Address to listen on (SERVER_HOST, default: %(default)s).',
+    )
+    parser.add_argument(
+        '--port', type=int, default=env_default('SERVER_PORT', 8000, int),
+        help='Port to listen on (SERVER_PORT, default: %(default)s).',
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=env_default('SERVER_WORKERS', os.cpu_count() or 1, int),
+        help='Number of worker processes (SERVER_WORKERS, default: the number of CPUs, %(default)s).',
+    )
+    parser.add_argument(
+        '-t', '--threads', type=int, default=env_default('SERVER_THREADS', 4, int),
+        help='Number of request threads per worker (SERVER_THREADS, default: %(default)s).',
+    )
+    parser.add_argument(
+        '--backlog', type=int, default=env_default('SERVER_BACKLOG', 1024, int),
+        help='Maximum number of connections waiting to be accepted (SERVER_BACKLOG, default: %(default)s).',
+    )
+    parser.add_argument(
+        '--connection-limit', type=int, default=env_default('SERVER_CONNECTION_LIMIT', 100, int),
+        help='Maximum number of open connections per worker (SERVER_CONNECTION_LIMIT, default: %(default)s).',
+    )
+    parser.add_argument(
+        '--channel-timeout', type=int, default=env_default('SERVER_CHANNEL_TIMEOUT', 120, int),
+        help='Seconds after which an idle connection is closed (SERVER_CHANNEL_TIMEOUT, default: %(default)s).',
+    )
+    parser.add_argument(
+        '--graceful-timeout', type=float, default=env_default('SERVER_GRACEFUL_TIMEOUT', 30, float),
+        help='Seconds after which a stopping worker is killed '
+             '(SERVER_GRACEFUL_TIMEOUT, default: %(default)s).',
+    )
+    parser.add_argument(
+        '--no-warmup', dest='warmup', action='store_false',
+        help="Don't import views and compile templates before starting the workers.",
+    )
+    return parser.parse_args(argv)
+
+
+def warm_up():
+    """Import everything a request needs, so that workers don't each do it on their first requests."""
+    from django.template import engines, TemplateSyntaxError
+    from django.urls import get_resolver
+
+    # resolving the URLconf imports the views, and with them the rest of the apps' code
+    get_resolver().url_patterns
+
+    # compile every template, so it is in the cached template loader of each worker
+    count = 0
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            directory = Path(directory)
+            for path in directory.rglob('*'):
+                if not path.is_file():
+                    continue
+                try:
+                    engine.get_template(path.relative_to(directory).as_posix())
+                except (TemplateSyntaxError, UnicodeDecodeError) as e:
+                    logger.debug('Not warming up template %s: %s', path, e)
+                else:
+                    count += 1
+    return count
+
+
+def load_application(warmup: bool = True):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ibis.settings')
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connections
+
+    start = time.perf_counter()
+    application = get_wsgi_application()
+    if warmup:
+        templates = warm_up()
+        logger.info('Warmed up in %.0f ms (%d templates compiled)', (time.perf_counter() - start) * 1000, templates)
+
+    # workers must not share the parent's database connections
+    connections.close_all()
+    for connection in connections.all():
+        if connection.settings_dict['OPTIONS'].get('pool'):
+            connection.close_pool()
+    return application
+
+
+class Worker:
+    """A worker process serving the shared socket with waitress."""
+
+    def __init__(self, application, sock: socket.socket, options: argparse.Namespace):
+        from waitress.server import create_server
+
+        self.parent = os.getppid()
+        self.server = create_server(
+            application,
+            sockets=[sock],
+            threads=options.threads,
+            backlog=options.backlog,
+            connection_limit=options.connection_limit,
+            channel_timeout=options.channel_timeout,
+            ident='ibis',
+        )
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        # the parent is sent SIGINT along with the workers when it runs in a terminal
+        signal.signal(signal.SIGINT, self.stop)
+        for signum in (signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(signum, signal.SIG_IGN)
+        threading.Thread(target=self.watch_parent, name='watch-parent', daemon=True).start()
+
+        # serves until stop() interrupts it; waitress then shuts down its threads, after
+        # they finish the requests they're running
+        self.server.run()
+        self.server.close()
+
+    def stop(self, signum, frame):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_IGN)
+        raise SystemExit
+
+    def watch_parent(self):
+        while os.getppid() == self.parent:
+            time.sleep(1)
+        logger.warning('Worker %d lost its parent process, stopping', os.getpid())
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+class Arbiter:
+    """The parent process: starts, replaces and stops the workers."""
+
+    def __init__(self, application, options: argparse.Namespace):
+        self.application = application
+        self.options = options
+        self.workers: dict[int, int] = {}  # pid -> generation
+        self.generation = 0
+        self.size = options.workers
+        self.signals: list[int] = []
+        self.socket = socket.create_server(
+            (options.host, options.port),
+            family=socket.AF_INET6 if ':' in options.host else socket.AF_INET,
+            backlog=options.backlog,
+        )
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = self.generation
+            return
+        status = 0
+        try:
+            Worker(self.application, self.socket, self.options).run()
+        except BaseException:
+            logger.exception('Worker %d failed', os.getpid())
+            status = 1
+        finally:
+            logging.shutdown()
+            os._exit(status)
+
+    def current_workers(self) -> list[int]:
+        return [pid for pid, generation in self.workers.items() if generation == self.generation]
+
+    def manage_workers(self):
+        current = self.current_workers()
+        for _ in range(self.size - len(current)):
+            self.spawn()
+        for pid in current[self.size:]:
+            self.kill(pid, signal.SIGTERM)
+
+    def kill(self, pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if not pid:
+                return
+            generation = self.workers.pop(pid, None)
+            if generation == self.generation and status:
+                logger.warning('Worker %d exited unexpectedly (status %d), replacing it', pid, status)
+
+    def handle_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def run(self):
+        host, port = self.socket.getsockname()[:2]
+        logger.info(
+            'Serving on http://%s:%d with %d workers of %d threads, %.0f ms after starting',
+            host, port, self.size, self.options.threads, (time.perf_counter() - STARTED) * 1000,
+        )
+        # objects created so far are shared with the workers; keeping the garbage
+        # collector away from them avoids copying their memory pages into each worker
+        gc.freeze()
+
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU, signal.SIGCHLD):
+            signal.signal(signum, self.handle_signal)
+
+        self.manage_workers()
+        while True:
+            # sleep until a signal arrives (or a second has passed, to check on the workers)
+            time.sleep(1)
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    return self.stop()
+                if signum == signal.SIGHUP:
+                    self.restart()
+                elif signum == signal.SIGTTIN:
+                    self.size += 1
+                elif signum == signal.SIGTTOU and self.size > 1:
+                    self.size -= 1
+            self.reap()
+            self.manage_workers()
+
+    def restart(self):
+        logger.info('Restarting workers')
+        old = list(self.workers)
+        self.generation += 1
+        self.manage_workers()
+        for pid in old:
+            self.kill(pid, signal.SIGTERM)
+
+    def stop(self):
+        logger.info('Shutting down')
+        for pid in list(self.workers):
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.options.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        for pid in list(self.workers):
+            logger.warning('Worker %d did not stop in time, killing it', pid)
+            self.kill(pid, signal.SIGKILL)
+        self.reap()
+        self.socket.close()
+
+
+def run(argv=None):
+    options = parse_args(argv)
+    application = load_application(options.warmup)
+    Arbiter(application, options).run()
+
+
+if __name__ == '__main__':
+    run()
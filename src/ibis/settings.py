@@ -17,7 +17,36 @@ import environ
 # set casting, default value for environment variables
 env = environ.Env(
     ALLOWED_HOSTS=(list, ['localhost']),
-    DEBUG=(bool, False)
+    DEBUG=(bool, False),
+    STATIC_MANIFEST_FALLBACK=bool,
+    DATABASE_POOL=(bool, False),
+    DATABASE_POOL_MIN_SIZE=(int, 2),
+    DATABASE_POOL_MAX_SIZE=(int, 10),
+    DATABASE_POOL_TIMEOUT=(float, 10),
+    DATABASE_CONN_MAX_AGE=(int, 0),
+    DATABASE_CONN_HEALTH_CHECKS=(bool, True),
+    DATABASE_REPLICA_URLS=(list, []),
+    REPLICA_STICKINESS=(int, 10),
+    INSTRUMENTATION=(bool, False),
+    SLOW_REQUEST_THRESHOLD=(float, 1000),
+    SLOW_QUERY_THRESHOLD=(float, None),
+    SLOW_QUERY_SAMPLE_RATE=(float, 1.0),
+    SLOW_QUERY_EXPLAIN_TIMEOUT=(int, 10000),
+    SLOW_QUERY_STORE_SIZE=(int, 500),
+    PROFILE_SAMPLE_INTERVAL=(float, 1),
+    PROFILE_TOP_N=(int, 30),
+    LOG_LEVEL=(str, 'INFO'),
+    OPENLIBRARY_CONCURRENCY=(int, 8),
+    OPENLIBRARY_TIMEOUT=(float, 10),
+    OPENLIBRARY_URL=(str, 'https://openlibrary.org'),
+    OPENLIBRARY_COVERS_URL=(str, 'https://covers.openlibrary.org'),
+    UPSTREAM_RATE=(float, 10),
+    UPSTREAM_BURST=(int, 20),
+    UPSTREAM_MAX_WAIT=(float, 5),
+    UPSTREAM_RETRIES=(int, 2),
+    UPSTREAM_BACKOFF=(float, 0.5),
+    UPSTREAM_FAILURE_THRESHOLD=(int, 5),
+    UPSTREAM_RESET_TIMEOUT=(float, 30),
 )
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,12 +80,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ibis.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'ibis.middleware.WhiteNoiseMiddleware',
+    'ibis.routers.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ibis.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -65,7 +97,7 @@ ROOT_URLCONF = 'ibis.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'ibis.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -80,6 +112,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'ibis.wsgi.application'
+ASGI_APPLICATION = 'ibis.asgi.application'
 
 
 # Database
@@ -89,6 +122,34 @@ DATABASES = {
     'default': env.db(),
 }
 
+# read replicas of the default database, as a comma-separated list of database URLs
+for number, url in enumerate(env('DATABASE_REPLICA_URLS'), start=1):
+    DATABASES[f'replica{number}'] = {**env.db_url_config(url), 'TEST': {'MIRROR': 'default'}}
+
+for database in DATABASES.values():
+    if env('DATABASE_POOL'):
+        # a pool of connections per server process, kept open between requests; this
+        # requires PostgreSQL with psycopg 3 and the psycopg-pool package
+        database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': env('DATABASE_POOL_MIN_SIZE'),
+            'max_size': env('DATABASE_POOL_MAX_SIZE'),
+            # seconds a request waits for a free connection before failing
+            'timeout': env('DATABASE_POOL_TIMEOUT'),
+        }
+    else:
+        # seconds a connection is kept open for the following requests (0 closes it after
+        # every request), checking that it is still usable before reusing it
+        database.setdefault('CONN_MAX_AGE', env('DATABASE_CONN_MAX_AGE'))
+        database.setdefault('CONN_HEALTH_CHECKS', env('DATABASE_CONN_HEALTH_CHECKS'))
+
+if len(DATABASES) > 1:
+    # reads in requests go to the replicas, unless the request or a recent one wrote
+    DATABASE_ROUTERS = ['ibis.routers.ReplicaRouter']
+
+# seconds after a write during which a client's reads keep going to the primary,
+# to cover the replication lag
+REPLICA_STICKINESS = env('REPLICA_STICKINESS')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -129,6 +190,27 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        # collectstatic (run when the image is built) adds a content hash to the file names and
+        # writes gzip and brotli compressed variants, which whitenoise serves with far-future caching
+        'BACKEND': 'ibis.storage.StaticFilesStorage',
+    },
+}
+
+# serve static files that are missing from the manifest of collectstatic by their original names,
+# found in the apps' static directories (see ibis.storage); for development, tests and servers
+# started for load tests, which don't run collectstatic. Off by default without DEBUG, as in a
+# deployment such a file wasn't collected
+STATIC_MANIFEST_FALLBACK = env('STATIC_MANIFEST_FALLBACK', default=DEBUG)
+WHITENOISE_USE_FINDERS = STATIC_MANIFEST_FALLBACK
+
+# turns STATIC_MANIFEST_FALLBACK on, as the tests don't run collectstatic either
+TEST_RUNNER = 'ibis.testing.TestRunner'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -138,3 +220,81 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+# Metadata services
+
+# base URLs for Open Library; override these to use a local fake server
+OPENLIBRARY_URL = env('OPENLIBRARY_URL')
+OPENLIBRARY_COVERS_URL = env('OPENLIBRARY_COVERS_URL')
+
+# maximum number of concurrent requests to Open Library from a single async view, and of
+# connections to each Open Library host from the threads of a process
+OPENLIBRARY_CONCURRENCY = env('OPENLIBRARY_CONCURRENCY')
+
+# timeout for requests to Open Library and the classifier service, in seconds
+OPENLIBRARY_TIMEOUT = env('OPENLIBRARY_TIMEOUT')
+
+# limits on the calls of each process to each metadata service (see catalog.upstream):
+# calls per second, with bursts of up to UPSTREAM_BURST calls; calls that would have to
+# wait longer than UPSTREAM_MAX_WAIT seconds for their turn fail instead
+UPSTREAM_RATE = env('UPSTREAM_RATE')
+UPSTREAM_BURST = env('UPSTREAM_BURST')
+UPSTREAM_MAX_WAIT = env('UPSTREAM_MAX_WAIT')
+
+# retries of a failed call, and the delay before the first of them, in seconds
+UPSTREAM_RETRIES = env('UPSTREAM_RETRIES')
+UPSTREAM_BACKOFF = env('UPSTREAM_BACKOFF')
+
+# after this many consecutive failures, calls to a service fail at once for
+# UPSTREAM_RESET_TIMEOUT seconds
+UPSTREAM_FAILURE_THRESHOLD = env('UPSTREAM_FAILURE_THRESHOLD')
+UPSTREAM_RESET_TIMEOUT = env('UPSTREAM_RESET_TIMEOUT')
+
+
+# Performance instrumentation
+
+# add Server-Timing headers and a log line with query and timing data to every response
+INSTRUMENTATION = env('INSTRUMENTATION')
+
+# requests that take longer than this (in milliseconds) are logged as warnings
+SLOW_REQUEST_THRESHOLD = env('SLOW_REQUEST_THRESHOLD')
+
+# SELECT queries that take longer than this (in milliseconds) are sampled and stored
+# with their query plan, for browsing in the admin; requires INSTRUMENTATION, unset to
+# turn off sampling
+SLOW_QUERY_THRESHOLD = env('SLOW_QUERY_THRESHOLD')
+
+# fraction of the slow queries that are sampled
+SLOW_QUERY_SAMPLE_RATE = env('SLOW_QUERY_SAMPLE_RATE')
+
+# statement timeout (in milliseconds) for running EXPLAIN ANALYZE on a sampled query
+SLOW_QUERY_EXPLAIN_TIMEOUT = env('SLOW_QUERY_EXPLAIN_TIMEOUT')
+
+# maximum number of slow query samples to keep; older samples are discarded
+SLOW_QUERY_STORE_SIZE = env('SLOW_QUERY_STORE_SIZE')
+
+# staff users can profile a request with a _profile query parameter or an X-Profile header;
+# the profiles are saved here
+PROFILE_DIR = env('PROFILE_DIR', default=BASE_DIR / 'profiles')
+
+# interval between stack samples of the sampling profiler, in milliseconds
+PROFILE_SAMPLE_INTERVAL = env('PROFILE_SAMPLE_INTERVAL')
+
+# number of functions listed in profile summaries
+PROFILE_TOP_N = env('PROFILE_TOP_N')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'ibis': {
+            'handlers': ['console'],
+            'level': env('LOG_LEVEL'),
+        },
+    },
+}
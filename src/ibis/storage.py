@@ -0,0 +1,21 @@
+from django.conf import settings
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """Manifest storage with compressed variants, which falls back to the
+    original name of a file that hasn't been collected when
+    ``STATIC_MANIFEST_FALLBACK`` is set.
+
+    This keeps pages rendering in development, tests and benchmarks without
+    running collectstatic first. The images built for deployment always
+    collect the static files, and a file missing from their manifest fails
+    the page rather than linking to a file that isn't served."""
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            if not settings.STATIC_MANIFEST_FALLBACK:
+                raise
+            return name
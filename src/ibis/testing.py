@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """Test runner for tests that render pages without running collectstatic
+    first, by serving static files from the apps (see ``STATIC_MANIFEST_FALLBACK``)."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.STATIC_MANIFEST_FALLBACK = True